@@ -1,36 +1,98 @@
 import argparse
+import glob
 import os
+import socket
 import sys
 import time
 from logging import StreamHandler
 from multiprocessing import freeze_support, set_start_method
 
+from mltd.models.migrations import start_deferred
+from mltd.models.query_tracer import (format_top, load_top, stats_path,
+                                      worker_stats_pattern)
 from mltd.models.setup import (check_database_version, cleanup, setup,
                                upgrade_database)
-from mltd.servers import api_server
-from mltd.servers.config import config
-from mltd.servers.logging import formatter, handler, logger
-from mltd.servers.process import CustomProcess
+from mltd.models.shards import shard_router
+from mltd.servers import api_server, asset_server, profiling
+from mltd.servers.config import api_port, config
+from mltd.servers.logging import add_handler, formatter, handler, logger
+from mltd.servers.process import CustomProcess, WorkerPool
 
 stream_handler = StreamHandler(sys.stdout)
 stream_handler.setFormatter(formatter)
-logger.addHandler(stream_handler)
+add_handler(stream_handler)
 
 
-def start_server(reset=False):
+def start_server(reset=False, workers=1):
     if reset or not os.path.isfile('mltd-relive.db'):
         reset_data()
-    upgrade_database()
+    deferred_migrations = upgrade_database(config.online_migrations)
+    shard_router.ensure_shards()
+    if deferred_migrations:
+        start_deferred(deferred_migrations)
+    # Statistics of the workers of a previous run
+    for stats_file in (glob.glob(worker_stats_pattern)
+                       + glob.glob(profiling.worker_stats_pattern)):
+        os.remove(stats_file)
 
     handler.doRollover()
     logger.info(f'Starting server...')
+    if workers > 1:
+        start_workers(workers)
+        return
     api_process = CustomProcess(target=api_server.start, daemon=True)
     api_process.start()
+    # Assets are served from a separate process so that asset downloads
+    # do not hold up API requests.
+    asset_process = CustomProcess(target=asset_server.start, daemon=True)
+    asset_process.start()
 
-    while not api_process.is_ready():
+    while not (api_process.is_ready() and asset_process.is_ready()):
         time.sleep(0.2)
     logger.info(f'Server started.')
     api_process.join()
+    asset_process.join()
+
+
+def start_workers(workers):
+    """Start API worker processes and supervise them until Ctrl+C."""
+    sock = socket.create_server(('', api_port))
+    api_pool = WorkerPool(api_server.start_worker, workers, sock=sock)
+    api_pool.start()
+    asset_process = CustomProcess(target=asset_server.start, daemon=True)
+    asset_process.start()
+
+    while not (api_pool.is_ready() and asset_process.is_ready()):
+        time.sleep(0.2)
+    logger.info(f'Server started with {workers} API workers.')
+    try:
+        while True:
+            api_pool.supervise()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info('Stopping API workers...')
+        api_pool.stop()
+        sock.close()
+        logger.info('Server stopped.')
+
+
+def print_top_queries(n):
+    try:
+        rows = load_top(n)
+    except FileNotFoundError:
+        print(f'{stats_path} not found. Set query_trace = True in '
+              f'config.ini and start the server first.')
+        return
+    print(format_top(rows))
+
+
+def print_profile():
+    try:
+        stages, slowest = profiling.load_profile()
+    except FileNotFoundError:
+        print('No profile found. Start the server and play a song first.')
+        return
+    print(profiling.format_profile(stages, slowest))
 
 
 def reset_data():
@@ -40,6 +102,7 @@ def reset_data():
         if decision.upper() != 'Y':
             exit()
         cleanup()
+        shard_router.remove_shards()
         logger.info('Dropped all tables.')
 
     handler.doRollover()
@@ -57,6 +120,17 @@ if __name__ == '__main__':
                         help='reset data')
     parser.add_argument('-c', '--config-only', action='store_true',
                         help='only update config; do not start server')
+    parser.add_argument('-q', '--top-queries', type=int, nargs='?',
+                        const=20, metavar='N',
+                        help='print the N SQL statements with the highest '
+                             'total time traced by the running server')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='print the stage timings of profiled service '
+                             'methods (e.g. LiveService.FinishSong) of the '
+                             'running server')
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+                        help='number of API worker processes (default: '
+                             'api_workers in config.ini)')
     args = parser.parse_args()
 
     config.is_local = True
@@ -64,7 +138,16 @@ if __name__ == '__main__':
         config.language = args.language
     if args.config_only:
         sys.exit()
-    start_server(args.reset)
+    if args.top_queries is not None:
+        print_top_queries(args.top_queries)
+        sys.exit()
+    if args.profile:
+        print_profile()
+        sys.exit()
+    workers = args.workers or config.api_workers
+    start_server(args.reset, workers)
+    if workers > 1:
+        sys.exit()
 
     try:
         while True:
@@ -1,9 +1,9 @@
-import time
-
 from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 
-from mltd.servers.logging import logger
+from mltd.models.query_tracer import query_tracer
+from mltd.servers.config import config
+from mltd.servers.profiling import stage_profiler
 
 engine = create_engine('sqlite+pysqlite:///mltd-relive.db')
 
@@ -12,21 +12,17 @@ engine = create_engine('sqlite+pysqlite:///mltd-relive.db')
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute('PRAGMA foreign_keys=ON')
+    # Readers do not block the writer and vice versa, which lets API
+    # worker processes share the database.
+    cursor.execute('PRAGMA journal_mode=WAL')
     cursor.close()
 
 
 @event.listens_for(Engine, 'before_cursor_execute')
 def before_cursor_execute(conn, cursor, statement,
                           parameters, context, executemany):
-    conn.info.setdefault('query_start_time', []).append(time.perf_counter_ns())
-    logger.debug(f'Start query: {statement}')
-    logger.debug(f'Parameters: {parameters}')
-
+    stage_profiler.count_statement()
 
-@event.listens_for(Engine, "after_cursor_execute")
-def after_cursor_execute(conn, cursor, statement,
-                         parameters, context, executemany):
-    total_ns = time.perf_counter_ns() - conn.info['query_start_time'].pop(-1)
-    logger.debug('Query complete!')
-    logger.debug(f'Query execution time: {total_ns // 1_000_000} ms')
 
+if config.query_trace:
+    query_tracer.enable(engine, config.slow_query_ms)
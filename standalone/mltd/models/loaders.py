@@ -0,0 +1,150 @@
+"""Loader profiles for ORM queries.
+
+Relationships in 'mltd.models.models' declare eager loading strategies
+suited to serializing whole objects, e.g. every User query joins four
+one-to-one tables and selectin-loads the top LPs, and every Card query
+selectin-loads its idol. A loader profile is a named list of loader
+options that a service applies to a single query to load only what the
+service uses.
+    select(User).options(*loader_profile('user-core'))
+Relationships that a profile does not load eagerly are loaded lazily on
+first access, so a profile only changes the number of statements and
+rows loaded, never the result.
+
+Running this module as a script counts the statements executed and the
+rows loaded by a sample query of each profile, with and without the
+profile.
+    python -m mltd.models.loaders [--user-id USER_ID]
+"""
+import argparse
+from collections import Counter
+from uuid import UUID
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, defaultload, joinedload, lazyload
+
+from mltd.models.engine import engine
+from mltd.models.models import Base, Card, GashaMedal, User
+
+# Every eagerly loaded relationship of User.
+_user_eager_relationships = [
+    User.challenge_song,
+    User.mission_summary,
+    User.map_level,
+    User.un_lock_song_status,
+    User.top_lps,
+]
+
+loader_profiles = {
+    # User columns only, for services that update vitality, money, etc.,
+    # and live services other than LiveService.FinishSong. The pending
+    # song is loaded lazily: joining it also joins its guest profile and
+    # cards, which is slower than a separate query.
+    'user-core': [lazyload(x) for x in _user_eager_relationships],
+    # Everything serialized by UserSchema, and the gasha medal and cards
+    # of LiveService.FinishSong. The cards are only counted, so their
+    # idols are not loaded.
+    'live-finish': [
+        joinedload(User.gasha_medal)
+        .selectinload(GashaMedal.gasha_medal_expire_dates),
+        defaultload(User.cards).lazyload(Card.idol),
+    ],
+    # Everything serialized by CardSchema.
+    'card-list': [lazyload(Card.idol)],
+}
+
+
+def loader_profile(name):
+    """Get the loader options of a profile.
+
+    Args:
+        name: Name of the profile. See 'loader_profiles' for available
+              profiles.
+    Returns:
+        A list of loader options to be passed to options().
+    """
+    return loader_profiles[name]
+
+
+def _samples(user_id):
+    """Sample queries of each profile.
+
+    Returns:
+        A list of tuples (profile, statement, touch), where touch is a
+        function accessing what the services using the profile access on
+        each result.
+    """
+    def touch_pending_song(user):
+        return user.pending_song and user.pending_song.song
+
+    return [
+        ('user-core',
+         select(User).where(User.user_id == user_id),
+         touch_pending_song),
+        ('live-finish',
+         select(User).where(User.user_id == user_id),
+         lambda user: (touch_pending_song(user), user.top_lps,
+                       user.challenge_song, user.map_level,
+                       user.gasha_medal
+                       and user.gasha_medal.gasha_medal_expire_dates,
+                       len(user.cards), len(user.costumes))),
+        ('card-list',
+         select(Card).where(Card.user_id == user_id),
+         lambda card: card.mst_card.mst_costume),
+    ]
+
+
+def count_loads(user_id):
+    """Count statements and rows loaded by sample queries of each profile.
+
+    Args:
+        user_id: User ID in UUID format.
+    Returns:
+        A list of dicts containing the following keys: profile,
+        default_statements, default_rows, profile_statements and
+        profile_rows.
+    """
+    statements = Counter()
+    rows = Counter()
+
+    def count_statement(*args):
+        statements['total'] += 1
+
+    def count_row(target, context):
+        rows['total'] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    event.listen(Base, 'load', count_row, propagate=True)
+    try:
+        results = []
+        for profile, statement, touch in _samples(user_id):
+            counts = {'profile': profile}
+            for prefix, options in [('default', []),
+                                    ('profile', loader_profile(profile))]:
+                statements.clear()
+                rows.clear()
+                with Session(engine) as session:
+                    for obj in session.scalars(statement.options(*options)):
+                        touch(obj)
+                counts[f'{prefix}_statements'] = statements['total']
+                counts[f'{prefix}_rows'] = rows['total']
+            results.append(counts)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+        event.remove(Base, 'load', count_row)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Count rows loaded by each loader profile.')
+    parser.add_argument('--user-id',
+                        default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                        help='user ID in UUID format')
+    args = parser.parse_args()
+    for counts in count_loads(UUID(args.user_id)):
+        print(f'{counts["profile"]}: '
+              f'{counts["default_statements"]} statements/'
+              f'{counts["default_rows"]} rows by default, '
+              f'{counts["profile_statements"]} statements/'
+              f'{counts["profile_rows"]} rows with profile')
@@ -0,0 +1,453 @@
+"""Chunked, resumable data migrations.
+
+upgrade_database() in 'mltd.models.setup' used to run each version step
+in a single transaction, which holds the SQLite write lock for as long
+as the step takes to update the rows of every user. Each step is now a
+Migration with up to three parts:
+    schema: changes to tables and master data, run in one transaction on
+            the main database.
+    user_schema: changes to per-user tables, run in one transaction on
+                 every database storing users (the main database or
+                 each shard), so that existing shards get new tables
+                 and columns too.
+    backfill: changes to the rows of a batch of users, run on every
+              database storing users (the main database or each shard,
+              see 'mltd.models.shards') in batches ordered by user ID.
+Each batch is committed together with a checkpoint in the table
+'migration_checkpoint', so the write lock is released between batches
+and an interrupted migration resumes after the last committed batch.
+The database version is set once every batch is done. Schema changes of
+a step with user schema changes or a backfill may run again when the
+step resumes, and
+backfills may run again for the users of a batch, so both must be safe
+to repeat (e.g. create tables with checkfirst=True, delete the rows of
+the batch before inserting them again).
+
+With 'online_migrations = True' in config.ini, the schema changes run at
+startup as before, but the backfills of steps marked 'online' run in a
+background thread of the console while the server is serving requests,
+pausing between batches so that requests get the write lock. Such
+backfills must give the same result for users whose rows were changed by
+requests while the migration was running.
+
+Running this module as a script migrates a synthetic database of N users
+with the v0.1.4 backfill (top LPs), interrupts the migration halfway,
+resumes it and checks the result against the single-statement
+migration.
+    python -m mltd.models.migrations [--users N] [--batch-size N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+
+from mltd.models.engine import engine
+from mltd.models.models import (LP, MigrationCheckpoint, MstSong,
+                                ServerVersion, TopLP, User)
+from mltd.models.shards import shard_router
+from mltd.servers.config import version_tuple
+from mltd.servers.logging import logger
+
+# Number of users migrated in each transaction
+batch_size = 1000
+# Seconds between progress messages
+progress_interval = 5
+
+
+class Migration:
+    """A step upgrading the database to a version."""
+
+    def __init__(self, version, schema=None, user_schema=None,
+                 backfill=None, online=False):
+        """Define a step.
+
+        Args:
+            version: Version the step upgrades the database to.
+            schema: A function taking a session, changing tables and
+                    master data. Run in one transaction on the main
+                    database.
+            user_schema: A function taking a session, changing per-user
+                         tables. Run in one transaction on each database
+                         storing users, after 'schema'. Per-user tables
+                         should be created with
+                         'shard_router.create_user_table()'.
+            backfill: A function taking a session and a list of user
+                      IDs, changing the rows of these users. Run in one
+                      transaction per batch of users.
+            online: Whether the backfill may run while the server is
+                    serving requests.
+        """
+        self.version = version
+        self.schema = schema
+        self.user_schema = user_schema
+        self.backfill = backfill
+        self.online = online or backfill is None
+
+
+class _Progress:
+    """Logs the progress of a backfill at most every few seconds."""
+
+    def __init__(self, migration, name, total, done):
+        self.migration = migration
+        self.name = name
+        self.total = total
+        self.start_done = done
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+
+    def report(self, done, final=False):
+        now = time.monotonic()
+        if not final and now - self.last_time < progress_interval:
+            return
+        self.last_time = now
+        rate = (done-self.start_done) / max(now - self.start_time, 1e-9)
+        message = (f'Migrating {self.name} to v{self.migration.version}: '
+                   f'{done}/{self.total} users')
+        if self.total:
+            message += f' ({done/self.total:.0%})'
+        message += f', {rate:.0f} users/s'
+        if not final and rate and self.total > done:
+            message += f', {(self.total-done)/rate:.0f} s remaining'
+        logger.info(message)
+
+
+def user_engines():
+    """Get the engines of the databases storing users.
+
+    Shards that have not been created yet are left out, since the users
+    are still in the main database and are copied after the migration.
+    """
+    if shard_router.enabled and all(
+            os.path.exists(path) for path in shard_router.paths()):
+        return shard_router.user_engines()
+    return [engine]
+
+
+def run_backfill(migration, user_engine, size=None, pause=0,
+                 stop_event=None):
+    """Run the backfill of a migration on a database storing users.
+
+    Resumes after the last batch committed by a previous run.
+    Args:
+        migration: A Migration with a backfill.
+        user_engine: Engine of the main database or of a shard.
+        size: Number of users in each batch, or None for 'batch_size'.
+        pause: Seconds to wait between batches.
+        stop_event: A threading.Event set to stop after the current
+                    batch.
+    Returns:
+        True if every user has been migrated, or False if stopped.
+    """
+    size = size or batch_size
+    name = os.path.basename(user_engine.url.database).split('?')[0]
+    with user_engine.begin() as connection:
+        # Created in the main database of a shard connection, since the
+        # attached main database of the server is read-only.
+        connection.execute(CreateTable(MigrationCheckpoint.__table__,
+                                       if_not_exists=True))
+    with Session(user_engine) as session:
+        total = session.scalar(select(func.count()).select_from(User))
+        checkpoint = session.get(MigrationCheckpoint, migration.version)
+        if checkpoint is None:
+            checkpoint = MigrationCheckpoint(version=migration.version)
+            session.add(checkpoint)
+            session.commit()
+        last_user_id = checkpoint.last_user_id
+        done = checkpoint.users_done
+    if done:
+        logger.info(f'Resuming migration of {name} to '
+                    f'v{migration.version} after {done} users')
+    progress = _Progress(migration, name, total, done)
+
+    while True:
+        if stop_event and stop_event.is_set():
+            logger.info(f'Migration of {name} to v{migration.version} '
+                        f'stopped after {done} users')
+            return False
+        with Session(user_engine) as session:
+            user_ids_stmt = (
+                select(User.user_id)
+                .order_by(User.user_id)
+                .limit(size)
+            )
+            if last_user_id:
+                user_ids_stmt = user_ids_stmt.where(
+                    User.user_id > last_user_id)
+            user_ids = session.scalars(user_ids_stmt).all()
+            if not user_ids:
+                break
+            migration.backfill(session, user_ids)
+            last_user_id = user_ids[-1]
+            done += len(user_ids)
+            session.execute(
+                update(MigrationCheckpoint)
+                .where(MigrationCheckpoint.version == migration.version)
+                .values(last_user_id=last_user_id, users_done=done,
+                        update_date=datetime.now(timezone.utc))
+            )
+            session.commit()
+        progress.report(done)
+        if pause:
+            time.sleep(pause)
+    progress.report(done, final=True)
+    return True
+
+
+def _set_version(session, version):
+    session.execute(
+        update(ServerVersion)
+        .values(version=version)
+    )
+
+
+def _finish(migration):
+    """Set the database version after the backfill of a migration."""
+    with Session(engine) as session:
+        _set_version(session, migration.version)
+        session.commit()
+    if migration.backfill:
+        for user_engine in user_engines():
+            with Session(user_engine) as session:
+                session.execute(
+                    delete(MigrationCheckpoint)
+                    .where(MigrationCheckpoint.version == migration.version)
+                )
+                session.commit()
+    logger.info(f'Database upgraded to v{migration.version}.')
+
+
+def migrate(migrations, db_version, online=False):
+    """Apply the migrations newer than the database version.
+
+    Args:
+        migrations: A list of Migrations in version order.
+        db_version: Current version of the database.
+        online: Whether to defer the backfills that may run while the
+                server is serving requests.
+    Returns:
+        A list of the Migrations whose backfills have been deferred, to
+        be passed to start_deferred() once the server is running.
+    """
+    pending = [x for x in migrations
+               if version_tuple(db_version) < version_tuple(x.version)]
+    # Versions are set in order, so only backfills of the last pending
+    # migrations can be deferred.
+    deferred_from = len(pending)
+    if online:
+        while deferred_from and pending[deferred_from-1].online:
+            deferred_from -= 1
+
+    for i, migration in enumerate(pending):
+        logger.info(f'Upgrading database to v{migration.version}...')
+        deferred = i >= deferred_from
+        # Otherwise the version is set once the databases storing users
+        # are migrated too.
+        set_version = not (migration.user_schema or migration.backfill
+                           or deferred)
+        with Session(engine) as session:
+            if migration.schema:
+                migration.schema(session)
+            if set_version:
+                _set_version(session, migration.version)
+            session.commit()
+        if migration.user_schema:
+            for user_engine in user_engines():
+                with Session(user_engine) as session:
+                    migration.user_schema(session)
+                    session.commit()
+        if deferred:
+            continue
+        if migration.backfill:
+            for user_engine in user_engines():
+                run_backfill(migration, user_engine)
+        if set_version:
+            logger.info(f'Database upgraded to v{migration.version}.')
+        else:
+            _finish(migration)
+    if pending[deferred_from:]:
+        logger.info('Data will be migrated while the server is running.')
+    return pending[deferred_from:]
+
+
+def run_deferred(migrations, pause=0.05, stop_event=None):
+    """Run deferred backfills and set the database version.
+
+    Args:
+        migrations: Migrations returned by migrate().
+        pause: Seconds to wait between batches, letting requests take
+               the write lock.
+        stop_event: A threading.Event set to stop after the current
+                    batch. Stopped migrations resume on the next start.
+    """
+    for migration in migrations:
+        if migration.backfill:
+            for user_engine in user_engines():
+                if not run_backfill(migration, user_engine, pause=pause,
+                                    stop_event=stop_event):
+                    return
+        _finish(migration)
+
+
+def start_deferred(migrations):
+    """Run deferred backfills in a daemon thread.
+
+    Returns:
+        The started thread.
+    """
+    def run():
+        try:
+            run_deferred(migrations)
+        except Exception:
+            logger.exception('Data migration failed, it will resume on '
+                             'the next start.')
+
+    thread = threading.Thread(target=run, name='migration', daemon=True)
+    thread.start()
+    return thread
+
+
+def _create_synthetic_database(path, users, songs_per_user, seed=0):
+    """Create a database containing users with LP lists.
+
+    Only the tables used by the top LP backfill are created, without
+    foreign keys. Master songs are copied from 'mltd-relive.db'.
+    """
+    rng = random.Random(seed)
+    synthetic_engine = create_engine(f'sqlite+pysqlite:///{path}')
+    with synthetic_engine.begin() as connection:
+        for model in (User, MstSong, LP, TopLP, MigrationCheckpoint):
+            connection.execute(CreateTable(
+                model.__table__, include_foreign_key_constraints=[]))
+        connection.exec_driver_sql(
+            "ATTACH DATABASE 'file:mltd-relive.db?mode=ro' AS source")
+        columns = ', '.join(f'"{x.name}"' for x in MstSong.__table__.c)
+        connection.exec_driver_sql(
+            f'INSERT INTO mst_song ({columns}) '
+            f'SELECT {columns} FROM source.mst_song')
+    with synthetic_engine.begin() as connection:
+        connection.exec_driver_sql('DETACH DATABASE source')
+        mst_song_ids = connection.scalars(
+            select(MstSong.mst_song_id)).all()
+        now = datetime.now(timezone.utc)
+        for start in range(0, users, 10_000):
+            user_ids = [uuid4() for _ in range(min(10_000, users-start))]
+            connection.execute(insert(User), [
+                {'user_id': user_id, 'search_id': f'{start+i:08X}',
+                 'user_id_hash': user_id.hex}
+                for i, user_id in enumerate(user_ids)])
+            connection.execute(insert(LP), [
+                {'user_id': user_id, 'mst_song_id': mst_song_id,
+                 'course': rng.randint(1, 6), 'lp': rng.randrange(1000),
+                 'is_playable': True, 'update_date': now}
+                for user_id in user_ids
+                for mst_song_id in rng.sample(mst_song_ids,
+                                              songs_per_user)])
+    return synthetic_engine
+
+
+def _top_lp_rows(connection):
+    return connection.execute(
+        select(TopLP.__table__)
+        .order_by(TopLP.user_id, TopLP.idol_type, TopLP.mst_song_id)
+    ).all()
+
+
+def test_backfill(users=100_000, size=1000, songs_per_user=30):
+    """Migrate a synthetic database, interrupting and resuming.
+
+    Args:
+        users: Number of users.
+        size: Number of users in each batch.
+        songs_per_user: Number of LP list entries of each user.
+    Returns:
+        True if the result is the same as the single-statement
+        migration.
+    """
+    from mltd.models.setup import migrations
+
+    migration = next(x for x in migrations if x.version == '0.1.4')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.db')
+        start = time.perf_counter()
+        synthetic_engine = _create_synthetic_database(path, users,
+                                                      songs_per_user)
+        print(f'Created {users} users with {songs_per_user} LPs each in '
+              f'{time.perf_counter()-start:.1f} s')
+
+        # Reference: all users in one transaction, as before.
+        start = time.perf_counter()
+        with Session(synthetic_engine) as session:
+            migration.backfill(session, None)
+            session.commit()
+        single_seconds = time.perf_counter() - start
+        with synthetic_engine.begin() as connection:
+            expected = _top_lp_rows(connection)
+            connection.execute(delete(TopLP))
+
+        batch_seconds = []
+        stop_event = threading.Event()
+
+        class TimedMigration(Migration):
+            def __init__(self, stop_after):
+                super().__init__(migration.version,
+                                 backfill=self.timed_backfill)
+                self.stop_after = stop_after
+
+            def timed_backfill(self, session, user_ids):
+                batch_start = time.perf_counter()
+                migration.backfill(session, user_ids)
+                batch_seconds.append(time.perf_counter() - batch_start)
+                if len(batch_seconds) == self.stop_after:
+                    stop_event.set()
+
+        batches = -(-users // size)
+        start = time.perf_counter()
+        finished = run_backfill(TimedMigration(batches // 2),
+                                synthetic_engine, size,
+                                stop_event=stop_event)
+        with Session(synthetic_engine) as session:
+            interrupted_done = session.get(MigrationCheckpoint,
+                                           migration.version).users_done
+        print(f'Interrupted: finished={finished}, {interrupted_done} users '
+              f'migrated')
+        stop_event.clear()
+        finished = run_backfill(TimedMigration(None), synthetic_engine,
+                                size, stop_event=stop_event)
+        batched_seconds = time.perf_counter() - start
+        with synthetic_engine.begin() as connection:
+            actual = _top_lp_rows(connection)
+            users_done = connection.scalar(
+                select(MigrationCheckpoint.users_done))
+        synthetic_engine.dispose()
+
+    print(f'Single transaction: {single_seconds:.2f} s holding the write '
+          f'lock')
+    print(f'Batches of {size}: {batched_seconds:.2f} s in '
+          f'{len(batch_seconds)} batches, longest batch '
+          f'{max(batch_seconds)*1000:.0f} ms')
+    passed = finished and users_done == users and actual == expected
+    print(f'Resumed: finished={finished}, {users_done} users migrated, '
+          f'{len(actual)} top LP rows '
+          f'{"match" if actual == expected else "DO NOT match"}')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test batched data migrations on a synthetic '
+                    'database.')
+    parser.add_argument('--users', type=int, default=100_000,
+                        help='number of users')
+    parser.add_argument('--batch-size', type=int, default=batch_size,
+                        help='number of users in each batch')
+    args = parser.parse_args()
+    raise SystemExit(0 if test_backfill(args.users, args.batch_size)
+                     else 1)
@@ -112,8 +112,10 @@ class User(Base):
     jewel: Mapped['Jewel'] = relationship(back_populates='user')
     profile: Mapped['Profile'] = relationship(back_populates='user')
     lps: Mapped[List['LP']] = relationship(
-        back_populates='user', lazy='selectin',
-        order_by='[LP.lp.desc(), LP.update_date]')
+        back_populates='user', order_by='[LP.lp.desc(), LP.update_date]')
+    top_lps: Mapped[List['TopLP']] = relationship(
+        back_populates='user', lazy='selectin', cascade='all, delete-orphan',
+        order_by='[TopLP.lp.desc(), TopLP.update_date]')
     songs: Mapped[List['Song']] = relationship(back_populates='user')
     courses: Mapped[List['Course']] = relationship(back_populates='user')
     cards: Mapped[List['Card']] = relationship(back_populates='user')
@@ -2384,6 +2386,39 @@ class LP(Base):
                                                innerjoin=True)
 
 
+class TopLP(Base):
+    """Top 10 song LPs of each idol type for each user.
+
+    A summary of the LP list that only keeps the 10 highest song LPs of
+    each idol type, which are the ones that count towards user LP. It is
+    updated incrementally whenever a song LP rises, so that user LP
+    lists can be served without loading all LP rows.
+    """
+    __tablename__ = 'top_lp'
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ['mst_song_id', 'course'],
+            ['mst_course.mst_song_id', 'mst_course.course_id']
+        ),
+    )
+
+    user_id = mapped_column(ForeignKey('user.user_id'), primary_key=True)
+    mst_song_id = mapped_column(ForeignKey('mst_song.mst_song_id'),
+                                primary_key=True)
+    idol_type: Mapped[int]
+    course: Mapped[int]
+    lp: Mapped[int]
+    is_playable: Mapped[bool] = mapped_column(default=True)
+    update_date: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+    user: Mapped['User'] = relationship(back_populates='top_lps')
+    mst_course: Mapped['MstCourse'] = relationship(
+        viewonly=True, lazy='joined', innerjoin=True)
+    mst_song: Mapped['MstSong'] = relationship(viewonly=True, lazy='joined',
+                                               innerjoin=True)
+
+
 class ChallengeSong(Base):
     """Daily challenge song for each user."""
     __tablename__ = 'challenge_song'
@@ -2804,6 +2839,22 @@ class LastUpdateDate(Base):
         default=datetime(1, 1, 1))
 
 
+class CollectionVersion(Base):
+    """Version counters of per-user collections.
+
+    collection: table name of the collection (e.g. card, item)
+    version: incremented whenever a row of the collection is inserted,
+             updated or deleted for the user. The nil UUID is used as
+             user_id for changes made by bulk statements, which may
+             affect any user.
+    """
+    __tablename__ = 'collection_version'
+
+    user_id: Mapped[UUID] = mapped_column(primary_key=True)
+    collection: Mapped[str] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+
 class MstBirthdayCalendar(Base):
     """Birthday calendar for all characters."""
     __tablename__ = 'mst_birthday_calendar'
@@ -2950,6 +3001,23 @@ class ServerVersion(Base):
     version: Mapped[str] = mapped_column(primary_key=True)
 
 
+class MigrationCheckpoint(Base):
+    """Progress of an unfinished data migration (custom table).
+
+    version: version the migration upgrades the database to.
+    last_user_id: the users are migrated in batches in the order of
+                  user_id, and all users up to this one are done.
+    users_done: number of users migrated so far.
+    """
+    __tablename__ = 'migration_checkpoint'
+
+    version: Mapped[str] = mapped_column(primary_key=True)
+    last_user_id: Mapped[Optional[UUID]] = mapped_column(default=None)
+    users_done: Mapped[int] = mapped_column(default=0)
+    update_date: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+
 if __name__ == '__main__':
     Base.metadata.create_all(engine)
 
@@ -0,0 +1,286 @@
+"""Progression tables of user levels and producer ranks.
+
+Leveling up used to be simulated one level at a time: required EXP grows
+by MstGameSetting.user_lv_base per level, max vitality and max friends
+grow on certain levels, and the rank reward was queried on every live.
+Instead, cumulative tables for levels 1-999 are built once from the
+master data, so that the level reached with a given amount of EXP, and
+the max vitality and max friends at that level, are bisect lookups.
+    progression = get_progression(session)
+    level, exp = progression.level_for_exp(user.level, user.exp + gain)
+Levels stop at the max level and any further EXP is kept.
+
+Running this module as a script checks the tables against the
+level-by-level rules from every level and benchmarks both.
+    python -m mltd.models.progression [--cases N] [--seed SEED]
+"""
+import argparse
+import copy
+import random
+import threading
+import time
+from bisect import bisect_right
+from itertools import accumulate
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from mltd.models.models import MstGameSetting, MstRewardItem
+from mltd.models.schemas import MstRewardItemSchema
+
+max_level = 999
+first_next_exp = 50
+first_max_vitality = 60
+first_max_friend = 50
+# Minimum theater fans for each producer rank (1-8).
+rank_requirements = [0, 1_000, 10_000, 50_000, 100_000, 300_000, 500_000,
+                     1_000_000]
+# {producer rank: (mst_item_id, amount) of the reward for reaching it}
+_rank_rewards = {1: (0, 0), 2: (3, 50), 3: (3, 50), 4: (3, 50), 5: (3, 50),
+                 6: (3, 50), 7: (3, 100), 8: (3, 150)}
+
+
+def _is_vitality_level(level):
+    """Whether max vitality increases by 1 when reaching a level."""
+    return (level <= 60 and level % 2 == 0
+            or 60 < level <= 150 and level % 3 == 0
+            or 150 < level <= 426 and level % 4 == 0
+            or 426 < level <= 586 and level % 5 == 1
+            or 586 < level <= 700 and level % 6 == 4)
+
+
+def _is_friend_level(level):
+    """Whether max friends increases by 1 when reaching a level."""
+    return level <= 151 and level % 3 == 1
+
+
+class Progression:
+    """Cumulative tables indexed by user level (index 0 is unused)."""
+
+    def __init__(self, user_lv_base, rank_rewards=None):
+        """Build the tables.
+
+        Args:
+            user_lv_base: Increase in required user EXP per level.
+            rank_rewards: A dict of serialized rank rewards keyed by
+                          producer rank.
+        """
+        levels = range(max_level + 1)
+        self.user_lv_base = user_lv_base
+        # Required EXP for leveling up from each level.
+        self.next_exp = [first_next_exp + (level-1) * user_lv_base
+                         for level in levels]
+        # Total EXP required to reach each level from level 1.
+        self.total_exp = [0, 0, *accumulate(self.next_exp[1:-1])]
+        self.max_vitality = [
+            first_max_vitality + x for x in accumulate(
+                level > 1 and _is_vitality_level(level) for level in levels)
+        ]
+        # Total of max vitality at each level from level 1, i.e. the
+        # vitality recovered by leveling up.
+        self.total_max_vitality = list(accumulate(
+            self.max_vitality[level] if level else 0 for level in levels))
+        self.max_friend = [
+            first_max_friend + x for x in accumulate(
+                level > 1 and _is_friend_level(level) for level in levels)
+        ]
+        self.rank_rewards = rank_rewards or {}
+
+    @classmethod
+    def from_master_data(cls, session: Session):
+        """Build the tables from the master data.
+
+        Args:
+            session: Existing SQLAlchemy session.
+        Returns:
+            A Progression object.
+        """
+        user_lv_base = session.scalar(
+            select(MstGameSetting.user_lv_base)
+        )
+        reward_item_schema = MstRewardItemSchema()
+        rank_rewards = {}
+        for rank, (mst_item_id, amount) in _rank_rewards.items():
+            rank_reward = session.scalar(
+                select(MstRewardItem)
+                .where(MstRewardItem.mst_item_id == mst_item_id)
+                .where(MstRewardItem.amount == amount)
+            )
+            rank_rewards[rank] = reward_item_schema.dump(rank_reward)
+        return cls(user_lv_base, rank_rewards)
+
+    def level_for_exp(self, level, exp):
+        """Get the level reached by gaining EXP.
+
+        Args:
+            level: Current user level.
+            exp: User EXP in the current level, including the gain.
+        Returns:
+            A tuple (level, exp) of the new level and the remaining EXP
+            in it.
+        """
+        total_exp = self.total_exp[level] + exp
+        new_level = min(bisect_right(self.total_exp, total_exp) - 1,
+                        max_level)
+        return new_level, total_exp - self.total_exp[new_level]
+
+    def level_up_vitality(self, before_level, after_level,
+                          before_max_vitality):
+        """Get the vitality changes of leveling up.
+
+        Reaching a level may increase max vitality by 1, then recovers
+        vitality by the max vitality.
+        Args:
+            before_level: User level before leveling up.
+            after_level: User level after leveling up.
+            before_max_vitality: Max vitality before leveling up.
+        Returns:
+            A tuple (recovered vitality, new max vitality).
+        """
+        if after_level <= before_level:
+            return 0, before_max_vitality
+        # Users whose max vitality differs from the table (e.g. edited)
+        # keep the difference.
+        offset = before_max_vitality - self.max_vitality[before_level]
+        recovered_vitality = (
+            self.total_max_vitality[after_level]
+            - self.total_max_vitality[before_level]
+            + offset * (after_level-before_level)
+        )
+        return recovered_vitality, self.max_vitality[after_level] + offset
+
+    def level_up_max_friend(self, before_level, after_level,
+                            before_max_friend):
+        """Get max friends after leveling up.
+
+        Args:
+            before_level: User level before leveling up.
+            after_level: User level after leveling up.
+            before_max_friend: Max friends before leveling up.
+        Returns:
+            The new max friends.
+        """
+        return (before_max_friend + self.max_friend[after_level]
+                - self.max_friend[before_level])
+
+    @staticmethod
+    def rank_for_fan(theater_fan):
+        """Get the producer rank reached with a number of theater fans."""
+        return bisect_right(rank_requirements, theater_fan)
+
+    def rank_reward(self, rank_up, rank):
+        """Get the serialized reward for reaching a producer rank.
+
+        Args:
+            rank_up: Whether the producer rank has risen.
+            rank: Producer rank reached.
+        Returns:
+            A dict of the serialized MstRewardItem, or the empty reward
+            if rank_up is False.
+        """
+        return copy.deepcopy(self.rank_rewards[rank if rank_up else 1])
+
+
+_progression = None
+_progression_lock = threading.Lock()
+
+
+def get_progression(session: Session):
+    """Get the progression tables, building them on the first call.
+
+    Args:
+        session: Existing SQLAlchemy session, used to read the master
+                 data on the first call.
+    Returns:
+        A Progression object.
+    """
+    global _progression
+    if _progression is None:
+        with _progression_lock:
+            if _progression is None:
+                _progression = Progression.from_master_data(session)
+    return _progression
+
+
+def _reference_level_up(level, exp, next_exp, max_vitality, max_friend,
+                        user_lv_base):
+    """Level-by-level rules that the tables replace."""
+    new_level = level
+    new_vitality = 0
+    new_max_vitality = max_vitality
+    new_max_friend = max_friend
+    while exp >= next_exp and new_level < max_level:
+        new_level += 1
+        exp -= next_exp
+        next_exp += user_lv_base
+        if _is_vitality_level(new_level):
+            new_max_vitality += 1
+        new_vitality += new_max_vitality
+        if _is_friend_level(new_level):
+            new_max_friend += 1
+    return new_level, exp, next_exp, new_vitality, new_max_vitality, \
+        new_max_friend
+
+
+def verify(cases=100_000, seed=0, user_lv_base=100):
+    """Compare the tables with the level-by-level rules.
+
+    Inputs start from every level with random EXP gains, from small
+    gains up to gains crossing hundreds of levels.
+    Args:
+        cases: Number of random inputs.
+        seed: Seed of the random number generator.
+        user_lv_base: Increase in required user EXP per level.
+    Returns:
+        True if both produce the same results for every input.
+    """
+    rng = random.Random(seed)
+    progression = Progression(user_lv_base)
+    inputs = []
+    for _ in range(cases):
+        level = rng.randint(1, max_level)
+        gain = rng.choice([612, 10_000, 10_000_000])
+        inputs.append((level, rng.randint(0, gain)))
+
+    def reference(level, exp):
+        return _reference_level_up(
+            level, exp, progression.next_exp[level],
+            progression.max_vitality[level], progression.max_friend[level],
+            user_lv_base)
+
+    def tables(level, exp):
+        new_level, new_exp = progression.level_for_exp(level, exp)
+        new_vitality, new_max_vitality = progression.level_up_vitality(
+            level, new_level, progression.max_vitality[level])
+        return new_level, new_exp, progression.next_exp[new_level], \
+            new_vitality, new_max_vitality, progression.level_up_max_friend(
+                level, new_level, progression.max_friend[level])
+
+    passed = True
+    for level, exp in inputs:
+        expected = reference(level, exp)
+        actual = tables(level, exp)
+        if actual != expected:
+            print(f'MISMATCH for level {level}, EXP {exp}: '
+                  f'{actual} != {expected}')
+            passed = False
+    print(f'{len(inputs)} inputs {"OK" if passed else "failed"}')
+
+    for name, f in [('Level by level', reference), ('Tables', tables)]:
+        start = time.perf_counter()
+        for level, exp in inputs:
+            f(level, exp)
+        seconds = time.perf_counter() - start
+        print(f'{name}: {seconds / len(inputs) * 1e6:.2f} us/call')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Verify and benchmark the progression tables.')
+    parser.add_argument('--cases', type=int, default=100_000,
+                        help='number of random inputs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random number generator')
+    args = parser.parse_args()
+    raise SystemExit(0 if verify(args.cases, args.seed) else 1)
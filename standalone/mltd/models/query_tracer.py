@@ -0,0 +1,237 @@
+"""Slow query tracing.
+
+The tracer is off by default and then adds no engine listeners at all.
+Enable it in config.ini:
+    query_trace = True
+    slow_query_ms = 100
+When enabled, every statement is timed and aggregated by SQL text
+(count, total and max time). A statement taking longer than the
+threshold is logged at warning level with its bound parameters and the
+output of EXPLAIN QUERY PLAN, which is run once per distinct statement
+and reused for later occurrences.
+
+The API server runs in its own process, so the aggregated statistics are
+saved to 'mltd-relive-queries.json' every few seconds while statements
+are executed and when the server exits, and the console prints the top
+statements from it:
+    python console.py --top-queries [N]
+With several API workers, each worker saves its own file
+('mltd-relive-queries-<worker ID>.json') and the console merges them.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+from mltd.servers.logging import logger
+from mltd.servers.utilities import save_periodically
+
+stats_path = 'mltd-relive-queries.json'
+worker_stats_pattern = 'mltd-relive-queries-*.json'
+_explainable = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+class QueryTracer:
+    """Aggregates statement timings and logs slow statements."""
+
+    def __init__(self, save_interval=10):
+        """Initialize the tracer.
+
+        Args:
+            save_interval: Seconds between saving the statistics to
+                           'path' after start_saving().
+        """
+        self.save_interval = save_interval
+        self.path = stats_path
+        self.threshold_ns = 0
+        self._engines = []
+        self._lock = threading.Lock()
+        # {statement: [count, total ns, max ns]}
+        self._stats = {}
+        # {statement: EXPLAIN QUERY PLAN output}
+        self._plans = {}
+        self._changed = False
+
+    @property
+    def enabled(self):
+        return bool(self._engines)
+
+    def enable(self, engine, threshold_ms=100):
+        """Start tracing the statements of an engine.
+
+        Can be called for several engines (e.g. the engine of each
+        shard), whose statistics are aggregated together.
+        Args:
+            engine: SQLAlchemy engine.
+            threshold_ms: Statements taking at least this long are
+                          logged.
+        """
+        self.threshold_ns = threshold_ms * 1_000_000
+        if engine in self._engines:
+            return
+        self._engines.append(engine)
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def disable(self):
+        """Stop tracing all engines. The collected statistics are kept."""
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self._before)
+            event.remove(engine, 'after_cursor_execute', self._after)
+        self._engines.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        conn.info.setdefault('query_tracer_start', []).append(
+            time.perf_counter_ns())
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        elapsed_ns = (time.perf_counter_ns()
+                      - conn.info['query_tracer_start'].pop())
+        with self._lock:
+            self._changed = True
+            stats = self._stats.get(statement)
+            if stats is None:
+                self._stats[statement] = [1, elapsed_ns, elapsed_ns]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed_ns
+                stats[2] = max(stats[2], elapsed_ns)
+        if elapsed_ns >= self.threshold_ns:
+            if executemany and parameters:
+                parameters = parameters[0]
+            logger.warning(
+                'Slow query (%d ms): %s\nParameters: %s\nQuery plan:\n%s',
+                elapsed_ns // 1_000_000, statement, parameters,
+                self._explain(cursor, statement, parameters))
+
+    def _explain(self, cursor, statement, parameters):
+        """Get the query plan of a statement, cached by SQL text."""
+        plan = self._plans.get(statement)
+        if plan is not None:
+            return plan
+        if not statement.lstrip().upper().startswith(_explainable):
+            plan = '(not applicable)'
+        else:
+            # Use a separate cursor, since the results of the statement
+            # have not been fetched yet.
+            explain_cursor = cursor.connection.cursor()
+            try:
+                explain_cursor.execute(f'EXPLAIN QUERY PLAN {statement}',
+                                       parameters)
+                plan = '\n'.join(f'{row[0]}|{row[1]}|{row[-1]}'
+                                 for row in explain_cursor.fetchall())
+            except Exception as e:
+                plan = f'(EXPLAIN failed: {e})'
+            finally:
+                explain_cursor.close()
+        self._plans[statement] = plan
+        return plan
+
+    def top(self, n=20):
+        """Get the statements with the highest total time.
+
+        Args:
+            n: Number of statements.
+        Returns:
+            A list of dicts containing the following keys: statement,
+            count, total_ms, mean_ms and max_ms.
+        """
+        with self._lock:
+            items = [(statement, *stats)
+                     for statement, stats in self._stats.items()]
+        items.sort(key=lambda x: x[2], reverse=True)
+        return [{
+            'statement': statement,
+            'count': count,
+            'total_ms': total_ns / 1e6,
+            'mean_ms': total_ns / count / 1e6,
+            'max_ms': max_ns / 1e6,
+        } for statement, count, total_ns, max_ns in items[:n]]
+
+    def reset(self):
+        """Discard all collected statistics."""
+        with self._lock:
+            self._stats.clear()
+
+    def save(self, path=None):
+        """Save the statistics of all statements to a JSON file."""
+        path = path or self.path
+        with self._lock:
+            self._changed = False
+        rows = self.top(n=None)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'statements': rows}, f)
+        os.replace(f'{path}.tmp', path)
+
+    def _save_changed(self):
+        if self._changed:
+            self.save()
+
+    def start_saving(self):
+        """Save to 'path' every 'save_interval' seconds if statements
+        were executed, and at exit."""
+        save_periodically(self._save_changed, self.save_interval,
+                          'query-trace-saver')
+
+
+query_tracer = QueryTracer()
+
+
+def load_top(n=20, path=None):
+    """Load the statements with the highest total time from files.
+
+    Args:
+        n: Number of statements.
+        path: File saved by QueryTracer.save(), or None to merge the
+              files of the API server or of all its workers.
+    Returns:
+        A list of dicts, see QueryTracer.top().
+    Raises:
+        FileNotFoundError: No file was found.
+    """
+    paths = [path] if path else glob.glob(worker_stats_pattern)
+    if not paths:
+        paths = [stats_path]
+    # {statement: merged row}
+    merged = {}
+    for file_path in paths:
+        with open(file_path, encoding='utf-8') as f:
+            rows = json.load(f)['statements']
+        for row in rows:
+            total = merged.get(row['statement'])
+            if total is None:
+                merged[row['statement']] = dict(row)
+                continue
+            total['count'] += row['count']
+            total['total_ms'] += row['total_ms']
+            total['max_ms'] = max(total['max_ms'], row['max_ms'])
+            total['mean_ms'] = total['total_ms'] / total['count']
+    rows = sorted(merged.values(), key=lambda x: x['total_ms'],
+                  reverse=True)
+    return rows[:n]
+
+
+def format_top(rows, width=100):
+    """Format the top statements as a table.
+
+    Args:
+        rows: A list of dicts returned by top() or load_top().
+        width: Maximum width of the statement column.
+    Returns:
+        A str.
+    """
+    lines = [f'{"total ms":>10} {"count":>8} {"mean ms":>9} {"max ms":>9}'
+             f'  statement']
+    for row in rows:
+        statement = ' '.join(row['statement'].split())
+        if len(statement) > width:
+            statement = statement[:width-3] + '...'
+        lines.append(f'{row["total_ms"]:>10.1f} {row["count"]:>8} '
+                     f'{row["mean_ms"]:>9.2f} {row["max_ms"]:>9.2f}'
+                     f'  {statement}')
+    return '\n'.join(lines)
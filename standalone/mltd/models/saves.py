@@ -0,0 +1,420 @@
+"""Per-user save export and import.
+
+A save contains the rows of one user in every per-user table (see
+'user_tables' in 'mltd.models.shards'), so a user can be backed up,
+moved to another machine or copied to another shard. It is a stream of
+msgpack maps:
+    header: {'format': 'mltd-relive-save', 'version': 1,
+             'server_version': database version, 'user_id': hex}
+    blocks: {'table': name, 'columns': [names],
+             'values': [[values of each column], ...]}
+    footer: {'rows': number of rows}
+Blocks are columnar and hold up to 'block_rows' rows of one table. The
+user ID column is left out of the blocks, since it is the user ID of the
+header. Values are stored as SQLite stores them (e.g. UUIDs as hex
+strings and dates as text), so rows are copied without going through
+the ORM.
+
+Export writes each block as soon as it is read. Import replaces all rows
+of the user in the database storing the user, inserting each block with
+one executemany() in a single transaction, and bumps the collection
+versions of the user (see 'mltd.models.versions') so that a running
+server does not return cached lists older than the import. Saves can
+only be imported into a database of the same version. Friends who are
+not in the database are left out where foreign keys between users are
+enforced (i.e. not in shards), since the keys would fail.
+
+Running this module as a script exports or imports a save, or checks
+the round trip of a user on a copy of 'mltd-relive.db', with LPs of all
+songs and a full present box added to the user.
+    python -m mltd.models.saves export USER_ID FILE
+    python -m mltd.models.saves import FILE
+    python -m mltd.models.saves test [--user-id USER_ID] [--presents N]
+"""
+import argparse
+import io
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+import msgpack
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+
+from mltd.models.shards import (cross_user_columns, master_path,
+                                shard_router, user_tables)
+from mltd.models.versions import (bump_versions, read_versions,
+                                  tracked_collections)
+from mltd.servers.logging import logger
+
+save_format = 'mltd-relive-save'
+save_format_version = 1
+block_rows = 1000
+# Types of values stored by SQLite
+_value_types = (str, int, float, bytes, type(None))
+_tables = {table.name: table for table in user_tables}
+
+
+@contextmanager
+def _transaction(user_engine, immediate=False):
+    """Open a connection in a single SQLite transaction.
+
+    As in 'session_scope.request()', BEGIN is emitted here instead of by
+    the sqlite3 module, so that all reads see the same snapshot and
+    PRAGMA defer_foreign_keys lasts until the commit.
+    Yields:
+        An SQLAlchemy connection.
+    """
+    with user_engine.connect() as connection:
+        dbapi_connection = connection.connection.driver_connection
+        isolation_level = dbapi_connection.isolation_level
+        dbapi_connection.isolation_level = None
+        try:
+            with connection.begin():
+                connection.exec_driver_sql(
+                    'BEGIN IMMEDIATE' if immediate else 'BEGIN')
+                yield connection
+        finally:
+            dbapi_connection.isolation_level = isolation_level
+
+
+def _column_list(names):
+    return ', '.join(f'"{x}"' for x in names)
+
+
+def _server_version(connection):
+    # Shards attach the main database, which has the version.
+    return connection.exec_driver_sql(
+        'SELECT version FROM server_version').scalar()
+
+
+def _delete_user(connection, user_id):
+    """Delete the rows of a user in every per-user table."""
+    for table, user_column in reversed(user_tables.items()):
+        connection.exec_driver_sql(
+            f'DELETE FROM "{table.name}" WHERE "{user_column}" = ?',
+            (user_id.hex,))
+
+
+def export_user(user_id, f, user_engine=None):
+    """Write the save of a user.
+
+    Args:
+        user_id: User ID as a UUID or str.
+        f: Binary file to write to.
+        user_engine: Engine of the database storing the user, or None
+                     for the user's shard.
+    Returns:
+        The number of rows written.
+    Raises:
+        KeyError: The user does not exist.
+    """
+    if not isinstance(user_id, UUID):
+        user_id = UUID(user_id)
+    user_engine = user_engine or shard_router.engine_for(user_id)
+    packer = msgpack.Packer()
+    rows = 0
+    with _transaction(user_engine) as connection:
+        if connection.exec_driver_sql(
+                'SELECT 1 FROM user WHERE user_id = ?',
+                (user_id.hex,)).first() is None:
+            raise KeyError(str(user_id))
+        f.write(packer.pack({
+            'format': save_format,
+            'version': save_format_version,
+            'server_version': _server_version(connection),
+            'user_id': user_id.hex,
+        }))
+        for table, user_column in user_tables.items():
+            columns = [x.name for x in table.c if x.name != user_column]
+            result = connection.exec_driver_sql(
+                f'SELECT {_column_list(columns)} '
+                f'FROM "{table.name}" WHERE "{user_column}" = ?',
+                (user_id.hex,))
+            while block := result.fetchmany(block_rows):
+                f.write(packer.pack({
+                    'table': table.name,
+                    'columns': columns,
+                    'values': [list(x) for x in zip(*block)],
+                }))
+                rows += len(block)
+        f.write(packer.pack({'rows': rows}))
+    return rows
+
+
+def _drop_missing_users(connection, table, columns, values):
+    """Leave out rows referring to users not in the database.
+
+    Returns:
+        The values of the remaining rows, by column.
+    """
+    for column in columns:
+        if (table.name, column) not in cross_user_columns:
+            continue
+        # Shards leave out foreign keys between users.
+        if not any(x[2] == 'user' and x[3] == column
+                   for x in connection.exec_driver_sql(
+                       f'PRAGMA foreign_key_list("{table.name}")')):
+            continue
+        referred = values[columns.index(column)]
+        existing = {x[0] for x in connection.exec_driver_sql(
+            f'SELECT user_id FROM user WHERE user_id IN '
+            f'({", ".join("?" * len(referred))})', tuple(referred))}
+        keep = [x in existing for x in referred]
+        if not all(keep):
+            logger.warning(f'Skipped {keep.count(False)} rows of '
+                           f'{table.name} referring to missing users')
+            values = [[x for x, k in zip(v, keep) if k] for v in values]
+    return values
+
+
+def _check_block(block):
+    """Check a block of a save.
+
+    Returns:
+        A tuple of the table, the list of column names and the list of
+        values of each column.
+    Raises:
+        ValueError: The block is malformed.
+    """
+    name = block.get('table')
+    table = _tables.get(name) if isinstance(name, str) else None
+    if table is None:
+        raise ValueError(f'Unknown table {name}')
+    columns = block.get('columns')
+    values = block.get('values')
+    if (not isinstance(columns, list) or not columns
+            or len(set(columns)) != len(columns)
+            or not set(columns) <= set(table.c.keys())
+            or user_tables[table] in columns):
+        raise ValueError(f'Invalid columns of table {table.name}')
+    if (not isinstance(values, list) or len(values) != len(columns)
+            or not all(isinstance(x, list) for x in values)
+            or len({len(x) for x in values}) != 1):
+        raise ValueError(f'Invalid values of table {table.name}')
+    if not all(isinstance(x, _value_types) for v in values for x in v):
+        raise ValueError(f'Invalid value type in table {table.name}')
+    return table, columns, values
+
+
+def import_user(f, user_engine=None):
+    """Replace the rows of a user with a save.
+
+    Args:
+        f: Binary file to read from.
+        user_engine: Engine of the database to import into, or None for
+                     the user's shard.
+    Returns:
+        A tuple of the user ID as a UUID and the number of rows in the
+        save.
+    Raises:
+        ValueError: The file is not a save, is malformed or truncated,
+                    is of another database version, or conflicts with
+                    other users in the database (e.g. the same search
+                    ID). Nothing is imported.
+    """
+    unpacker = msgpack.Unpacker(f, raw=False)
+    try:
+        header = next(unpacker, None)
+    except ValueError:
+        header = None
+    if (not isinstance(header, dict)
+            or header.get('format') != save_format
+            or header.get('version') != save_format_version
+            or not isinstance(header.get('user_id'), str)):
+        raise ValueError('Not a save file')
+    user_id = UUID(header['user_id'])
+    user_engine = user_engine or shard_router.engine_for(user_id)
+    rows = 0
+    try:
+        with _transaction(user_engine, immediate=True) as connection:
+            db_version = _server_version(connection)
+            if header.get('server_version') != db_version:
+                raise ValueError(
+                    f'Save of database v{header.get("server_version")} '
+                    f'cannot be imported into database v{db_version}')
+            # Rows of other users may refer to the user (e.g. friends),
+            # so foreign keys are checked once the user is inserted
+            # again.
+            connection.exec_driver_sql('PRAGMA defer_foreign_keys=ON')
+            # The save contains the collection versions of the time it
+            # was exported.
+            versions = read_versions(connection, user_id)
+            _delete_user(connection, user_id)
+            for block in unpacker:
+                if not isinstance(block, dict):
+                    raise ValueError('Invalid block')
+                if 'table' not in block:
+                    if block.get('rows') != rows:
+                        raise ValueError('Save file is truncated')
+                    break
+                table, columns, values = _check_block(block)
+                rows += len(values[0])
+                values = _drop_missing_users(connection, table, columns,
+                                             values)
+                params = [(*row, user_id.hex) for row in zip(*values)]
+                if not params:
+                    continue
+                names = [*columns, user_tables[table]]
+                connection.exec_driver_sql(
+                    f'INSERT INTO "{table.name}" '
+                    f'({_column_list(names)}) '
+                    f'VALUES ({", ".join("?" * len(names))})',
+                    params)
+            else:
+                raise ValueError('Save file is truncated')
+            bump_versions(connection, user_id, versions)
+    except IntegrityError as e:
+        raise ValueError(
+            f'Save conflicts with the database: {e.orig}') from e
+    return user_id, rows
+
+
+def _dump_user(user_engine, user_id):
+    """Get the rows of a user in every per-user table, sorted.
+
+    Collection versions are left out, since each import bumps them.
+    """
+    with _transaction(user_engine) as connection:
+        return {table.name: sorted(connection.exec_driver_sql(
+            f'SELECT * FROM "{table.name}" WHERE "{user_column}" = ?',
+            (user_id.hex,)).all(), key=repr)
+            for table, user_column in user_tables.items()
+            if table.name != 'collection_version'}
+
+
+def _versions_bumped(user_engine, user_id, versions):
+    """Check that every tracked collection of a user has a new version."""
+    with _transaction(user_engine) as connection:
+        new_versions = read_versions(connection, user_id)
+    return all(new_versions.get(x, 0) > versions.get(x, 0)
+               for x in tracked_collections)
+
+
+def _max_out_user(user_engine, user_id, presents):
+    """Add an LP of every song and presents to a user."""
+    date_format = '%Y-%m-%d %H:%M:%S.%f'
+    start = datetime(2000, 1, 1)
+    with _transaction(user_engine, immediate=True) as connection:
+        connection.exec_driver_sql(
+            'INSERT OR REPLACE INTO lp (user_id, mst_song_id, course, lp, '
+            'is_playable, update_date) '
+            'SELECT ?, mst_song_id, MAX(course_id), mst_song_id % 400, 1, ? '
+            'FROM mst_course GROUP BY mst_song_id',
+            (user_id.hex, start.strftime(date_format)))
+        connection.exec_driver_sql(
+            'INSERT INTO present (present_id, user_id, comment, end_date, '
+            'create_date, amount, present_type, present_state) '
+            'VALUES (?, ?, ?, ?, ?, 1, 1, 1)',
+            [(uuid4().hex, user_id.hex, f'Present {i}',
+              datetime(2099, 12, 31).strftime(date_format),
+              (start + timedelta(milliseconds=i)).strftime(date_format))
+             for i in range(presents)])
+
+
+def test_round_trip(user_id, presents=1000):
+    """Export a user, delete it, import it and compare the rows.
+
+    Runs on a copy of 'mltd-relive.db', where LPs of all songs and
+    'presents' presents are added to the user first. With sharding
+    enabled, the user is first copied from its shard.
+    Returns:
+        True if the rows after the import are the same as before.
+    """
+    user_id = UUID(user_id)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'mltd-relive-save-test.db')
+        source = sqlite3.connect(master_path)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        test_engine = create_engine(f'sqlite+pysqlite:///{path}')
+        try:
+            if shard_router.enabled:
+                # The copy has no users, so copy the user from its shard.
+                f = io.BytesIO()
+                export_user(user_id, f)
+                f.seek(0)
+                import_user(f, test_engine)
+            _max_out_user(test_engine, user_id, presents)
+            before = _dump_user(test_engine, user_id)
+            with _transaction(test_engine) as connection:
+                versions = read_versions(connection, user_id)
+
+            f = io.BytesIO()
+            start_time = time.perf_counter()
+            rows = export_user(user_id, f, test_engine)
+            export_time = time.perf_counter() - start_time
+            save = f.getvalue()
+            print(f'Exported {rows} rows of {len(user_tables)} tables in '
+                  f'{export_time * 1000:.1f} ms: {len(save)} bytes')
+
+            with _transaction(test_engine, immediate=True) as connection:
+                connection.exec_driver_sql(
+                    'DELETE FROM friend WHERE friend_id = ?',
+                    (user_id.hex,))
+                _delete_user(connection, user_id)
+            start_time = time.perf_counter()
+            import_user(io.BytesIO(save), test_engine)
+            import_time = time.perf_counter() - start_time
+            print(f'Imported {rows} rows in {import_time * 1000:.1f} ms')
+
+            same = _dump_user(test_engine, user_id) == before
+            print('Rows match' if same else 'Rows differ')
+            bumped = _versions_bumped(test_engine, user_id, versions)
+            with _transaction(test_engine) as connection:
+                versions = read_versions(connection, user_id)
+            # Importing over the existing rows replaces them.
+            import_user(io.BytesIO(save), test_engine)
+            same = same and _dump_user(test_engine, user_id) == before
+            print('Reimport matches' if same else 'Reimport differs')
+            bumped = bumped and _versions_bumped(test_engine, user_id,
+                                                 versions)
+            print('Versions bumped' if bumped else 'Versions not bumped')
+            same = same and bumped
+        finally:
+            test_engine.dispose()
+    return same
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export or import the save of a user.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='export a user')
+    export_parser.add_argument('user_id', help='user ID in UUID format')
+    export_parser.add_argument('file', help='save file to write')
+    import_parser = subparsers.add_parser(
+        'import', help='import a user, replacing its rows')
+    import_parser.add_argument('file', help='save file to read')
+    test_parser = subparsers.add_parser(
+        'test', help='check the round trip on a copy of the database')
+    test_parser.add_argument('--user-id',
+                             default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                             help='user ID in UUID format')
+    test_parser.add_argument('--presents', type=int, default=1000,
+                             help='number of presents added to the user')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        try:
+            with open(args.file, 'wb') as f:
+                rows = export_user(args.user_id, f)
+        except KeyError:
+            os.remove(args.file)
+            raise SystemExit(f'User not found: {args.user_id}')
+        print(f'Exported {rows} rows to {args.file}')
+    elif args.command == 'import':
+        with open(args.file, 'rb') as f:
+            try:
+                user_id, rows = import_user(f)
+            except ValueError as e:
+                raise SystemExit(e)
+        print(f'Imported {rows} rows of user {user_id}')
+    elif not test_round_trip(args.user_id, args.presents):
+        raise SystemExit(1)
@@ -1,9 +1,10 @@
+from datetime import datetime, timezone
+
 from marshmallow import fields, post_dump
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from marshmallow_sqlalchemy.fields import Nested
 
 from mltd.models.models import *
-from mltd.servers.utilities import str_to_datetime
 
 _empty_card = {
     'card_id': '',
@@ -157,7 +158,26 @@ _empty_song = {
 }
 
 
-class UserSchema(SQLAlchemyAutoSchema):
+class NativeDateTime(fields.DateTime):
+    """A datetime dumped as an aware datetime object instead of a str.
+
+    Naive datetimes loaded from the database are in UTC. The dumped
+    datetime is formatted only once, by the JSON encoder of the handler.
+    """
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if value is None:
+            return None
+        return value.replace(tzinfo=timezone.utc)
+
+
+class BaseSchema(SQLAlchemyAutoSchema):
+    """Base class of schemas dumping datetime columns as NativeDateTime."""
+    TYPE_MAPPING = {**SQLAlchemyAutoSchema.TYPE_MAPPING,
+                    datetime: NativeDateTime}
+
+
+class UserSchema(BaseSchema):
     class Meta:
         model = User
         include_relationships = True
@@ -167,7 +187,8 @@ class UserSchema(SQLAlchemyAutoSchema):
                    'costume_advs', 'gashas', 'units', 'song_units',
                    'main_story_chapters', 'campaigns', 'record_times',
                    'missions', 'special_stories', 'event_stories',
-                   'event_memories', 'login_bonus_schedules', 'presents')
+                   'event_memories', 'login_bonus_schedules', 'presents',
+                   'lps')
         ordered = True
 
     vitality = fields.Int()
@@ -175,23 +196,22 @@ class UserSchema(SQLAlchemyAutoSchema):
     mission_summary = Nested('PanelMissionSheetSchema')
     map_level = Nested('MapLevelSchema')
     un_lock_song_status = Nested('UnLockSongStatusSchema')
-    lps = Nested('LPSchema', many=True)
+    top_lps = Nested('TopLPSchema', many=True)
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['last_login_date'] = str_to_datetime(data['last_login_date'])
-        data['full_recover_date'] = str_to_datetime(data['full_recover_date'])
-        data['first_time_date'] = str_to_datetime(data['first_time_date'])
         if data['lounge_id'] is None:
             data['lounge_id'] = ''
         data['user_recognition'] = data['map_level']['user_recognition']
 
-        # Populate lp_list.
-        data['lp_list'] = None if not data['lps'] else data['lps'][:10]
+        # Populate lp_list. The 10 highest song LPs are always among the
+        # top 10 song LPs of their idol types.
+        data['lp_list'] = (None if not data['top_lps']
+                           else data['top_lps'][:10])
 
         # Populate type_lp_list.
         type_lp_map = {i: [] for i in range(1, 5)}
-        for lp in data['lps']:
+        for lp in data['top_lps']:
             type_lp_map[lp['idol_type']].append(lp)
         type_lp_list = []
         for i in range(1, 5):
@@ -202,12 +222,12 @@ class UserSchema(SQLAlchemyAutoSchema):
                 'lp': sum(lp['lp'] for lp in type_lp_map[i][:10])
             })
         data['type_lp_list'] = type_lp_list
-        del data['lps']
+        del data['top_lps']
 
         return data
 
 
-class MstIdolSchema(SQLAlchemyAutoSchema):
+class MstIdolSchema(BaseSchema):
     class Meta:
         model = MstIdol
         include_relationships = True
@@ -215,7 +235,7 @@ class MstIdolSchema(SQLAlchemyAutoSchema):
     default_costume = Nested('MstCostumeSchema')
 
 
-class IdolSchema(SQLAlchemyAutoSchema):
+class IdolSchema(BaseSchema):
     class Meta:
         model = Idol
         include_fk = True
@@ -277,7 +297,7 @@ class IdolSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstCostumeSchema(SQLAlchemyAutoSchema):
+class MstCostumeSchema(BaseSchema):
     class Meta:
         model = MstCostume
         include_fk = True
@@ -285,12 +305,11 @@ class MstCostumeSchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['release_date'] = str_to_datetime(
-            data['release_date']).astimezone(config.timezone)
+        data['release_date'] = data['release_date'].astimezone(config.timezone)
         return data
 
 
-class MstCostumeBulkChangeGroupSchema(SQLAlchemyAutoSchema):
+class MstCostumeBulkChangeGroupSchema(BaseSchema):
     class Meta:
         model = MstCostumeBulkChangeGroup
         ordered = True
@@ -301,25 +320,25 @@ class MstCostumeBulkChangeGroupSchema(SQLAlchemyAutoSchema):
         data['cbc_target_sort_id_format_list'] = [
             data['cbc_target_sort_id_format']]
 
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstCenterEffectSchema(SQLAlchemyAutoSchema):
+class MstCenterEffectSchema(BaseSchema):
     class Meta:
         model = MstCenterEffect
 
 
-class MstCardSkillSchema(SQLAlchemyAutoSchema):
+class MstCardSkillSchema(BaseSchema):
     class Meta:
         model = MstCardSkill
         exclude = ('probability_base',)
 
 
-class MstCardSchema(SQLAlchemyAutoSchema):
+class MstCardSchema(BaseSchema):
     class Meta:
         model = MstCard
         include_fk = True
@@ -333,14 +352,12 @@ class MstCardSchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['master_lesson_begin_date'] = str_to_datetime(
-            data['master_lesson_begin_date'])
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
         return data
 
 
-class AlbumSchema(SQLAlchemyAutoSchema):
+class AlbumSchema(BaseSchema):
     class Meta:
         model = MstCard
         include_fk = True
@@ -379,12 +396,12 @@ class AlbumSchema(SQLAlchemyAutoSchema):
             data['effect_id_list'] = [mst_card_skill['effect_id'], 0]
         del data['mst_card_skill']
 
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
         return data
 
 
-class CardSchema(SQLAlchemyAutoSchema):
+class CardSchema(BaseSchema):
     class Meta:
         model = Card
         include_fk = True
@@ -448,7 +465,6 @@ class CardSchema(SQLAlchemyAutoSchema):
         del data['skill_probability']
 
         data['ex_type'] = mst_card['ex_type']
-        data['create_date'] = str_to_datetime(data['create_date'])
         data['variation'] = mst_card['variation']
         data['master_lesson_begin_date'] = mst_card['master_lesson_begin_date']
         data['training_item_list'] = mst_card['training_item_list']
@@ -490,31 +506,30 @@ class CardSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstVoiceCategorySchema(SQLAlchemyAutoSchema):
+class MstVoiceCategorySchema(BaseSchema):
     class Meta:
         model = MstVoiceCategory
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['release_date'] = str_to_datetime(
-            data['release_date']).astimezone(config.timezone)
+        data['release_date'] = data['release_date'].astimezone(config.timezone)
         return data
 
 
-class MstLessonWearSchema(SQLAlchemyAutoSchema):
+class MstLessonWearSchema(BaseSchema):
     class Meta:
         model = MstLessonWear
         include_fk = True
         ordered = True
 
 
-class MstItemSchema(SQLAlchemyAutoSchema):
+class MstItemSchema(BaseSchema):
     class Meta:
         model = MstItem
 
 
-class ItemSchema(SQLAlchemyAutoSchema):
+class ItemSchema(BaseSchema):
     class Meta:
         model = Item
         include_fk = True
@@ -534,7 +549,7 @@ class ItemSchema(SQLAlchemyAutoSchema):
         data['sort_id'] = mst_item['sort_id']
         data['value1'] = mst_item['value1']
         data['value2'] = mst_item['value2']
-        data['expire_date'] = str_to_datetime(data['expire_date']).astimezone(
+        data['expire_date'] = data['expire_date'].astimezone(
             config.timezone) if not mst_item['is_extend'] else None
         data['expire_date_list'] = [] if not mst_item['is_extend'] else None
         data['is_extend'] = mst_item['is_extend']
@@ -542,7 +557,7 @@ class ItemSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstRewardItemSchema(SQLAlchemyAutoSchema):
+class MstRewardItemSchema(BaseSchema):
     class Meta:
         model = MstRewardItem
         include_fk = True
@@ -581,7 +596,7 @@ class MstRewardItemSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstMemorialSchema(SQLAlchemyAutoSchema):
+class MstMemorialSchema(BaseSchema):
     class Meta:
         model = MstMemorial
         include_fk = True
@@ -593,12 +608,12 @@ class MstMemorialSchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
         return data
 
 
-class MemorialSchema(SQLAlchemyAutoSchema):
+class MemorialSchema(BaseSchema):
     class Meta:
         model = Memorial
         include_fk = True
@@ -615,8 +630,6 @@ class MemorialSchema(SQLAlchemyAutoSchema):
         data['mst_idol_id'] = mst_memorial['mst_idol_id']
         data['release_affection'] = mst_memorial['release_affection']
         data['number'] = mst_memorial['number']
-        if data['released_date']:
-            data['released_date'] = str_to_datetime(data['released_date'])
 
         # Populate reward_item_list.
         data['reward_item_list'] = [mst_memorial['mst_reward_item']]
@@ -627,7 +640,7 @@ class MemorialSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class EpisodeSchema(SQLAlchemyAutoSchema):
+class EpisodeSchema(BaseSchema):
     class Meta:
         model = Episode
         include_fk = True
@@ -650,7 +663,7 @@ class EpisodeSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstTheaterCostumeBlogSchema(SQLAlchemyAutoSchema):
+class MstTheaterCostumeBlogSchema(BaseSchema):
     class Meta:
         model = MstTheaterCostumeBlog
         include_relationships = True
@@ -659,7 +672,7 @@ class MstTheaterCostumeBlogSchema(SQLAlchemyAutoSchema):
     mst_reward_item = Nested('MstRewardItemSchema')
 
 
-class CostumeAdvSchema(SQLAlchemyAutoSchema):
+class CostumeAdvSchema(BaseSchema):
     class Meta:
         model = CostumeAdv
         include_fk = True
@@ -684,21 +697,21 @@ class CostumeAdvSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstGashaSchema(SQLAlchemyAutoSchema):
+class MstGashaSchema(BaseSchema):
     class Meta:
         model = MstGasha
         include_fk = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class GashaSchema(SQLAlchemyAutoSchema):
+class GashaSchema(BaseSchema):
     class Meta:
         model = Gasha
         include_fk = True
@@ -760,21 +773,21 @@ class GashaSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstJobSchema(SQLAlchemyAutoSchema):
+class MstJobSchema(BaseSchema):
     class Meta:
         model = MstJob
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstSongSchema(SQLAlchemyAutoSchema):
+class MstSongSchema(BaseSchema):
     class Meta:
         model = MstSong
         include_relationships = True
@@ -782,12 +795,12 @@ class MstSongSchema(SQLAlchemyAutoSchema):
     mst_extend_song = Nested('MstExtendSongSchema')
 
 
-class MstExtendSongSchema(SQLAlchemyAutoSchema):
+class MstExtendSongSchema(BaseSchema):
     class Meta:
         model = MstExtendSong
 
 
-class SongSchema(SQLAlchemyAutoSchema):
+class SongSchema(BaseSchema):
     class Meta:
         model = Song
         include_fk = True
@@ -838,8 +851,6 @@ class SongSchema(SQLAlchemyAutoSchema):
         data['stage_id'] = mst_song['stage_id']
         data['stage_ts_id'] = mst_song['stage_ts_id']
         data['bpm'] = mst_song['bpm']
-        data['first_cleared_date'] = str_to_datetime(
-            data['first_cleared_date'])
         data['is_visible'] = mst_song['is_visible']
         data['apple_song_url'] = mst_song['apple_song_url']
         data['google_song_url'] = mst_song['google_song_url']
@@ -924,12 +935,12 @@ class SongSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstCourseSchema(SQLAlchemyAutoSchema):
+class MstCourseSchema(BaseSchema):
     class Meta:
         model = MstCourse
 
 
-class CourseSchema(SQLAlchemyAutoSchema):
+class CourseSchema(BaseSchema):
     class Meta:
         model = Course
         include_fk = True
@@ -950,7 +961,7 @@ class CourseSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class UnitSchema(SQLAlchemyAutoSchema):
+class UnitSchema(BaseSchema):
     class Meta:
         model = Unit
         include_relationships = True
@@ -967,7 +978,7 @@ class UnitSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class UnitIdolSchema(SQLAlchemyAutoSchema):
+class UnitIdolSchema(BaseSchema):
     class Meta:
         model = UnitIdol
         include_fk = True
@@ -975,7 +986,7 @@ class UnitIdolSchema(SQLAlchemyAutoSchema):
         ordered = True
 
 
-class SongUnitSchema(SQLAlchemyAutoSchema):
+class SongUnitSchema(BaseSchema):
     class Meta:
         model = SongUnit
         include_fk = True
@@ -994,7 +1005,7 @@ class SongUnitSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class SongUnitIdolSchema(SQLAlchemyAutoSchema):
+class SongUnitIdolSchema(BaseSchema):
     class Meta:
         model = SongUnitIdol
         include_fk = True
@@ -1002,7 +1013,7 @@ class SongUnitIdolSchema(SQLAlchemyAutoSchema):
         ordered = True
 
 
-class MstMainStorySchema(SQLAlchemyAutoSchema):
+class MstMainStorySchema(BaseSchema):
     class Meta:
         model = MstMainStory
         include_fk = True
@@ -1012,7 +1023,7 @@ class MstMainStorySchema(SQLAlchemyAutoSchema):
     mst_reward_items = Nested('MstRewardItemSchema', many=True)
 
 
-class MainStoryChapterSchema(SQLAlchemyAutoSchema):
+class MainStoryChapterSchema(BaseSchema):
     class Meta:
         model = MainStoryChapter
         include_fk = True
@@ -1032,7 +1043,6 @@ class MainStoryChapterSchema(SQLAlchemyAutoSchema):
 
         data['release_level'] = mst_main_story['release_level']
         data['release_song_id'] = mst_main_story['release_song_id']
-        data['released_date'] = str_to_datetime(data['released_date'])
         data['reward_song_id'] = mst_main_story['reward_song_id']
 
         # Populate reward_song.
@@ -1108,7 +1118,7 @@ class MainStoryChapterSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstTheaterRoomStatusSchema(SQLAlchemyAutoSchema):
+class MstTheaterRoomStatusSchema(BaseSchema):
     class Meta:
         model = MstTheaterRoomStatus
         include_fk = True
@@ -1146,7 +1156,7 @@ class MstTheaterRoomStatusSchema(SQLAlchemyAutoSchema):
         }
 
 
-class MstTheaterRoomIdolSchema(SQLAlchemyAutoSchema):
+class MstTheaterRoomIdolSchema(BaseSchema):
     class Meta:
         model = MstTheaterRoomIdol
         include_fk = True
@@ -1156,7 +1166,7 @@ class MstTheaterRoomIdolSchema(SQLAlchemyAutoSchema):
         ordered = True
 
 
-class MstMainStoryContactStatusSchema(SQLAlchemyAutoSchema):
+class MstMainStoryContactStatusSchema(BaseSchema):
     class Meta:
         model = MstMainStoryContactStatus
         include_fk = True
@@ -1173,7 +1183,7 @@ class MstMainStoryContactStatusSchema(SQLAlchemyAutoSchema):
         }
 
 
-class MstEventContactStatusSchema(SQLAlchemyAutoSchema):
+class MstEventContactStatusSchema(BaseSchema):
     class Meta:
         model = MstEventContactStatus
         include_fk = True
@@ -1190,7 +1200,7 @@ class MstEventContactStatusSchema(SQLAlchemyAutoSchema):
         }
 
 
-class MstAwakeningConfigSchema(SQLAlchemyAutoSchema):
+class MstAwakeningConfigSchema(BaseSchema):
     class Meta:
         model = MstAwakeningConfig
         include_fk = True
@@ -1211,7 +1221,7 @@ class MstAwakeningConfigSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstAwakeningConfigItemSchema(SQLAlchemyAutoSchema):
+class MstAwakeningConfigItemSchema(BaseSchema):
     class Meta:
         model = MstAwakeningConfigItem
         include_fk = True
@@ -1219,7 +1229,7 @@ class MstAwakeningConfigItemSchema(SQLAlchemyAutoSchema):
         ordered = True
 
 
-class MstMasterLesson2ConfigSchema(SQLAlchemyAutoSchema):
+class MstMasterLesson2ConfigSchema(BaseSchema):
     class Meta:
         model = MstMasterLesson2Config
         include_relationships = True
@@ -1237,7 +1247,7 @@ class MstMasterLesson2ConfigSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstMasterLesson2ConfigItemSchema(SQLAlchemyAutoSchema):
+class MstMasterLesson2ConfigItemSchema(BaseSchema):
     class Meta:
         model = MstMasterLesson2ConfigItem
         include_fk = True
@@ -1245,7 +1255,7 @@ class MstMasterLesson2ConfigItemSchema(SQLAlchemyAutoSchema):
         ordered = True
 
 
-class MstExMasterLessonConfigSchema(SQLAlchemyAutoSchema):
+class MstExMasterLessonConfigSchema(BaseSchema):
     class Meta:
         model = MstExMasterLessonConfig
         include_fk = True
@@ -1261,20 +1271,20 @@ class MstExMasterLessonConfigSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstLessonMoneyConfigSchema(SQLAlchemyAutoSchema):
+class MstLessonMoneyConfigSchema(BaseSchema):
     class Meta:
         model = MstLessonMoneyConfig
         include_fk = True
         ordered = True
 
 
-class MstLessonSkillLevelUpConfigSchema(SQLAlchemyAutoSchema):
+class MstLessonSkillLevelUpConfigSchema(BaseSchema):
     class Meta:
         model = MstLessonSkillLevelUpConfig
         ordered = True
 
 
-class MstLessonWearConfigSchema(SQLAlchemyAutoSchema):
+class MstLessonWearConfigSchema(BaseSchema):
     class Meta:
         model = MstLessonWearConfig
 
@@ -1287,20 +1297,20 @@ class MstLessonWearConfigSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class LessonWearConfigSchema(SQLAlchemyAutoSchema):
+class LessonWearConfigSchema(BaseSchema):
     class Meta:
         model = LessonWearConfig
         include_fk = True
         exclude = ('user_id',)
 
 
-class MstComicMenuSchema(SQLAlchemyAutoSchema):
+class MstComicMenuSchema(BaseSchema):
     class Meta:
         model = MstComicMenu
         ordered = True
 
 
-class MstTrainingUnitSchema(SQLAlchemyAutoSchema):
+class MstTrainingUnitSchema(BaseSchema):
     class Meta:
         model = MstTrainingUnit
 
@@ -1313,7 +1323,7 @@ class MstTrainingUnitSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstMasterLessonFiveConfigSchema(SQLAlchemyAutoSchema):
+class MstMasterLessonFiveConfigSchema(BaseSchema):
     class Meta:
         model = MstMasterLessonFiveConfig
         include_relationships = True
@@ -1332,7 +1342,7 @@ class MstMasterLessonFiveConfigSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstMasterLessonFiveConfigItemSchema(SQLAlchemyAutoSchema):
+class MstMasterLessonFiveConfigItemSchema(BaseSchema):
     class Meta:
         model = MstMasterLessonFiveConfigItem
         include_fk = True
@@ -1340,21 +1350,21 @@ class MstMasterLessonFiveConfigItemSchema(SQLAlchemyAutoSchema):
         exclude = ('ex_type', 'idol_type')
 
 
-class MstTitleImageSchema(SQLAlchemyAutoSchema):
+class MstTitleImageSchema(BaseSchema):
     class Meta:
         model = MstTitleImage
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstGameSettingSchema(SQLAlchemyAutoSchema):
+class MstGameSettingSchema(BaseSchema):
     class Meta:
         model = MstGameSetting
         include_relationships = True
@@ -1367,11 +1377,10 @@ class MstGameSettingSchema(SQLAlchemyAutoSchema):
         data['recover_jewel'] = [
             {
                 'amount': data['recover_jewel_amount'],
-                'begin_date': str_to_datetime(
-                    data['recover_jewel_begin_date']).astimezone(
+                'begin_date': data['recover_jewel_begin_date'].astimezone(
                     config.timezone),
-                'end_date': str_to_datetime(
-                    data['recover_jewel_end_date']).astimezone(config.timezone)
+                'end_date': data['recover_jewel_end_date'].astimezone(
+                    config.timezone)
             }
         ]
         del data['recover_jewel_amount']
@@ -1382,11 +1391,9 @@ class MstGameSettingSchema(SQLAlchemyAutoSchema):
         data['continue_jewel'] = [
             {
                 'amount': data['continue_jewel_amount'],
-                'begin_date': str_to_datetime(
-                    data['continue_jewel_begin_date']).astimezone(
+                'begin_date': data['continue_jewel_begin_date'].astimezone(
                     config.timezone),
-                'end_date': str_to_datetime(
-                    data['continue_jewel_end_date']).astimezone(
+                'end_date': data['continue_jewel_end_date'].astimezone(
                     config.timezone)
             }
         ]
@@ -1394,8 +1401,8 @@ class MstGameSettingSchema(SQLAlchemyAutoSchema):
         del data['continue_jewel_begin_date']
         del data['continue_jewel_end_date']
 
-        data['overflow_date'] = str_to_datetime(
-            data['overflow_date']).astimezone(config.timezone)
+        data['overflow_date'] = data['overflow_date'].astimezone(
+            config.timezone)
 
         # Populate lounge_chat_fetch_cycle.
         data['lounge_chat_fetch_cycle'] = [
@@ -1405,11 +1412,9 @@ class MstGameSettingSchema(SQLAlchemyAutoSchema):
         data['un_lock_song_jewel'] = [
             {
                 'amount': data['un_lock_song_jewel_amount'],
-                'begin_date': str_to_datetime(
-                    data['un_lock_song_jewel_begin_date']).astimezone(
+                'begin_date': data['un_lock_song_jewel_begin_date'].astimezone(
                     config.timezone),
-                'end_date': str_to_datetime(
-                    data['un_lock_song_jewel_end_date']).astimezone(
+                'end_date': data['un_lock_song_jewel_end_date'].astimezone(
                     config.timezone)
             }
         ]
@@ -1424,34 +1429,34 @@ class MstGameSettingSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstLoadingCharacterSchema(SQLAlchemyAutoSchema):
+class MstLoadingCharacterSchema(BaseSchema):
     class Meta:
         model = MstLoadingCharacter
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstCampaignSchema(SQLAlchemyAutoSchema):
+class MstCampaignSchema(BaseSchema):
     class Meta:
         model = MstCampaign
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['start_date'] = str_to_datetime(data['start_date']).astimezone(
+        data['start_date'] = data['start_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class CampaignSchema(SQLAlchemyAutoSchema):
+class CampaignSchema(BaseSchema):
     class Meta:
         model = Campaign
         include_relationships = True
@@ -1474,7 +1479,7 @@ class CampaignSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class GashaMedalSchema(SQLAlchemyAutoSchema):
+class GashaMedalSchema(BaseSchema):
     class Meta:
         model = GashaMedal
         include_relationships = True
@@ -1493,82 +1498,76 @@ class GashaMedalSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class GashaMedalExpireDateSchema(SQLAlchemyAutoSchema):
+class GashaMedalExpireDateSchema(BaseSchema):
     class Meta:
         model = GashaMedalExpireDate
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['expire_date'] = str_to_datetime(data['expire_date'])
         return data
 
 
-class JewelSchema(SQLAlchemyAutoSchema):
+class JewelSchema(BaseSchema):
     class Meta:
         model = Jewel
         ordered = True
 
 
-class RecordTimeSchema(SQLAlchemyAutoSchema):
+class RecordTimeSchema(BaseSchema):
     class Meta:
         model = RecordTime
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['time'] = str_to_datetime(data['time'])
         return data
 
 
-class MstTopicsSchema(SQLAlchemyAutoSchema):
+class MstTopicsSchema(BaseSchema):
     class Meta:
         model = MstTopics
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['release_date'] = str_to_datetime(
-            data['release_date']).astimezone(config.timezone)
+        data['release_date'] = data['release_date'].astimezone(config.timezone)
         return data
 
 
-class MstWhiteBoardSchema(SQLAlchemyAutoSchema):
+class MstWhiteBoardSchema(BaseSchema):
     class Meta:
         model = MstWhiteBoard
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['display_date'] = str_to_datetime(
-            data['display_date']).astimezone(config.timezone)
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['display_date'] = data['display_date'].astimezone(config.timezone)
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstEventSchema(SQLAlchemyAutoSchema):
+class MstEventSchema(BaseSchema):
     class Meta:
         model = MstEvent
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
+            config.timezone)
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['page_begin_date'] = data['page_begin_date'].astimezone(
+            config.timezone)
+        data['page_end_date'] = data['page_end_date'].astimezone(
             config.timezone)
-        data['page_begin_date'] = str_to_datetime(
-            data['page_begin_date']).astimezone(config.timezone)
-        data['page_end_date'] = str_to_datetime(
-            data['page_end_date']).astimezone(config.timezone)
-        data['boost_begin_date'] = str_to_datetime(data['boost_begin_date'])
-        data['boost_end_date'] = str_to_datetime(data['boost_end_date'])
         return data
 
 
-class MstEventTalkStorySchema(SQLAlchemyAutoSchema):
+class MstEventTalkStorySchema(BaseSchema):
     class Meta:
         model = MstEventTalkStory
 
@@ -1578,12 +1577,12 @@ class MstEventTalkStorySchema(SQLAlchemyAutoSchema):
         data['mst_event_talk_speaker_id'] = [
             int(x) for x in data['mst_event_talk_speaker_id'].split(',')]
 
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
         return data
 
 
-class EventTalkStorySchema(SQLAlchemyAutoSchema):
+class EventTalkStorySchema(BaseSchema):
     class Meta:
         model = EventTalkStory
         include_fk = True
@@ -1605,17 +1604,16 @@ class EventTalkStorySchema(SQLAlchemyAutoSchema):
         data['thumbnail_id'] = mst_event_talk_story['thumbnail_id']
         data['begin_date'] = mst_event_talk_story['begin_date']
         del data['mst_event_talk_story']
-        data['released_date'] = str_to_datetime(data['released_date'])
         return data
 
 
-class MstEventTalkCallTextSchema(SQLAlchemyAutoSchema):
+class MstEventTalkCallTextSchema(BaseSchema):
     class Meta:
         model = MstEventTalkCallText
         ordered = True
 
 
-class MstEventTalkControlSchema(SQLAlchemyAutoSchema):
+class MstEventTalkControlSchema(BaseSchema):
     class Meta:
         model = MstEventTalkControl
         include_fk = True
@@ -1634,21 +1632,21 @@ class MstEventTalkControlSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstMissionScheduleSchema(SQLAlchemyAutoSchema):
+class MstMissionScheduleSchema(BaseSchema):
     class Meta:
         model = MstMissionSchedule
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstPanelMissionSheetSchema(SQLAlchemyAutoSchema):
+class MstPanelMissionSheetSchema(BaseSchema):
     class Meta:
         model = MstPanelMissionSheet
         include_relationships = True
@@ -1658,9 +1656,9 @@ class MstPanelMissionSheetSchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
 
         # Populate sheet_reward_list.
@@ -1670,14 +1668,14 @@ class MstPanelMissionSheetSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class PanelMissionSheetSchema(SQLAlchemyAutoSchema):
+class PanelMissionSheetSchema(BaseSchema):
     class Meta:
         model = PanelMissionSheet
         include_fk = True
         exclude = ('user_id',)
 
 
-class MstMissionSchema(SQLAlchemyAutoSchema):
+class MstMissionSchema(BaseSchema):
     class Meta:
         model = MstMission
         include_relationships = True
@@ -1685,7 +1683,7 @@ class MstMissionSchema(SQLAlchemyAutoSchema):
     mst_mission_rewards = Nested('MstMissionRewardSchema', many=True)
 
 
-class MstMissionRewardSchema(SQLAlchemyAutoSchema):
+class MstMissionRewardSchema(BaseSchema):
     class Meta:
         model = MstMissionReward
         include_fk = True
@@ -1711,7 +1709,7 @@ class MstMissionRewardSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MissionSchema(SQLAlchemyAutoSchema):
+class MissionSchema(BaseSchema):
     class Meta:
         model = Mission
         include_fk = True
@@ -1741,9 +1739,6 @@ class MissionSchema(SQLAlchemyAutoSchema):
         # Populate mission_reward_list.
         data['mission_reward_list'] = mst_mission['mst_mission_rewards']
 
-        data['create_date'] = str_to_datetime(data['create_date'])
-        data['update_date'] = str_to_datetime(data['update_date'])
-        data['finish_date'] = str_to_datetime(data['finish_date'])
         if data['mission_state'] == 3:
             data['progress'] = data['goal']
         data['sort_id'] = mst_mission['sort_id']
@@ -1754,7 +1749,7 @@ class MissionSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstSpecialStorySchema(SQLAlchemyAutoSchema):
+class MstSpecialStorySchema(BaseSchema):
     class Meta:
         model = MstSpecialStory
         include_fk = True
@@ -1765,14 +1760,14 @@ class MstSpecialStorySchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
         return data
 
 
-class MstSpecialMVUnitIdolSchema(SQLAlchemyAutoSchema):
+class MstSpecialMVUnitIdolSchema(BaseSchema):
     class Meta:
         model = MstSpecialMVUnitIdol
         include_fk = True
@@ -1795,7 +1790,7 @@ class MstSpecialMVUnitIdolSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class SpecialStorySchema(SQLAlchemyAutoSchema):
+class SpecialStorySchema(BaseSchema):
     class Meta:
         model = SpecialStory
         include_fk = True
@@ -1857,7 +1852,7 @@ class SpecialStorySchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstEventStorySchema(SQLAlchemyAutoSchema):
+class MstEventStorySchema(BaseSchema):
     class Meta:
         model = MstEventStory
         include_fk = True
@@ -1869,21 +1864,22 @@ class MstEventStorySchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
+            config.timezone)
+        data['end_date'] = data['end_date'].astimezone(
             config.timezone)
-        data['end_date'] = str_to_datetime(data['end_date']).astimezone(
+        data['page_begin_date'] = data['page_begin_date'].astimezone(
             config.timezone)
-        data['page_begin_date'] = str_to_datetime(
-            data['page_begin_date']).astimezone(config.timezone)
-        data['page_end_date'] = str_to_datetime(
-            data['page_end_date']).astimezone(config.timezone)
-        data['release_item_begin_date'] = str_to_datetime(
-            data['release_item_begin_date']).astimezone(
-            config.timezone if data['release_mst_item_id'] else timezone.utc)
+        data['page_end_date'] = data['page_end_date'].astimezone(
+            config.timezone)
+        data['release_item_begin_date'] = (
+            data['release_item_begin_date'].astimezone(
+                config.timezone if data['release_mst_item_id']
+                else timezone.utc))
         return data
 
 
-class MstEventStoryMVUnitIdolSchema(SQLAlchemyAutoSchema):
+class MstEventStoryMVUnitIdolSchema(BaseSchema):
     class Meta:
         model = MstEventStoryMVUnitIdol
         include_fk = True
@@ -1906,7 +1902,7 @@ class MstEventStoryMVUnitIdolSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class EventStorySchema(SQLAlchemyAutoSchema):
+class EventStorySchema(BaseSchema):
     class Meta:
         model = EventStory
         include_fk = True
@@ -1956,7 +1952,6 @@ class EventStorySchema(SQLAlchemyAutoSchema):
         }
 
         data['release_event_point'] = mst_event_story['release_event_point']
-        data['released_date'] = str_to_datetime(data['released_date'])
         data['begin_date'] = mst_event_story['begin_date']
         data['end_date'] = mst_event_story['end_date']
         data['page_begin_date'] = mst_event_story['page_begin_date']
@@ -1974,7 +1969,7 @@ class EventStorySchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstEventMemorySchema(SQLAlchemyAutoSchema):
+class MstEventMemorySchema(BaseSchema):
     class Meta:
         model = MstEventMemory
         include_fk = True
@@ -1984,12 +1979,12 @@ class MstEventMemorySchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['release_item_begin_date'] = str_to_datetime(
-            data['release_item_begin_date']).astimezone(config.timezone)
+        data['release_item_begin_date'] = (
+            data['release_item_begin_date'].astimezone(config.timezone))
         return data
 
 
-class EventMemorySchema(SQLAlchemyAutoSchema):
+class EventMemorySchema(BaseSchema):
     class Meta:
         model = EventMemory
         include_fk = True
@@ -2053,7 +2048,7 @@ class EventMemorySchema(SQLAlchemyAutoSchema):
         return data
 
 
-class LPSchema(SQLAlchemyAutoSchema):
+class LPSchema(BaseSchema):
     class Meta:
         model = LP
         include_fk = True
@@ -2075,7 +2070,27 @@ class LPSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class ChallengeSongSchema(SQLAlchemyAutoSchema):
+class TopLPSchema(BaseSchema):
+    class Meta:
+        model = TopLP
+        include_fk = True
+        include_relationships = True
+        exclude = ('user_id', 'update_date', 'user')
+
+    mst_course = Nested('MstCourseSchema', only=('level',))
+    mst_song = Nested('MstSongSchema', only=('resource_id', 'sort_id'))
+
+    @post_dump
+    def _convert(self, data, **kwargs):
+        data['level'] = data['mst_course']['level']
+        data['resourse_id'] = data['mst_song']['resource_id']
+        data['sort_id'] = data['mst_song']['sort_id']
+        del data['mst_course']
+        del data['mst_song']
+        return data
+
+
+class ChallengeSongSchema(BaseSchema):
     class Meta:
         model = ChallengeSong
         include_fk = True
@@ -2083,21 +2098,20 @@ class ChallengeSongSchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['update_date'] = str_to_datetime(data['update_date'])
         return data
 
 
-class MapLevelSchema(SQLAlchemyAutoSchema):
+class MapLevelSchema(BaseSchema):
     class Meta:
         model = MapLevel
 
 
-class UnLockSongStatusSchema(SQLAlchemyAutoSchema):
+class UnLockSongStatusSchema(BaseSchema):
     class Meta:
         model = UnLockSongStatus
 
 
-class PendingSongSchema(SQLAlchemyAutoSchema):
+class PendingSongSchema(BaseSchema):
     class Meta:
         model = PendingSong
         include_fk = True
@@ -2226,7 +2240,6 @@ class PendingSongSchema(SQLAlchemyAutoSchema):
         data['user_summary']['is_friend'] = data['is_friend']
         del data['is_friend']
 
-        data['start_date'] = str_to_datetime(data['start_date'])
 
         # Populate threshold_list.
         data['threshold_list'] = [
@@ -2235,7 +2248,7 @@ class PendingSongSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class PendingJobSchema(SQLAlchemyAutoSchema):
+class PendingJobSchema(BaseSchema):
     class Meta:
         model = PendingJob
         include_fk = True
@@ -2254,18 +2267,18 @@ class PendingJobSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class PendingJobAnswerSchema(SQLAlchemyAutoSchema):
+class PendingJobAnswerSchema(BaseSchema):
     class Meta:
         model = PendingJobAnswer
         ordered = True
 
 
-class MstLoginBonusScheduleSchema(SQLAlchemyAutoSchema):
+class MstLoginBonusScheduleSchema(BaseSchema):
     class Meta:
         model = MstLoginBonusSchedule
 
 
-class LoginBonusScheduleSchema(SQLAlchemyAutoSchema):
+class LoginBonusScheduleSchema(BaseSchema):
     class Meta:
         model = LoginBonusSchedule
         include_fk = True
@@ -2292,13 +2305,13 @@ class LoginBonusScheduleSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstLoginBonusItemSchema(SQLAlchemyAutoSchema):
+class MstLoginBonusItemSchema(BaseSchema):
     class Meta:
         model = MstLoginBonusItem
         include_fk = True
 
 
-class LoginBonusItemSchema(SQLAlchemyAutoSchema):
+class LoginBonusItemSchema(BaseSchema):
     class Meta:
         model = LoginBonusItem
         include_fk = True
@@ -2317,13 +2330,13 @@ class LoginBonusItemSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstOfferSchema(SQLAlchemyAutoSchema):
+class MstOfferSchema(BaseSchema):
     class Meta:
         model = MstOffer
         include_fk = True
 
 
-class OfferSchema(SQLAlchemyAutoSchema):
+class OfferSchema(BaseSchema):
     class Meta:
         model = Offer
         include_fk = True
@@ -2351,7 +2364,6 @@ class OfferSchema(SQLAlchemyAutoSchema):
         data['parameter_type'] = mst_offer['parameter_type']
         data['border_value'] = mst_offer['border_value']
         del data['mst_offer']
-        data['start_date'] = str_to_datetime(data['start_date'])
 
         # Populate card_list.
         data['card_list'] = (
@@ -2363,7 +2375,7 @@ class OfferSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class OfferCardSchema(SQLAlchemyAutoSchema):
+class OfferCardSchema(BaseSchema):
     class Meta:
         model = OfferCard
         include_relationships = True
@@ -2375,13 +2387,13 @@ class OfferCardSchema(SQLAlchemyAutoSchema):
         return data['card']
 
 
-class MstOfferTextSchema(SQLAlchemyAutoSchema):
+class MstOfferTextSchema(BaseSchema):
     class Meta:
         model = MstOfferText
         include_fk = True
 
 
-class OfferTextSchema(SQLAlchemyAutoSchema):
+class OfferTextSchema(BaseSchema):
     class Meta:
         model = OfferText
         include_fk = True
@@ -2402,19 +2414,17 @@ class OfferTextSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstBannerSchema(SQLAlchemyAutoSchema):
+class MstBannerSchema(BaseSchema):
     class Meta:
         model = MstBanner
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['open_date'] = str_to_datetime(data['open_date'])
-        data['close_date'] = str_to_datetime(data['close_date'])
         return data
 
 
-class ProfileSchema(SQLAlchemyAutoSchema):
+class ProfileSchema(BaseSchema):
     class Meta:
         model = Profile
         include_fk = True
@@ -2460,7 +2470,7 @@ class ProfileSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class GuestSchema(SQLAlchemyAutoSchema):
+class GuestSchema(BaseSchema):
     class Meta:
         model = Profile
         include_fk = True
@@ -2500,7 +2510,7 @@ class GuestSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class HelperCardSchema(SQLAlchemyAutoSchema):
+class HelperCardSchema(BaseSchema):
     class Meta:
         model = HelperCard
         include_relationships = True
@@ -2508,39 +2518,38 @@ class HelperCardSchema(SQLAlchemyAutoSchema):
     card = Nested('CardSchema')
 
 
-class ClearSongCountSchema(SQLAlchemyAutoSchema):
+class ClearSongCountSchema(BaseSchema):
     class Meta:
         model = ClearSongCount
         ordered = True
 
 
-class FullComboSongCountSchema(SQLAlchemyAutoSchema):
+class FullComboSongCountSchema(BaseSchema):
     class Meta:
         model = FullComboSongCount
         ordered = True
 
 
-class LastUpdateDateSchema(SQLAlchemyAutoSchema):
+class LastUpdateDateSchema(BaseSchema):
     class Meta:
         model = LastUpdateDate
         ordered = True
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['last_update_date'] = str_to_datetime(data['last_update_date'])
         if data['last_update_date_type'] in [9, 10, 11, 12, 13, 14, 15, 17]:
             data['last_update_date'] = data['last_update_date'].astimezone(
                 config.timezone)
         return data
 
 
-class MstBirthdayCalendarSchema(SQLAlchemyAutoSchema):
+class MstBirthdayCalendarSchema(BaseSchema):
     class Meta:
         model = MstBirthdayCalendar
         ordered = True
 
 
-class BirthdaySchema(SQLAlchemyAutoSchema):
+class BirthdaySchema(BaseSchema):
     class Meta:
         model = Birthday
         include_fk = True
@@ -2548,7 +2557,7 @@ class BirthdaySchema(SQLAlchemyAutoSchema):
         ordered = True
 
 
-class PresentSchema(SQLAlchemyAutoSchema):
+class PresentSchema(BaseSchema):
     class Meta:
         model = Present
         include_fk = True
@@ -2561,8 +2570,6 @@ class PresentSchema(SQLAlchemyAutoSchema):
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['end_date'] = str_to_datetime(data['end_date'])
-        data['create_date'] = str_to_datetime(data['create_date'])
 
         # Populate empty item.
         if not data['item']:
@@ -2602,18 +2609,18 @@ class PresentSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class MstAchievementSchema(SQLAlchemyAutoSchema):
+class MstAchievementSchema(BaseSchema):
     class Meta:
         model = MstAchievement
 
     @post_dump
     def _convert(self, data, **kwargs):
-        data['begin_date'] = str_to_datetime(data['begin_date']).astimezone(
+        data['begin_date'] = data['begin_date'].astimezone(
             config.timezone)
         return data
 
 
-class AchievementSchema(SQLAlchemyAutoSchema):
+class AchievementSchema(BaseSchema):
     class Meta:
         model = Achievement
         include_fk = True
@@ -2634,7 +2641,7 @@ class AchievementSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class RandomLiveSchema(SQLAlchemyAutoSchema):
+class RandomLiveSchema(BaseSchema):
     class Meta:
         model = RandomLive
         include_fk = True
@@ -2654,7 +2661,7 @@ class RandomLiveSchema(SQLAlchemyAutoSchema):
         return data
 
 
-class RandomLiveIdolSchema(SQLAlchemyAutoSchema):
+class RandomLiveIdolSchema(BaseSchema):
     class Meta:
         model = RandomLiveIdol
         include_fk = True
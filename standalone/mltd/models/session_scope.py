@@ -0,0 +1,243 @@
+"""Request-scoped database sessions.
+
+Services used to open their own 'Session(engine)' and commit it, so a
+request (or a batch of JSON-RPC calls) could run several independent
+SQLite write transactions. Instead, the request handler opens one
+connection and one transaction per request:
+    with session_scope.request():
+        JSONRPCResponseManager.handle(request, dispatcher, context)
+Each JSON-RPC method wrapped by 'session_scope.method()' runs in a
+savepoint, and services get the method's session with:
+    with request_session() as session:
+A service calling 'session.commit()' only releases the savepoint, and a
+method raising an exception rolls back its own savepoint without
+affecting the other methods of the batch. The transaction is committed
+once at the end of the request.
+
+The transaction begins with BEGIN IMMEDIATE, so that concurrent requests
+queue on the SQLite write lock when they start instead of failing when
+upgrading a read lock midway. With several API worker processes, that
+would run all requests one at a time, so workers set 'begin_immediate'
+to False: requests begin with a deferred transaction and only take the
+write lock when they first write, which lets read-only requests run in
+parallel with a writer in WAL mode. If upgrading to the write lock
+fails, the request is rolled back and LockConflict is raised, and the
+handler runs it again with BEGIN IMMEDIATE.
+
+Outside of a request (e.g. the scheduler, the console and module entry
+points), 'request_session()' opens a plain 'Session(engine)' as before.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from mltd.models.engine import engine
+from mltd.models.shards import shard_router
+from mltd.servers.logging import logger
+
+# (connection, session of the current method or None, request state)
+_current = ContextVar('request_session', default=None)
+_lock_error_codes = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_BUSY_SNAPSHOT)
+
+
+class LockConflict(Exception):
+    """A deferred request could not take the write lock."""
+
+
+def _is_lock_error(e):
+    """Whether an exception is SQLite failing to take a lock."""
+    if isinstance(e, OperationalError):
+        e = e.orig
+    return (isinstance(e, sqlite3.OperationalError)
+            and (getattr(e, 'sqlite_errorcode', None) in _lock_error_codes
+                 or 'database is locked' in str(e)))
+
+
+class SessionScope:
+    """Opens request transactions and method savepoints."""
+
+    def __init__(self):
+        # Whether requests take the write lock when they begin.
+        self.begin_immediate = True
+        self._lock = threading.Lock()
+        self._rollback_callbacks = []
+        self._stats = {
+            'requests': 0,
+            'transactions': 0,
+            'rollbacks': 0,
+            'lock_conflicts': 0,
+            'savepoints': 0,
+            'savepoint_rollbacks': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def on_rollback(self, callback):
+        """Register a function called after a request is rolled back.
+
+        Caches filled from uncommitted data of the request can be
+        invalidated here.
+        Args:
+            callback: A function without arguments.
+        """
+        self._rollback_callbacks.append(callback)
+
+    @contextmanager
+    def request(self, immediate=None, user_id=None):
+        """Run a request in a single transaction.
+
+        The transaction is committed when the block exits, or rolled
+        back if it raises an exception.
+        Args:
+            immediate: Whether to begin with BEGIN IMMEDIATE, or None
+                       for 'begin_immediate'.
+            user_id: ID of the user sending the request, whose shard
+                     the transaction runs in (see 'mltd.models.shards').
+        Raises:
+            LockConflict: A deferred transaction could not take the
+                          write lock, so the request was rolled back and
+                          should be run again with immediate=True.
+        """
+        if _current.get() is not None:
+            # Nested requests join the outer transaction.
+            yield
+            return
+
+        if immediate is None:
+            immediate = self.begin_immediate
+        self._count('requests')
+        with shard_router.engine_for(user_id).connect() as connection:
+            # Let SQLAlchemy emit BEGIN and SAVEPOINT itself instead of
+            # the sqlite3 module, which would commit on releasing the
+            # first savepoint.
+            dbapi_connection = connection.connection.driver_connection
+            isolation_level = dbapi_connection.isolation_level
+            dbapi_connection.isolation_level = None
+            # JSON-RPC turns exceptions of methods into error
+            # responses, so methods record lock errors here.
+            state = {'lock_error': False}
+            token = _current.set((connection, None, state))
+            try:
+                transaction = connection.begin()
+                connection.exec_driver_sql(
+                    'BEGIN IMMEDIATE' if immediate else 'BEGIN')
+                try:
+                    yield
+                    if state['lock_error']:
+                        raise LockConflict()
+                    transaction.commit()
+                except BaseException as e:
+                    if transaction.is_active:
+                        transaction.rollback()
+                    self._rolled_back()
+                    if not immediate and (isinstance(e, LockConflict)
+                                          or _is_lock_error(e)):
+                        self._count('lock_conflicts')
+                        if isinstance(e, LockConflict):
+                            raise
+                        raise LockConflict() from e
+                    raise
+                self._count('transactions')
+            finally:
+                _current.reset(token)
+                dbapi_connection.isolation_level = isolation_level
+
+    def _rolled_back(self):
+        self._count('rollbacks')
+        for callback in self._rollback_callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception('Rollback callback failed')
+
+    def method(self, f):
+        """Wrap a service method to run in a savepoint of the request.
+
+        Outside of a request, the method is called unchanged.
+        Args:
+            f: A JSON-RPC service method.
+        Returns:
+            The wrapped method.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            current = _current.get()
+            if current is None:
+                return f(*args, **kwargs)
+            connection, _, state = current
+            self._count('savepoints')
+            with Session(
+                bind=connection,
+                join_transaction_mode='create_savepoint'
+            ) as session:
+                token = _current.set((connection, session, state))
+                try:
+                    return f(*args, **kwargs)
+                except BaseException as e:
+                    self._count('savepoint_rollbacks')
+                    if _is_lock_error(e):
+                        state['lock_error'] = True
+                    raise
+                finally:
+                    _current.reset(token)
+
+        return wrapper
+
+    def summary(self):
+        """Return transaction statistics.
+
+        Returns:
+            A dict containing the following keys: requests,
+            transactions (committed requests), rollbacks (requests
+            rolled back), lock_conflicts (deferred requests rolled back
+            to be run again with BEGIN IMMEDIATE), savepoints (methods
+            run in a savepoint), savepoint_rollbacks (methods that
+            raised an exception) and methods_per_request.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['methods_per_request'] = (
+            stats['savepoints'] / stats['requests'] if stats['requests']
+            else 0)
+        return stats
+
+    def reset(self):
+        """Discard all collected statistics."""
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+
+session_scope = SessionScope()
+
+
+@contextmanager
+def request_session():
+    """Get the session of the current request.
+
+    Within a method wrapped by 'session_scope.method()', the method's
+    session is returned and stays open after the block. Elsewhere in a
+    request, a new session in its own savepoint is opened. Outside of a
+    request, a plain 'Session(engine)' is opened.
+    Yields:
+        An SQLAlchemy session.
+    """
+    current = _current.get()
+    if current is None:
+        with Session(engine) as session:
+            yield session
+    elif current[1] is not None:
+        yield current[1]
+    else:
+        with Session(
+            bind=current[0],
+            join_transaction_mode='create_savepoint'
+        ) as session:
+            yield session
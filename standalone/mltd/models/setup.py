@@ -4,11 +4,14 @@ import sys
 from base64 import b64encode
 from uuid import UUID, uuid4
 
-from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy import delete, func, insert, select, text, update
 from sqlalchemy.orm import Session
 
 from mltd.models.engine import engine
+from mltd.models.migrations import Migration, migrate
 from mltd.models.models import *
+from mltd.models.progression import get_progression
+from mltd.models.shards import shard_router
 from mltd.servers.config import config, version, version_tuple
 from mltd.servers.i18n import translation
 from mltd.servers.logging import logger
@@ -271,23 +274,26 @@ def setup(conn=None):
 
     with Session(engine) as session:
         # Insert "admin" data (user with everything fully unlocked).
+        progression = get_progression(session)
+        level = 900
+        theater_fan = 3_978_000_000
         user = User(
             user_id=UUID('ffffffff-ffff-ffff-ffff-ffffffffffff'),
             search_id='00000000',
             name='MLTDrelive',
             money=9_999_999,
-            _vitality=240,
-            max_vitality=240,
+            _vitality=progression.max_vitality[level],
+            max_vitality=progression.max_vitality[level],
             live_ticket=500,
             exp=0,
-            next_exp=89_950,
-            level=900,
-            theater_fan=3_978_000_000,
+            next_exp=progression.next_exp[level],
+            level=level,
+            theater_fan=theater_fan,
             last_login_date=datetime(2022, 1, 28, 4, tzinfo=timezone.utc),
             is_tutorial_finished=True,
-            producer_rank=8,
+            producer_rank=progression.rank_for_fan(theater_fan),
             first_time_date=datetime(2019, 8, 30, 3, tzinfo=timezone.utc),
-            max_friend=100
+            max_friend=progression.max_friend[level]
         )
         user.user_id_hash = b64encode(
             bytes(str(user.user_id), encoding='ascii') + bytes.fromhex(
@@ -882,67 +888,120 @@ def check_database_version():
     return db_version
 
 
-def upgrade_database():
-    db_version = check_database_version()
-
-    if version_tuple(db_version) < version_tuple('0.0.4'):
-        logger.info('Upgrading database to v0.0.4...')
-        with Session(engine) as session:
-            table = Base.metadata.tables['mst_costume_bulk_change_group']
-            table.create(bind=session.get_bind())
-
-            _insert_csv_data(session, _mst_data_path(),
-                             'mst_costume_bulk_change_group.csv')
-
-            session.execute(
-                update(MstOffer)
-                .where(MstOffer.mst_offer_id == 43)
-                .values(resource_id='bg2d_g1121')
-            )
-
-            session.execute(
-                update(ServerVersion)
-                .values(version='0.0.4')
-            )
-
-            session.commit()
-        logger.info('Database upgraded to v0.0.4.')
-
-    if version_tuple(db_version) < version_tuple('0.1.0'):
-        logger.info('Upgrading database to v0.1.0...')
-        with Session(engine) as session:
-            session.execute(
-                delete(SongUnitIdol)
-                .where(SongUnitIdol.mst_song_id == 10021)
-            )
-            session.execute(
-                delete(SongUnit)
-                .where(SongUnit.mst_song_id == 10021)
-            )
-
-            session.execute(
-                update(ServerVersion)
-                .values(version='0.1.0')
-            )
-
-            session.commit()
-        logger.info('Database upgraded to v0.1.0.')
-
-    if version_tuple(db_version) < version_tuple('0.1.3'):
-        logger.info('Upgrading database to v0.1.3...')
-        with Session(engine) as session:
-            table = Base.metadata.tables['mst_white_board']
-            table.create(bind=session.get_bind())
-
-            _insert_csv_data(session, _mst_data_path(), 'mst_white_board.csv')
-
-            session.execute(
-                update(ServerVersion)
-                .values(version='0.1.3')
+def _upgrade_0_0_4(session: Session):
+    table = Base.metadata.tables['mst_costume_bulk_change_group']
+    table.create(bind=session.get_bind(), checkfirst=True)
+
+    session.execute(delete(table))
+    _insert_csv_data(session, _mst_data_path(),
+                     'mst_costume_bulk_change_group.csv')
+
+    session.execute(
+        update(MstOffer)
+        .where(MstOffer.mst_offer_id == 43)
+        .values(resource_id='bg2d_g1121')
+    )
+
+
+def _remove_song_units_0_1_0(session: Session, user_ids):
+    session.execute(
+        delete(SongUnitIdol)
+        .where(SongUnitIdol.user_id.in_(user_ids))
+        .where(SongUnitIdol.mst_song_id == 10021)
+    )
+    session.execute(
+        delete(SongUnit)
+        .where(SongUnit.user_id.in_(user_ids))
+        .where(SongUnit.mst_song_id == 10021)
+    )
+
+
+def _upgrade_0_1_3(session: Session):
+    table = Base.metadata.tables['mst_white_board']
+    table.create(bind=session.get_bind(), checkfirst=True)
+
+    session.execute(delete(table))
+    _insert_csv_data(session, _mst_data_path(), 'mst_white_board.csv')
+
+
+def _upgrade_users_0_1_4(session: Session):
+    for table_name in ['top_lp', 'collection_version']:
+        shard_router.create_user_table(session.connection(),
+                                       Base.metadata.tables[table_name])
+
+
+def _populate_top_lp_0_1_4(session: Session, user_ids):
+    """Populate top 10 song LPs of each idol type from LP list.
+
+    Args:
+        session: Existing SQLAlchemy session.
+        user_ids: A list of user IDs, or None for all users.
+    """
+    ranked_lp = (
+        select(
+            LP.user_id,
+            LP.mst_song_id,
+            MstSong.idol_type,
+            LP.course,
+            LP.lp,
+            LP.is_playable,
+            LP.update_date,
+            func.row_number().over(
+                partition_by=[LP.user_id, MstSong.idol_type],
+                order_by=[LP.lp.desc(), LP.update_date]
+            ).label('rank')
+        )
+        .join(MstSong, MstSong.mst_song_id == LP.mst_song_id)
+    )
+    delete_stmt = delete(TopLP)
+    if user_ids is not None:
+        ranked_lp = ranked_lp.where(LP.user_id.in_(user_ids))
+        delete_stmt = delete_stmt.where(TopLP.user_id.in_(user_ids))
+    ranked_lp = ranked_lp.subquery()
+
+    # Top LPs updated by requests while the migration is running are
+    # computed again from the LP list.
+    session.execute(delete_stmt)
+    session.execute(
+        insert(TopLP)
+        .from_select(
+            ['user_id', 'mst_song_id', 'idol_type', 'course', 'lp',
+             'is_playable', 'update_date'],
+            select(
+                ranked_lp.c.user_id,
+                ranked_lp.c.mst_song_id,
+                ranked_lp.c.idol_type,
+                ranked_lp.c.course,
+                ranked_lp.c.lp,
+                ranked_lp.c.is_playable,
+                ranked_lp.c.update_date
             )
-
-            session.commit()
-        logger.info('Database upgraded to v0.1.3.')
+            .where(ranked_lp.c.rank <= 10)
+        )
+    )
+
+
+migrations = [
+    Migration('0.0.4', schema=_upgrade_0_0_4),
+    Migration('0.1.0', backfill=_remove_song_units_0_1_0, online=True),
+    Migration('0.1.3', schema=_upgrade_0_1_3),
+    Migration('0.1.4', user_schema=_upgrade_users_0_1_4,
+              backfill=_populate_top_lp_0_1_4, online=True),
+]
+
+
+def upgrade_database(online=False):
+    """Upgrade the database to the application version.
+
+    See 'mltd.models.migrations'.
+    Args:
+        online: Whether to defer the data migrations that may run while
+                the server is serving requests.
+    Returns:
+        A list of the Migrations whose data migrations have been
+        deferred, to be passed to migrations.start_deferred().
+    """
+    return migrate(migrations, check_database_version(), online)
 
 
 if __name__ == '__main__':
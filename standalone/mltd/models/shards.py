@@ -0,0 +1,394 @@
+"""User-sharded storage.
+
+With 'shards = K' in config.ini (K > 0), the per-user tables (user and
+every table keyed by a user ID) are stored in K shard files
+('mltd-relive-shard-<index>.db') instead of 'mltd-relive.db', so that
+requests of users in different shards do not wait for the same SQLite
+write lock. Master data stays in 'mltd-relive.db', which each shard
+connection attaches read-only as 'master'. SQLite resolves unqualified
+table names in the main database first and then in attached databases,
+so queries joining per-user tables with master tables run unchanged.
+
+A user is assigned to a shard by a consistent hash ring, so adding a
+shard only moves the users whose ring positions the new shard takes
+over (about 1/K of them). The request handler passes the user ID of
+each request (header 'X-Application-User-Id', or the params of requests
+such as 'AuthService.Login') to 'session_scope.request()', which opens
+the connection to the user's shard. Requests without a user ID are
+rejected, since the per-user tables of 'mltd-relive.db' are emptied
+once the users are split into shards. Features reading other users
+(guests, song ranking) and batch jobs (daily reset) query every shard
+with scatter() and gather().
+
+Foreign keys to master tables and between different users (friends, the
+guest of a pending song) cannot be enforced across database files, so
+they are left out of the shard schema.
+
+Running this module as a script creates the shards and copies the users
+of 'mltd-relive.db' to them, or prints the number of users per shard.
+    python -m mltd.models.shards split [--shards K]
+    python -m mltd.models.shards stats [--shards K]
+"""
+import argparse
+import bisect
+import hashlib
+import os
+import threading
+from uuid import UUID
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from mltd.models.engine import engine
+from mltd.models.models import Base, User
+from mltd.models.query_tracer import query_tracer
+from mltd.servers.config import config
+from mltd.servers.logging import logger
+
+master_path = 'mltd-relive.db'
+# Columns referring to other users, which may be in another shard
+cross_user_columns = {('friend', 'friend_id'),
+                      ('pending_song', 'guest_user_id')}
+
+
+def _user_tables():
+    """Find the per-user tables.
+
+    Returns:
+        A dict mapping each per-user table, in dependency order, to the
+        name of its column containing the user ID.
+    """
+    tables = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name == 'user':
+            tables[table] = 'user_id'
+        elif 'user_id' in table.c:
+            tables[table] = 'user_id'
+        else:
+            # Tables keyed by the user through a foreign key, such as
+            # profile.id_ and helper_card.id_
+            for fk in table.foreign_keys:
+                if (fk.column.table in tables
+                        and fk.column.name == tables[fk.column.table]):
+                    tables[table] = fk.parent.name
+                    break
+    return tables
+
+
+user_tables = _user_tables()
+
+
+def shard_path(index):
+    return f'mltd-relive-shard-{index}.db'
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          'big')
+
+
+class ShardRing:
+    """Consistent hash ring mapping user IDs to shard indexes."""
+
+    def __init__(self, shards, vnodes=64):
+        """Build the ring.
+
+        Args:
+            shards: Number of shards.
+            vnodes: Number of points of each shard on the ring. More
+                    points spread users more evenly.
+        """
+        self.shards = shards
+        points = sorted((_ring_hash(f'{index}-{vnode}'.encode()), index)
+                        for index in range(shards)
+                        for vnode in range(vnodes))
+        self._hashes = [x[0] for x in points]
+        self._indexes = [x[1] for x in points]
+
+    def shard_of(self, user_id):
+        """Get the shard index of a user.
+
+        Args:
+            user_id: User ID as a UUID or str.
+        Returns:
+            An int between 0 and shards - 1.
+        """
+        if not isinstance(user_id, UUID):
+            user_id = UUID(user_id)
+        i = bisect.bisect(self._hashes, _ring_hash(user_id.bytes))
+        return self._indexes[i % len(self._indexes)]
+
+
+class ShardRouter:
+    """Opens the engine of each shard and routes users to them."""
+
+    def __init__(self, shards):
+        """Initialize the router.
+
+        Args:
+            shards: Number of shards, or 0 to store all users in
+                    'mltd-relive.db'.
+        """
+        self.shards = shards
+        self.ring = ShardRing(shards) if shards else None
+        self._lock = threading.Lock()
+        self._engines = {}
+
+    @property
+    def enabled(self):
+        return self.shards > 0
+
+    def paths(self):
+        """Get the file paths of all shards."""
+        return [shard_path(i) for i in range(self.shards)]
+
+    def _create_engine(self, index):
+        shard_engine = create_engine(
+            f'sqlite+pysqlite:///file:{shard_path(index)}'
+            f'?mode=rwc&uri=true')
+
+        @event.listens_for(shard_engine, 'connect')
+        def attach_master(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('ATTACH DATABASE ? AS master',
+                           (f'file:{master_path}?mode=ro',))
+            cursor.close()
+
+        if config.query_trace:
+            query_tracer.enable(shard_engine, config.slow_query_ms)
+        return shard_engine
+
+    def shard_engine(self, index):
+        """Get the engine of a shard, creating it on first use."""
+        shard_engine = self._engines.get(index)
+        if shard_engine is None:
+            with self._lock:
+                shard_engine = self._engines.get(index)
+                if shard_engine is None:
+                    shard_engine = self._create_engine(index)
+                    self._engines[index] = shard_engine
+        return shard_engine
+
+    def engine_for(self, user_id):
+        """Get the engine storing a user.
+
+        Args:
+            user_id: User ID as a UUID or str, or None.
+        Returns:
+            The engine of the user's shard, or the main engine if
+            sharding is disabled.
+        Raises:
+            ValueError: Sharding is enabled and no user ID is given. The
+                        main database does not store users then.
+        """
+        if not self.enabled:
+            return engine
+        if not user_id:
+            raise ValueError('A user ID is required when sharding is '
+                             'enabled')
+        return self.shard_engine(self.ring.shard_of(user_id))
+
+    def user_engines(self):
+        """Get the engines of all shards, or the main engine."""
+        if not self.enabled:
+            return [engine]
+        return [self.shard_engine(i) for i in range(self.shards)]
+
+    def scatter(self, session, fetch):
+        """Run a query on every database storing users.
+
+        Args:
+            session: Session of the current request, reused for its own
+                     database.
+            fetch: A function taking a session and returning a list.
+                   Results are used after the sessions of other shards
+                   are closed, so it should return plain values (e.g.
+                   dumped schemas) rather than ORM objects.
+        Returns:
+            The concatenated lists returned by 'fetch'.
+        """
+        if not self.enabled:
+            return fetch(session)
+        own_engine = session.get_bind().engine
+        results = []
+        for shard_engine in self.user_engines():
+            if shard_engine is own_engine:
+                results.extend(fetch(session))
+            else:
+                with Session(shard_engine) as shard_session:
+                    results.extend(fetch(shard_session))
+        return results
+
+    def gather(self, session, user_ids, fetch):
+        """Run a query for some users on the databases storing them.
+
+        Args:
+            session: Session of the current request, reused for its own
+                     database.
+            user_ids: User IDs in UUID format.
+            fetch: A function taking a session and a list of user IDs
+                   stored in it, and returning a list. See scatter().
+        Returns:
+            The concatenated lists returned by 'fetch'.
+        """
+        if not self.enabled:
+            return fetch(session, list(user_ids))
+        shard_user_ids = {}
+        for user_id in user_ids:
+            shard_user_ids.setdefault(
+                self.ring.shard_of(user_id), []).append(user_id)
+        own_engine = session.get_bind().engine
+        results = []
+        for index, ids in sorted(shard_user_ids.items()):
+            shard_engine = self.shard_engine(index)
+            if shard_engine is own_engine:
+                results.extend(fetch(session, ids))
+            else:
+                with Session(shard_engine) as shard_session:
+                    results.extend(fetch(shard_session, ids))
+        return results
+
+    def create_user_table(self, connection, table):
+        """Create a per-user table if it does not exist.
+
+        In a shard, foreign keys to master tables and to other users are
+        left out, since SQLite only enforces foreign keys within a
+        database file.
+        Args:
+            connection: Connection to the main database or to a shard.
+            table: A table in 'user_tables'.
+        """
+        if connection.engine not in self._engines.values():
+            table.create(connection, checkfirst=True)
+            return
+        foreign_keys = [
+            fk for fk in table.foreign_key_constraints
+            if fk.referred_table in user_tables
+            and not any((table.name, column.name) in cross_user_columns
+                        for column in fk.columns)]
+        connection.execute(CreateTable(
+            table, include_foreign_key_constraints=foreign_keys,
+            if_not_exists=True))
+        for index_ in table.indexes:
+            connection.execute(CreateIndex(index_, if_not_exists=True))
+
+    def create_schema(self, index):
+        """Create the per-user tables in a shard."""
+        with self.shard_engine(index).begin() as connection:
+            for table in user_tables:
+                self.create_user_table(connection, table)
+
+    def split(self):
+        """Create the shards and copy the users of the main database.
+
+        Rows are copied table by table with INSERT ... SELECT from the
+        attached main database, for the users of each shard. Once every
+        shard is created, the rows are deleted from the main database,
+        so that stale copies of users cannot be read or changed there.
+        Returns:
+            A list of the number of users copied to each shard.
+        Raises:
+            FileExistsError: A shard already exists.
+        """
+        for index in range(self.shards):
+            if os.path.exists(shard_path(index)):
+                raise FileExistsError(shard_path(index))
+        with Session(engine) as session:
+            user_ids = session.scalars(select(User.user_id)).all()
+        shard_user_ids = [[] for _ in range(self.shards)]
+        for user_id in user_ids:
+            shard_user_ids[self.ring.shard_of(user_id)].append(user_id.hex)
+
+        for index, ids in enumerate(shard_user_ids):
+            self.create_schema(index)
+            with self.shard_engine(index).begin() as connection:
+                connection.exec_driver_sql(
+                    'CREATE TEMP TABLE shard_user (user_id PRIMARY KEY)')
+                # Versions of bulk changes are kept by the nil UUID.
+                connection.exec_driver_sql(
+                    'INSERT INTO shard_user VALUES (?)',
+                    [(x,) for x in [UUID(int=0).hex, *ids]])
+                for table, user_column in user_tables.items():
+                    columns = ', '.join(f'"{x.name}"' for x in table.c)
+                    connection.exec_driver_sql(
+                        f'INSERT INTO main."{table.name}" ({columns}) '
+                        f'SELECT {columns} FROM master."{table.name}" '
+                        f'WHERE "{user_column}" IN '
+                        f'(SELECT user_id FROM shard_user)')
+                connection.exec_driver_sql('DROP TABLE shard_user')
+            logger.info(f'Copied {len(ids)} users to {shard_path(index)}')
+
+        with engine.begin() as connection:
+            for table in reversed(user_tables):
+                connection.exec_driver_sql(f'DELETE FROM "{table.name}"')
+        logger.info(f'Deleted the copied users from {master_path}')
+        return [len(x) for x in shard_user_ids]
+
+    def ensure_shards(self):
+        """Create the shards if sharding is enabled and none exist yet,
+        copying the users of the main database.
+
+        Raises:
+            FileNotFoundError: Only some of the shards exist, e.g. the
+                               number of shards was changed.
+        """
+        if not self.enabled:
+            return
+        missing = [shard_path(i) for i in range(self.shards)
+                   if not os.path.exists(shard_path(i))]
+        if len(missing) == self.shards:
+            self.split()
+        elif missing:
+            raise FileNotFoundError(', '.join(missing))
+
+    def user_counts(self):
+        """Get the number of users in each shard."""
+        counts = []
+        for shard_engine in self.user_engines():
+            with Session(shard_engine) as session:
+                counts.append(session.scalar(
+                    select(func.count()).select_from(User)))
+        return counts
+
+    def dispose(self):
+        """Close the connections of all shard engines."""
+        with self._lock:
+            for shard_engine in self._engines.values():
+                shard_engine.dispose()
+            self._engines.clear()
+
+    def remove_shards(self):
+        """Delete the shard files, e.g. when resetting all data."""
+        self.dispose()
+        for index in range(self.shards):
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(shard_path(index) + suffix):
+                    os.remove(shard_path(index) + suffix)
+
+
+shard_router = ShardRouter(config.shards)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Split users into shards.')
+    parser.add_argument('command', choices=['split', 'stats'])
+    parser.add_argument('--shards', type=int, default=config.shards,
+                        help='number of shards (default: shards in '
+                             'config.ini)')
+    args = parser.parse_args()
+    if args.shards <= 0:
+        raise SystemExit('Set the number of shards with --shards or '
+                         'shards in config.ini')
+
+    router = ShardRouter(args.shards)
+    if args.command == 'split':
+        try:
+            router.split()
+        except FileExistsError as e:
+            raise SystemExit(f'Shard already exists: {e}')
+    elif not all(os.path.exists(shard_path(i)) for i in range(args.shards)):
+        raise SystemExit('Shards not found, run "split" first')
+    for index, count in enumerate(router.user_counts()):
+        print(f'{shard_path(index)}: {count} users')
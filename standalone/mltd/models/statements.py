@@ -0,0 +1,305 @@
+"""Lambda statements for hot queries.
+
+SQLAlchemy caches the compiled SQL of every statement, but a service
+building a query with select() still constructs the whole statement
+object and generates its cache key on every call, which costs more
+Python time than SQLite takes to run a simple lookup. The queries
+executed most often when replaying a login, song selection and live
+(users by ID, missions by class in LiveService.FinishSong, course cost
+and score thresholds in LiveService.StartSong) are defined here as
+lambda statements instead, which are constructed once per call site and
+only extract the bound values on later calls.
+    user = session.scalars(select_user(user_id, 'user-core')).one()
+
+warm_up() executes each statement once at startup so that its compiled
+form is in the cache of the main engine and of each shard engine (see
+'mltd.models.shards') before the first request, and cache_summary()
+reports the hit rate of the compiled caches for all statements executed
+since then.
+
+Running this module as a script reports the Python-side time per query
+(total time minus the time spent in SQLite) of each statement built
+with select() and as a lambda statement.
+    python -m mltd.models.statements [--user-id USER_ID] [--repeat N]
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+from uuid import UUID
+
+from sqlalchemy import event, lambda_stmt, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from mltd.models.engine import engine
+from mltd.models.loaders import loader_profile
+from mltd.models.models import (Course, Mission, MstCourse, MstMission,
+                                MstScoreThreshold, User)
+from mltd.models.shards import shard_router
+from mltd.servers.logging import logger
+
+
+def select_user(user_id, profile=None):
+    """Select a user by ID.
+
+    Args:
+        user_id: User ID in UUID format.
+        profile: Name of the loader profile to apply (see
+                 'mltd.models.loaders'), or None.
+    Returns:
+        A statement selecting a User.
+    """
+    stmt = lambda_stmt(lambda: select(User).where(User.user_id == user_id))
+    if profile:
+        options = loader_profile(profile)
+        # The options depend only on the profile name, which is part of
+        # the cache key.
+        stmt = stmt.add_criteria(lambda s: s.options(*options),
+                                 track_on=[profile],
+                                 track_closure_variables=False)
+    return stmt
+
+
+def select_course(user_id, mst_song_id, course_id):
+    """Select a course of a song of a user.
+
+    Returns:
+        A statement selecting a Course.
+    """
+    return lambda_stmt(
+        lambda: select(Course)
+        .where(Course.user_id == user_id)
+        .where(Course.mst_song_id == mst_song_id)
+        .where(Course.course_id == course_id)
+    )
+
+
+def select_course_cost(mst_song_id, course_id):
+    """Select the vitality cost of a course.
+
+    Returns:
+        A statement selecting an int.
+    """
+    return lambda_stmt(
+        lambda: select(MstCourse.cost)
+        .where(MstCourse.mst_song_id == mst_song_id)
+        .where(MstCourse.course_id == course_id)
+    )
+
+
+def select_score_threshold_list(mst_song_id, course_id):
+    """Select the score thresholds for the level of a course.
+
+    Returns:
+        A statement selecting a str of comma-separated scores.
+    """
+    return lambda_stmt(
+        lambda: select(MstScoreThreshold.score_threshold_list)
+        .where(MstScoreThreshold.level == (
+            select(MstCourse.level)
+            .where(MstCourse.mst_song_id == mst_song_id)
+            .where(MstCourse.course_id == course_id)
+            .scalar_subquery()
+        ))
+    )
+
+
+def select_active_mission(user_id, mst_mission_id):
+    """Select a mission of a user if it is in progress.
+
+    Returns:
+        A statement selecting a Mission.
+    """
+    return lambda_stmt(
+        lambda: select(Mission)
+        .where(Mission.user_id == user_id)
+        .where(Mission.mst_mission_id == mst_mission_id)
+        .where(Mission.mission_state == 1)
+    )
+
+
+def select_open_missions(user_id, mst_mission_class_id):
+    """Select the unfinished missions of a class of a user.
+
+    Missions are ordered in the order they are unlocked.
+    Returns:
+        A statement selecting Missions whose state is 0 (prerequisite
+        not met) or 1 (in progress).
+    """
+    return lambda_stmt(
+        lambda: select(Mission)
+        .join(MstMission)
+        .where(Mission.user_id == user_id)
+        .where(MstMission.mst_mission_class_id == mst_mission_class_id)
+        .where(Mission.mission_state.in_([0, 1]))
+        .order_by(MstMission.sort_id)
+    )
+
+
+def _samples(user_id):
+    """Sample queries of each statement, for warm-up and benchmarks.
+
+    Returns:
+        A list of tuples (name, build lambda statement, build equivalent
+        statement with select()), where both builders are functions
+        without arguments, constructing the statement as a service
+        would on each call.
+    """
+    return [
+        ('select_user',
+         lambda: select_user(user_id),
+         lambda: select(User).where(User.user_id == user_id)),
+        ('select_user (user-core)',
+         lambda: select_user(user_id, 'user-core'),
+         lambda: select(User).where(User.user_id == user_id)
+         .options(*loader_profile('user-core'))),
+        ('select_course',
+         lambda: select_course(user_id, 1, 4),
+         lambda: select(Course).where(Course.user_id == user_id)
+         .where(Course.mst_song_id == 1).where(Course.course_id == 4)),
+        ('select_course_cost',
+         lambda: select_course_cost(1, 4),
+         lambda: select(MstCourse.cost).where(MstCourse.mst_song_id == 1)
+         .where(MstCourse.course_id == 4)),
+        ('select_score_threshold_list',
+         lambda: select_score_threshold_list(1, 4),
+         lambda: select(MstScoreThreshold.score_threshold_list)
+         .where(MstScoreThreshold.level == (
+             select(MstCourse.level).where(MstCourse.mst_song_id == 1)
+             .where(MstCourse.course_id == 4).scalar_subquery()))),
+        ('select_active_mission',
+         lambda: select_active_mission(user_id, 70),
+         lambda: select(Mission).where(Mission.user_id == user_id)
+         .where(Mission.mst_mission_id == 70)
+         .where(Mission.mission_state == 1)),
+        ('select_open_missions',
+         lambda: select_open_missions(user_id, 3),
+         lambda: select(Mission).join(MstMission)
+         .where(Mission.user_id == user_id)
+         .where(MstMission.mst_mission_class_id == 3)
+         .where(Mission.mission_state.in_([0, 1]))
+         .order_by(MstMission.sort_id)),
+    ]
+
+
+class _CacheStats:
+    """Compiled cache hits and misses of all executed statements."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, cache_hit):
+        with self._lock:
+            self._counts[cache_hit] += 1
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self._counts)
+        hits = counts.get('CACHE_HIT', 0)
+        misses = counts.get('CACHE_MISS', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'uncached': sum(counts.values()) - hits - misses,
+            'hit_rate': hits / (hits+misses) if hits + misses else 0,
+            'cached_statements': sum(len(x._compiled_cache)
+                                     for x in _engines()),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+_cache_stats = _CacheStats()
+
+
+def _engines():
+    """Get the main engine and the engines of the shards, if any."""
+    engines = shard_router.user_engines()
+    return engines if engine in engines else [engine, *engines]
+
+
+# Listen on all engines, including shard engines created later.
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_cache_hit(conn, cursor, statement, parameters, context,
+                      executemany):
+    if context is not None:
+        _cache_stats.record(getattr(context.cache_hit, 'name', 'NO_CACHE'))
+
+
+def cache_summary():
+    """Return statistics of the compiled statement cache.
+
+    Returns:
+        A dict containing the following keys: hits, misses, uncached
+        (statements not eligible for caching, e.g. plain SQL), hit_rate
+        and cached_statements (current size of the cache).
+    """
+    return _cache_stats.summary()
+
+
+def warm_up():
+    """Compile the hot statements into the caches of the engines."""
+    start = time.perf_counter()
+    samples = _samples(UUID(int=0))
+    # Each engine has its own compiled cache.
+    for user_engine in _engines():
+        with Session(user_engine) as session:
+            for _, build, _ in samples:
+                session.execute(build()).all()
+    logger.info(f'Warmed up {len(samples)} statements in '
+                f'{(time.perf_counter()-start)*1000:.0f} ms')
+
+
+def benchmark(user_id, repeat=1000):
+    """Report the Python-side time per query of each statement.
+
+    Args:
+        user_id: User ID in UUID format.
+        repeat: Number of times each statement is executed.
+    """
+    sqlite_ns = Counter()
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info['benchmark_start_ns'] = time.perf_counter_ns()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        sqlite_ns['total'] += (time.perf_counter_ns()
+                               - conn.info['benchmark_start_ns'])
+
+    warm_up()
+    event.listen(engine, 'before_cursor_execute', before)
+    event.listen(engine, 'after_cursor_execute', after)
+    try:
+        with Session(engine) as session:
+            for name, build_lambda, build_select in _samples(user_id):
+                results = []
+                for kind, build in [('select()', build_select),
+                                    ('lambda', build_lambda)]:
+                    sqlite_ns.clear()
+                    start = time.perf_counter_ns()
+                    for _ in range(repeat):
+                        session.execute(build()).all()
+                    total_ns = time.perf_counter_ns() - start
+                    python_us = (total_ns-sqlite_ns['total']) / repeat / 1000
+                    results.append(f'{kind} {python_us:.0f} us')
+                print(f'{name}: {", ".join(results)}')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before)
+        event.remove(engine, 'after_cursor_execute', after)
+    print(cache_summary())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark lambda statements of hot queries.')
+    parser.add_argument('--user-id',
+                        default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                        help='user ID in UUID format')
+    parser.add_argument('--repeat', type=int, default=1000,
+                        help='number of executions of each statement')
+    args = parser.parse_args()
+    benchmark(UUID(args.user_id), args.repeat)
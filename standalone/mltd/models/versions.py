@@ -0,0 +1,206 @@
+"""Change tracking for per-user collections.
+
+Every insert, update or delete of a row in a tracked collection bumps
+the version counter of that collection for the row's user in the same
+transaction, so a version read together with the collection is always
+consistent with it. Changes are detected by SQLAlchemy session events,
+so services do not need to bump versions themselves.
+1. Changes made through the unit of work (adding, modifying or deleting
+   ORM objects) are detected after each flush.
+2. Bulk insert/update/delete statements executed through a session bump
+   the version of the collection for the users they are limited to, i.e.
+   a user_id compared in their WHERE clause (or given in the parameters
+   of an insert). Statements that may affect any user, such as the daily
+   reset, bump the version for the nil UUID, which is part of the
+   version of every user.
+Statements executed directly on a connection are not tracked, so code
+writing rows that way (e.g. importing a save) bumps the versions of the
+user with bump_versions() instead.
+"""
+from itertools import chain
+from uuid import UUID
+
+from sqlalchemy import event, func, or_, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import (BinaryExpression, BindParameter,
+                                     BooleanClauseList)
+
+from mltd.models.models import CollectionVersion
+
+tracked_collections = {
+    'card',
+    'costume',
+    'costume_adv',
+    'course',
+    'episode',
+    'idol',
+    'item',
+    'lesson_wear_config',
+    'memorial',
+    'song',
+    'unit',
+    'unit_idol',
+}
+
+# user_id for changes made by bulk statements.
+all_users = UUID(int=0)
+
+
+def _bump(connection, user_id, collection):
+    connection.execute(
+        insert(CollectionVersion)
+        .values(user_id=user_id, collection=collection, version=1)
+        .on_conflict_do_update(
+            index_elements=['user_id', 'collection'],
+            set_={'version': CollectionVersion.version + 1}
+        )
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_flushed_collections(session, flush_context):
+    changes = set()
+    for obj in chain(session.new, session.deleted, session.dirty):
+        collection = getattr(obj, '__tablename__', None)
+        if collection not in tracked_collections:
+            continue
+        if (obj in session.dirty
+                and not session.is_modified(obj, include_collections=False)):
+            continue
+        user_id = getattr(obj, 'user_id', None)
+        if user_id:
+            changes.add((user_id, collection))
+    if changes:
+        connection = session.connection()
+        for user_id, collection in changes:
+            _bump(connection, user_id, collection)
+
+
+def _inserted_user_ids(orm_execute_state):
+    parameters = orm_execute_state.parameters
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    user_ids = {x.get('user_id') for x in parameters or []}
+    if not user_ids or None in user_ids:
+        return None
+    return user_ids
+
+
+def _filtered_user_ids(statement):
+    user_column = statement.table.c.get('user_id')
+    criteria = statement.whereclause
+    if user_column is None or criteria is None:
+        return None
+    # Only criteria that all rows must match limit the users.
+    if (isinstance(criteria, BooleanClauseList)
+            and criteria.operator is operators.and_):
+        clauses = criteria.clauses
+    else:
+        clauses = [criteria]
+    for clause in clauses:
+        if (not isinstance(clause, BinaryExpression)
+                or clause.operator not in (operators.eq, operators.in_op)):
+            continue
+        # Comparisons with a relationship (Song.user == user) put the
+        # parameter on the left.
+        for column, value in [(clause.left, clause.right),
+                              (clause.right, clause.left)]:
+            if (isinstance(value, BindParameter)
+                    and column.compare(user_column)):
+                user_ids = value.effective_value
+                if clause.operator is operators.eq:
+                    user_ids = [user_ids]
+                if user_ids is not None and None not in user_ids:
+                    return set(user_ids)
+    return None
+
+
+def _statement_user_ids(orm_execute_state):
+    """Find the users a bulk statement is limited to.
+
+    Returns:
+        A set of user IDs, or None if the statement may affect any user.
+    """
+    if orm_execute_state.is_insert:
+        return _inserted_user_ids(orm_execute_state)
+    return _filtered_user_ids(orm_execute_state.statement)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_bulk_collections(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        return
+    collection = orm_execute_state.statement.table.name
+    if collection not in tracked_collections:
+        return
+    user_ids = _statement_user_ids(orm_execute_state) or [all_users]
+    connection = orm_execute_state.session.connection()
+    for user_id in user_ids:
+        _bump(connection, user_id, collection)
+
+
+def read_versions(connection, user_id):
+    """Read the version of every collection of a user.
+
+    Args:
+        connection: SQLAlchemy connection or session.
+        user_id: User ID in UUID format.
+    Returns:
+        A dict mapping collection names to versions.
+    """
+    return dict(connection.execute(
+        select(CollectionVersion.collection, CollectionVersion.version)
+        .where(CollectionVersion.user_id == user_id)
+    ).all())
+
+
+def bump_versions(connection, user_id, previous_versions=None):
+    """Bump the versions of all tracked collections of a user.
+
+    Args:
+        connection: SQLAlchemy connection.
+        user_id: User ID in UUID format.
+        previous_versions: Versions returned by read_versions() before
+                           the rows of the user were replaced, or None.
+                           The new versions are above them, so that they
+                           never return to a version that responses may
+                           have been cached under.
+    """
+    previous_versions = previous_versions or {}
+    for collection in tracked_collections:
+        previous_version = previous_versions.get(collection, 0)
+        connection.execute(
+            insert(CollectionVersion)
+            .values(user_id=user_id, collection=collection,
+                    version=previous_version + 1)
+            .on_conflict_do_update(
+                index_elements=['user_id', 'collection'],
+                set_={'version': func.max(CollectionVersion.version,
+                                          previous_version) + 1}
+            )
+        )
+
+
+def get_versions(session: Session, user_id, collections):
+    """Get the current versions of collections for a user.
+
+    Args:
+        session: Existing SQLAlchemy session.
+        user_id: User ID in UUID format.
+        collections: An iterable of collection (table) names.
+    Returns:
+        A hashable value that changes whenever any of the collections
+        changes for the user.
+    """
+    versions = session.execute(
+        select(CollectionVersion.collection, CollectionVersion.user_id,
+               CollectionVersion.version)
+        .where(or_(CollectionVersion.user_id == user_id,
+                   CollectionVersion.user_id == all_users))
+        .where(CollectionVersion.collection.in_(list(collections)))
+    ).all()
+    return tuple(sorted((collection, user_id == all_users, version)
+                        for collection, user_id, version in versions))
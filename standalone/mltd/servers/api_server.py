@@ -1,11 +1,43 @@
+"""API server.
+
+By default, the API server runs in a single process. With
+'api_workers = N' in config.ini (or 'console.py --workers N'), the
+console creates the listening socket and starts N worker processes
+accepting connections from it, supervised by
+'mltd.servers.process.WorkerPool'. Only worker 0 runs the daily reset
+scheduler. The database is in WAL mode and workers begin requests with
+a deferred transaction (see 'mltd.models.session_scope'), so requests
+that only read do not wait for each other.
+
+Running this module as a script measures the throughput of the API
+with 1 to N workers, replaying encrypted requests of a user from
+client processes.
+    python -m mltd.servers.api_server --benchmark [--workers N]
+        [--clients N] [--duration SECONDS] [--user-id USER_ID]
+"""
+import argparse
+import json
+import signal
 import socket
 import sys
+import threading
+import time
+import urllib.request
+from multiprocessing import Process, Queue, set_start_method
 from os import path
-from wsgiref.simple_server import WSGIRequestHandler, make_server
+from wsgiref.simple_server import (WSGIRequestHandler, WSGIServer,
+                                   make_server)
 
+from mltd.models import statements
+from mltd.models.query_tracer import query_tracer
+from mltd.models.session_scope import session_scope
+from mltd.servers import scheduler
 from mltd.servers.config import api_port
+from mltd.servers.encryption import encrypt_request
 from mltd.servers.handler import application
 from mltd.servers.logging import logger
+from mltd.servers.process import WorkerPool
+from mltd.servers.profiling import stage_profiler
 
 
 # A hack to prevent slow http.server.HTTPServer startup time on Windows.
@@ -27,6 +59,24 @@ class SilentWSGIRequestHandler(WSGIRequestHandler):
         pass
 
 
+class SharedSocketWSGIServer(WSGIServer):
+    """WSGI server accepting connections from an inherited socket."""
+
+    def __init__(self, sock):
+        super().__init__(sock.getsockname(), SilentWSGIRequestHandler,
+                         bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        # Workers wake up together when a connection arrives, and all
+        # but one find nothing to accept. Accepting must not block them,
+        # or they would not notice shutdown() until the next connection.
+        self.socket.setblocking(False)
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+
+
 def key_path():
     base_path = getattr(sys, '_MEIPASS', path.abspath('..'))
     return path.join(base_path, 'key')
@@ -36,12 +86,144 @@ def start(port=api_port, conn=None):
     with make_server('', port, application,
                      handler_class=SilentWSGIRequestHandler) as httpd:
         logger.info(f'Serving HTTP on port {port}...')
+        statements.warm_up()
+        scheduler.start()
+        stage_profiler.start_saving()
+        if query_tracer.enabled:
+            query_tracer.start_saving()
         if conn:
             conn.send(True)
             conn.close()
         httpd.serve_forever()
 
 
-if __name__ == '__main__':
-    start()
+def start_worker(sock, worker_id, stop_event, conn=None):
+    """Serve API requests as a worker process.
 
+    Args:
+        sock: Listening socket shared by all workers.
+        worker_id: Index of the worker, from 0.
+        stop_event: A multiprocessing.Event set to stop the worker after
+                    the request being handled.
+        conn: Status pipe, sent True when the worker is ready.
+    """
+    # The console stops the workers on Ctrl+C.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    session_scope.begin_immediate = False
+    query_tracer.path = f'mltd-relive-queries-{worker_id}.json'
+    stage_profiler.path = f'mltd-relive-profile-{worker_id}.json'
+    with SharedSocketWSGIServer(sock) as httpd:
+        httpd.set_app(application)
+        statements.warm_up()
+        if worker_id == 0:
+            scheduler.start()
+        stage_profiler.start_saving()
+        if query_tracer.enabled:
+            query_tracer.start_saving()
+
+        def wait_for_stop():
+            stop_event.wait()
+            httpd.shutdown()
+
+        threading.Thread(target=wait_for_stop, name='stop',
+                         daemon=True).start()
+        logger.info(f'Worker {worker_id} serving HTTP on port '
+                    f'{httpd.server_port}...')
+        if conn:
+            conn.send(True)
+            conn.close()
+        httpd.serve_forever()
+    logger.info(f'Worker {worker_id} stopped.')
+
+
+def _benchmark_requests():
+    """Encrypted bodies of read-only requests replayed by the benchmark.
+
+    The bodies do not depend on the user, who is identified by the
+    X-Application-User-Id header set by each client.
+    Returns:
+        A list of bytes.
+    """
+    methods = ['UserService.GetSelf', 'ItemService.GetItemList',
+               'CardService.GetCardList', 'IdolService.GetIdolList',
+               'SongService.GetSongList']
+    return [encrypt_request(json.dumps({
+        'jsonrpc': '2.0', 'id': i, 'method': method, 'params': [{}],
+    }).encode()) for i, method in enumerate(methods)]
+
+
+def _benchmark_client(port, user_id, duration, results):
+    bodies = _benchmark_requests()
+    count = errors = 0
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < duration:
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{port}/', data=bodies[count % len(bodies)],
+            headers={'X-Application-User-Id': user_id})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except OSError:
+            errors += 1
+        count += 1
+    results.put((count, errors, time.monotonic() - start_time))
+
+
+def benchmark(workers, clients, duration, user_id, port=api_port+1):
+    """Print the API throughput with 1 to 'workers' workers.
+
+    Args:
+        workers: Maximum number of workers.
+        clients: Number of client processes sending requests.
+        duration: Seconds to send requests for each number of workers.
+        user_id: User ID in UUID format.
+        port: Port to listen on during the benchmark.
+    """
+    sock = socket.create_server(('127.0.0.1', port))
+    try:
+        baseline = None
+        for n in range(1, workers+1):
+            pool = WorkerPool(start_worker, n, sock=sock)
+            pool.start()
+            while not pool.is_ready():
+                time.sleep(0.1)
+            results = Queue()
+            client_processes = [
+                Process(target=_benchmark_client,
+                        args=(port, user_id, duration, results))
+                for _ in range(clients)]
+            for process in client_processes:
+                process.start()
+            totals = [results.get() for _ in client_processes]
+            for process in client_processes:
+                process.join()
+            pool.stop()
+            rate = sum(count / elapsed for count, _, elapsed in totals)
+            errors = sum(x[1] for x in totals)
+            baseline = baseline or rate
+            print(f'{n} worker(s): {rate:.1f} requests/s '
+                  f'({rate/baseline:.2f}x), {errors} errors')
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start the API server.')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure throughput with 1 to N workers')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='maximum number of workers of the benchmark')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of client processes of the benchmark')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to send requests for each number '
+                             'of workers')
+    parser.add_argument('--user-id',
+                        default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                        help='user ID in UUID format')
+    args = parser.parse_args()
+    if args.benchmark:
+        set_start_method('spawn')
+        benchmark(args.workers, args.clients, args.duration, args.user_id)
+    else:
+        start()
@@ -0,0 +1,291 @@
+"""Memory-mapped index of asset manifests.
+
+The manifest of an asset directory is a msgpack file mapping each asset
+file name under '120000/' to [content hash, hashed name, size]. Game
+clients request assets by hashed name, so serving them used to unpack
+the whole manifest and build a reverse dict for every language and
+platform. Instead, the build step converts each manifest into an index
+file next to it ('manifest.idx'), an open addressing hash table keyed by
+hashed name that is memory-mapped and looked up in place, without
+parsing anything at startup.
+
+Index layout (little-endian):
+    header: magic (8 bytes), slot count (power of 2), entry count
+    slots: (64-bit hash of the hashed name, record offset or 0 if empty)
+    records: size, lengths of the following 3 strings, hashed name,
+             path relative to the asset directory, content hash
+
+Running this module as a script builds the indexes of all asset
+directories, or verifies the size and content hash of every asset file
+against the manifest in parallel.
+    python -m mltd.servers.asset_index build [--root ROOT]
+    python -m mltd.servers.asset_index verify [--root ROOT] [--jobs N]
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from typing import NamedTuple
+
+from msgpack import unpackb
+
+manifest_names = {'zh': '85822153578df611a4f852d4e02660f6f34401e4.data',
+                  'ko': '25c292462510f60200eecd8080f4680114b8c576.data'}
+index_name = 'manifest.idx'
+
+_magic = b'MLTDAIX1'
+_header = struct.Struct('<8sII')
+_slot = struct.Struct('<QI')
+_record = struct.Struct('<QHHH')
+# Content hash algorithms by length of the hex digest.
+_hash_algorithms = {32: 'md5', 40: 'sha1', 64: 'sha256'}
+
+
+class AssetEntry(NamedTuple):
+    hashed_name: str
+    # Path relative to the asset directory.
+    path: str
+    size: int
+    # Hex digest of the content, or '' for the manifest itself.
+    content_hash: str
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          'little')
+
+
+def asset_directories(root):
+    """Find the asset directories in a directory.
+
+    Args:
+        root: Directory containing 'assets-<lang>-<platform>'
+              directories.
+    Returns:
+        A list of tuples (lang, platform, directory path).
+    """
+    try:
+        names = sorted(os.listdir(root))
+    except OSError:
+        return []
+    directories = []
+    for name in names:
+        tokens = name.split('-')
+        if (len(tokens) == 3 and tokens[0] == 'assets'
+                and tokens[1] in manifest_names
+                and path.isdir(path.join(root, name))):
+            directories.append((tokens[1], tokens[2], path.join(root, name)))
+    return directories
+
+
+def read_manifest(directory, lang):
+    """Unpack the manifest of an asset directory.
+
+    Args:
+        directory: Path of the asset directory.
+        lang: Game client language ('zh' or 'ko').
+    Returns:
+        A list of AssetEntry, including one for the manifest itself.
+    """
+    manifest_path = path.join(directory, manifest_names[lang])
+    with open(manifest_path, 'rb') as f:
+        manifest = unpackb(f.read())
+    entries = [AssetEntry(v[1], f'120000/{k}', v[2], v[0])
+               for k, v in manifest[0].items()]
+    entries.append(AssetEntry(manifest_names[lang], manifest_names[lang],
+                              os.path.getsize(manifest_path), ''))
+    return entries
+
+
+def build_index(directory, lang):
+    """Build the index of an asset directory from its manifest.
+
+    The index is written to a temporary file and renamed, so a server
+    using the previous index is not affected.
+    Args:
+        directory: Path of the asset directory.
+        lang: Game client language ('zh' or 'ko').
+    Returns:
+        The number of entries in the index.
+    """
+    entries = read_manifest(directory, lang)
+    slot_count = 1
+    # Keep the load factor at most 1/2 so that probes stay short.
+    while slot_count < 2 * len(entries):
+        slot_count *= 2
+    slots = [(0, 0)] * slot_count
+    records = bytearray()
+    records_offset = _header.size + slot_count * _slot.size
+    for entry in entries:
+        key = entry.hashed_name.encode()
+        strings = [key, entry.path.encode(), entry.content_hash.encode()]
+        key_hash = _key_hash(key)
+        i = key_hash & (slot_count-1)
+        while slots[i][1]:
+            i = (i+1) & (slot_count-1)
+        slots[i] = (key_hash, records_offset + len(records))
+        records += _record.pack(entry.size, *[len(x) for x in strings])
+        records += b''.join(strings)
+
+    index_path = path.join(directory, index_name)
+    with open(f'{index_path}.tmp', 'wb') as f:
+        f.write(_header.pack(_magic, slot_count, len(entries)))
+        for slot in slots:
+            f.write(_slot.pack(*slot))
+        f.write(records)
+    os.replace(f'{index_path}.tmp', index_path)
+    return len(entries)
+
+
+def is_index_current(directory, lang):
+    """Whether the index exists and is newer than the manifest."""
+    try:
+        return (os.path.getmtime(path.join(directory, index_name))
+                >= os.path.getmtime(path.join(directory,
+                                              manifest_names[lang])))
+    except OSError:
+        return False
+
+
+class AssetIndex:
+    """Memory-mapped index of an asset directory.
+
+    Behaves as a read-only dict from hashed names to file paths.
+    """
+
+    def __init__(self, directory):
+        """Map the index of an asset directory.
+
+        Args:
+            directory: Path of the asset directory.
+        Raises:
+            OSError: The index cannot be read.
+            ValueError: The file is not an index.
+        """
+        self.directory = directory
+        with open(path.join(directory, index_name), 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._slot_count, self._count = _header.unpack_from(
+            self._mmap)
+        if magic != _magic:
+            raise ValueError(f'Not an asset index: {directory}')
+
+    def __len__(self):
+        return self._count
+
+    def entry(self, hashed_name):
+        """Look up an asset.
+
+        Args:
+            hashed_name: Hashed name requested by the game client.
+        Returns:
+            An AssetEntry, or None if the asset does not exist.
+        """
+        key = hashed_name.encode()
+        key_hash = _key_hash(key)
+        mask = self._slot_count - 1
+        i = key_hash & mask
+        while True:
+            slot_hash, offset = _slot.unpack_from(
+                self._mmap, _header.size + i * _slot.size)
+            if not offset:
+                return None
+            if slot_hash == key_hash:
+                size, key_len, path_len, hash_len = _record.unpack_from(
+                    self._mmap, offset)
+                start = offset + _record.size
+                if self._mmap[start:start+key_len] == key:
+                    start += key_len
+                    asset_path = self._mmap[start:start+path_len].decode()
+                    start += path_len
+                    content_hash = self._mmap[start:start+hash_len].decode()
+                    return AssetEntry(hashed_name, asset_path, size,
+                                      content_hash)
+            i = (i+1) & mask
+
+    def get(self, hashed_name, default=None):
+        """Get the file path of an asset, as dict.get()."""
+        entry = self.entry(hashed_name)
+        if entry is None:
+            return default
+        return path.join(self.directory, entry.path)
+
+    def close(self):
+        self._mmap.close()
+
+
+def _verify_entry(directory, entry):
+    """Check the size and content hash of an asset file.
+
+    Returns:
+        A description of the problem, or None if the file is valid.
+    """
+    file_path = path.join(directory, entry.path)
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return f'{entry.path}: missing'
+    if size != entry.size:
+        return f'{entry.path}: size {size} != {entry.size}'
+    algorithm = _hash_algorithms.get(len(entry.content_hash))
+    if not algorithm:
+        return None
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    if digest.hexdigest() != entry.content_hash.lower():
+        return f'{entry.path}: {algorithm} {digest.hexdigest()} != ' \
+               f'{entry.content_hash}'
+    return None
+
+
+def verify_assets(directory, lang, jobs=None):
+    """Check every asset file of a directory against the manifest.
+
+    Files are hashed in a thread pool; hashlib releases the GIL while
+    hashing, so the threads run in parallel.
+    Args:
+        directory: Path of the asset directory.
+        lang: Game client language ('zh' or 'ko').
+        jobs: Number of threads, or None for the number of CPUs.
+    Returns:
+        A tuple (number of files checked, list of problems).
+    """
+    entries = read_manifest(directory, lang)
+    with ThreadPoolExecutor(jobs or os.cpu_count()) as executor:
+        results = executor.map(lambda x: _verify_entry(directory, x),
+                               entries)
+        problems = [x for x in results if x]
+    return len(entries), problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build or verify asset manifest indexes.')
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--root', default=path.abspath('..'),
+                        help='directory containing the asset directories')
+    parser.add_argument('--jobs', type=int,
+                        help='number of threads used to verify assets')
+    args = parser.parse_args()
+
+    directories = asset_directories(args.root)
+    if not directories:
+        print(f'No asset directories in {args.root}')
+    failed = False
+    for lang, platform, directory in directories:
+        if args.command == 'build':
+            count = build_index(directory, lang)
+            print(f'assets-{lang}-{platform}: {count} entries indexed')
+        else:
+            count, problems = verify_assets(directory, lang, args.jobs)
+            for problem in problems:
+                print(f'assets-{lang}-{platform}/{problem}')
+            print(f'assets-{lang}-{platform}: {count} files checked, '
+                  f'{len(problems)} problems')
+            failed = failed or bool(problems)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,244 @@
+"""Asset server.
+
+Serves the game assets extracted to '../assets-<lang>-<platform>/', as
+requested with paths ending in '/<lang>-<platform>/<hashed name>'. The
+manifest of each asset directory maps hashed names to files under
+'120000/', and the manifest itself is served under its own hashed name.
+
+The lookup of each asset directory is opened once when the server
+starts: the memory-mapped index built by 'mltd.servers.asset_index' if
+it is up to date, or else the manifest unpacked into a dict. Files are
+sent with socket.sendfile(), which copies them to the socket in the
+kernel (os.sendfile) where available instead of reading them into
+memory. The hashed name is the hash of the content, so it is used as the
+ETag, and conditional requests (If-None-Match) and single byte ranges
+(Range and If-Range) are supported for resuming downloads.
+
+The server runs in its own process with a thread per connection, so that
+downloading all assets on a new device does not hold up API requests.
+"""
+import os
+import re
+import sys
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from urllib.parse import unquote, urlsplit
+
+from mltd.servers.asset_index import (AssetIndex, asset_directories,
+                                      is_index_current, manifest_names,
+                                      read_manifest)
+from mltd.servers.config import asset_port
+from mltd.servers.logging import logger
+
+_range_pattern = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def asset_path():
+    return getattr(sys, '_MEIPASS', path.abspath('..'))
+
+
+class AssetManifest:
+    """Lookup of asset files by hashed name."""
+
+    def __init__(self, root):
+        """Initialize the lookup.
+
+        Args:
+            root: Directory containing the asset directories.
+        """
+        self.root = root
+        self._lock = threading.Lock()
+        # {(lang, platform): AssetIndex or {hashed name: file path}}
+        self._lookup = {}
+
+    def _load(self, lang, platform):
+        directory = path.join(self.root, f'assets-{lang}-{platform}')
+        if is_index_current(directory, lang):
+            return AssetIndex(directory)
+        logger.warning(f'No up-to-date index in {directory}, run '
+                       f'"python -m mltd.servers.asset_index build"')
+        return {entry.hashed_name: path.join(directory, entry.path)
+                for entry in read_manifest(directory, lang)}
+
+    def load_all(self):
+        """Load the manifests of all asset directories.
+
+        Returns:
+            The number of manifests loaded.
+        """
+        count = 0
+        for lang, platform, directory in asset_directories(self.root):
+            try:
+                self.get(lang, platform)
+                count += 1
+            except (OSError, ValueError):
+                logger.warning(f'Cannot load the manifest in {directory}')
+        return count
+
+    def get(self, lang, platform):
+        """Get the lookup of an asset directory, loading it if needed.
+
+        Args:
+            lang: Game client language ('zh' or 'ko').
+            platform: Game client platform.
+        Returns:
+            An AssetIndex or a dict mapping hashed names to file paths.
+        Raises:
+            KeyError: The language is not supported.
+            OSError: The manifest cannot be read.
+        """
+        key = (lang, platform)
+        lookup = self._lookup.get(key)
+        if lookup is None:
+            if lang not in manifest_names:
+                raise KeyError(lang)
+            with self._lock:
+                lookup = self._lookup.get(key)
+                if lookup is None:
+                    lookup = self._load(lang, platform)
+                    self._lookup[key] = lookup
+        return lookup
+
+    def find(self, lang, platform, hashed_name):
+        """Get the file path of an asset.
+
+        Returns:
+            The file path, or None if the asset does not exist.
+        """
+        try:
+            return self.get(lang, platform).get(hashed_name)
+        except (KeyError, OSError, ValueError):
+            return None
+
+
+manifest = AssetManifest(asset_path())
+
+
+def parse_range(header, size):
+    """Parse a Range header.
+
+    Only a single byte range is supported, as download clients request.
+    Args:
+        header: Value of the Range header.
+        size: Size of the file in bytes.
+    Returns:
+        A tuple (first byte, last byte), or None if the header should be
+        ignored and the whole file sent.
+    Raises:
+        ValueError: The range is not satisfiable.
+    """
+    match = _range_pattern.fullmatch(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        # Invalid ranges are ignored.
+        return None
+    if first >= size:
+        raise ValueError(header)
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+class AssetHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_asset(send_body=True)
+
+    def do_HEAD(self):
+        self.send_asset(send_body=False)
+
+    def send_asset(self, send_body):
+        tokens = unquote(urlsplit(self.path).path).split('/')
+        lang, _, platform = tokens[-2].partition('-')
+        file_path = manifest.find(lang, platform, tokens[-1])
+        try:
+            f = open(file_path, 'rb') if file_path else None
+        except OSError:
+            f = None
+        if f is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            etag = f'"{tokens[-1]}"'
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match and (
+                    if_none_match.strip() == '*'
+                    or etag in [x.strip().removeprefix('W/')
+                                for x in if_none_match.split(',')]):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            byte_range = None
+            range_header = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if range_header and (if_range is None or if_range == etag):
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    self.send_response(
+                        HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+            if byte_range:
+                first, last = byte_range
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header('Content-Range',
+                                 f'bytes {first}-{last}/{size}')
+            else:
+                first, last = 0, size - 1
+                self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(last - first + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control',
+                             'public, max-age=31536000, immutable')
+            self.end_headers()
+            if send_body and last >= first:
+                try:
+                    self.connection.sendfile(f, first, last - first + 1)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the download.
+                    self.close_connection = True
+
+    def log_message(self, format, *args):
+        # Disable stderr output
+        pass
+
+
+class AssetHTTPServer(ThreadingHTTPServer):
+    # Game clients open many connections when downloading all assets.
+    request_queue_size = 64
+
+
+def start(port=asset_port, conn=None):
+    count = manifest.load_all()
+    if not count:
+        logger.warning(f'No assets found in {manifest.root}')
+    with AssetHTTPServer(('', port), AssetHTTPRequestHandler) as httpd:
+        logger.info(f'Serving {count} asset directories on port {port}...')
+        if conn:
+            conn.send(True)
+            conn.close()
+        httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    start()
@@ -2,12 +2,33 @@ import logging
 from configparser import ConfigParser
 from datetime import timedelta, timezone
 
-version = '0.1.3'
+version = '0.1.4'
 api_port = 7650
+asset_port = 8080
 # 'zh' for Traditional Chinese, 'ko' for Korean
 _language = 'zh'
 _log_level = logging.INFO
 _is_local = False
+_dns_upstream = '8.8.8.8:53'
+# Number of API worker processes sharing the listening socket
+_api_workers = 1
+# Number of user shard files, or 0 to store all users in one database
+_shards = 0
+# Whether data migrations may run while the server is running
+_online_migrations = False
+# 'queue' to write logs from a background thread, or 'sync'
+_log_mode = 'queue'
+# 'text' or 'json'
+_log_format = 'text'
+_log_payload_sample_rate = 1.0
+_query_trace = False
+_slow_query_ms = 100
+# Server timezones by language, created once since config.timezone is
+# read for every serialized datetime.
+_timezones = {
+    'zh': timezone(timedelta(hours=8)),
+    'default': timezone(timedelta(hours=9)),
+}
 
 
 def version_tuple(v):
@@ -23,7 +44,16 @@ class CustomConfigParser(ConfigParser):
                 'version': version,
                 'language': _language,
                 'log_level': _log_level,
-                'is_local': _is_local
+                'log_mode': _log_mode,
+                'log_format': _log_format,
+                'log_payload_sample_rate': _log_payload_sample_rate,
+                'query_trace': _query_trace,
+                'slow_query_ms': _slow_query_ms,
+                'is_local': _is_local,
+                'dns_upstream': _dns_upstream,
+                'api_workers': _api_workers,
+                'shards': _shards,
+                'online_migrations': _online_migrations
             }
         })
         if not self.read('config.ini'):
@@ -43,12 +73,32 @@ class CustomConfigParser(ConfigParser):
 
     @property
     def timezone(self):
-        return timezone(timedelta(hours=8 if self.language == 'zh' else 9))
+        return _timezones['zh' if self.language == 'zh' else 'default']
 
     @property
     def log_level(self):
         return self.getint('default', 'log_level')
 
+    @property
+    def log_mode(self):
+        return self['default']['log_mode']
+
+    @property
+    def log_format(self):
+        return self['default']['log_format']
+
+    @property
+    def log_payload_sample_rate(self):
+        return self.getfloat('default', 'log_payload_sample_rate')
+
+    @property
+    def query_trace(self):
+        return self.getboolean('default', 'query_trace')
+
+    @property
+    def slow_query_ms(self):
+        return self.getint('default', 'slow_query_ms')
+
     @property
     def is_local(self):
         return self.getboolean('default', 'is_local')
@@ -58,6 +108,22 @@ class CustomConfigParser(ConfigParser):
         self['default']['is_local'] = str(value)
         self.write_config()
 
+    @property
+    def dns_upstream(self):
+        return self['default']['dns_upstream']
+
+    @property
+    def api_workers(self):
+        return self.getint('default', 'api_workers')
+
+    @property
+    def shards(self):
+        return self.getint('default', 'shards')
+
+    @property
+    def online_migrations(self):
+        return self.getboolean('default', 'online_migrations')
+
     def write_config(self):
         with open('config.ini', 'w') as config_file:
             self.write(config_file)
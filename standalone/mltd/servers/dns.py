@@ -1,10 +1,33 @@
+"""DNS server.
+
+Answers the API server's domains with the LAN IP of this machine and
+forwards every other query to the upstream resolver configured as
+'dns_upstream' in config.ini. Once a phone uses this server as its
+resolver, all of its background DNS traffic goes through it, so
+forwarded answers are cached:
+- Answers are kept in an LRU cache for the smallest TTL of their
+  records, and served with the remaining TTL.
+- NXDOMAIN and empty answers are cached for the TTL of the SOA record
+  in the authority section (RFC 2308), or 'negative_ttl' without one.
+- Concurrent identical queries are sent upstream once, and the other
+  queries wait for its answer.
+Queries are served over both UDP and TCP.
+"""
+import copy
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from inspect import cleandoc
 from time import sleep
 
 import netifaces
+from dnslib import QTYPE, RCODE, DNSRecord
 from dnslib.intercept import InterceptResolver
 from dnslib.server import DNSLogger, DNSServer
 
+from mltd.servers.config import config
 from mltd.servers.logging import logger
 
 dns_port = 53
@@ -24,8 +47,215 @@ def get_lan_ips():
     return ipv4, ipv6
 
 
-def start(port=dns_port, conn=None):
-    lan_ipv4, lan_ipv6 = get_lan_ips()
+class DNSCache:
+    """LRU cache of upstream answers with TTL expiry."""
+
+    def __init__(self, max_entries=4096, max_ttl=3600, negative_ttl=60):
+        """Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached answers.
+            max_ttl: Maximum seconds an answer is cached, positive or
+                     negative.
+            negative_ttl: Seconds a negative answer without an SOA
+                          record is cached.
+        """
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # {(qname, qtype, qclass): (packed answer, cached time, expiry)}
+        self._entries = OrderedDict()
+        # {(qname, qtype, qclass): Future of the upstream answer}
+        self._pending = {}
+        self._stats = {
+            'queries': 0,
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'upstream_errors': 0,
+        }
+
+    def _ttl(self, reply):
+        """Get the seconds an upstream answer can be cached, or 0."""
+        if reply.header.tc or reply.header.rcode not in (
+                RCODE.NOERROR, RCODE.NXDOMAIN):
+            return 0
+        if reply.header.rcode == RCODE.NOERROR and reply.rr:
+            ttl = min(rr.ttl for rr in reply.rr)
+        else:
+            soa_ttls = [min(rr.ttl, rr.rdata.times[-1]) for rr in reply.auth
+                        if rr.rtype == QTYPE.SOA]
+            ttl = min(soa_ttls) if soa_ttls else self.negative_ttl
+        return min(ttl, self.max_ttl)
+
+    def _get(self, key, now):
+        """Get a cached answer, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, reply, now):
+        ttl = self._ttl(reply)
+        if ttl <= 0:
+            return
+        self._entries[key] = (reply.pack(), now, now + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _cached_reply(request, entry, now):
+        """Build a reply to a request from a cached answer."""
+        packed, cached_time, _ = entry
+        reply = DNSRecord.parse(packed)
+        reply.header.id = request.header.id
+        elapsed = int(now - cached_time)
+        for rr in reply.rr + reply.auth + reply.ar:
+            if rr.rtype != QTYPE.OPT:
+                rr.ttl = max(rr.ttl - elapsed, 0)
+        return reply
+
+    def resolve(self, request, forward):
+        """Answer a request from the cache or by forwarding it.
+
+        Args:
+            request: A DNSRecord of the query.
+            forward: A function without arguments that sends the request
+                     upstream and returns the reply as a DNSRecord.
+        Returns:
+            A DNSRecord of the reply.
+        """
+        question = request.q
+        key = (str(question.qname).lower(), question.qtype, question.qclass)
+        now = time.monotonic()
+        with self._lock:
+            self._stats['queries'] += 1
+            entry = self._get(key, now)
+            if entry is not None:
+                reply = self._cached_reply(request, entry, now)
+                if reply.rr:
+                    self._stats['hits'] += 1
+                else:
+                    self._stats['negative_hits'] += 1
+                return reply
+            future = self._pending.get(key)
+            is_leader = future is None
+            if is_leader:
+                self._stats['misses'] += 1
+                future = Future()
+                self._pending[key] = future
+            else:
+                self._stats['coalesced'] += 1
+
+        if is_leader:
+            try:
+                reply = forward()
+            except Exception as e:
+                with self._lock:
+                    self._stats['upstream_errors'] += 1
+                    del self._pending[key]
+                future.set_exception(e)
+                raise
+            with self._lock:
+                self._put(key, reply, time.monotonic())
+                del self._pending[key]
+            future.set_result(reply)
+            return reply
+
+        reply = copy.deepcopy(future.result())
+        reply.header.id = request.header.id
+        return reply
+
+    def summary(self):
+        """Return cache statistics.
+
+        Returns:
+            A dict containing the following keys: queries, hits,
+            negative_hits, misses (queries sent upstream), coalesced
+            (queries that waited for an identical query), upstream
+            errors, hit_rate (answered without sending upstream) and
+            entries.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        answered = stats['hits'] + stats['negative_hits'] + stats['coalesced']
+        stats['hit_rate'] = (answered / stats['queries'] if stats['queries']
+                             else 0)
+        return stats
+
+
+class CachingInterceptResolver(InterceptResolver):
+    """InterceptResolver whose forwarded queries go through a DNSCache."""
+
+    def __init__(self, *args, cache=None, report_interval=1000, **kwargs):
+        """Initialize the resolver.
+
+        Other arguments are passed to InterceptResolver.
+        Args:
+            cache: A DNSCache, or None to create one.
+            report_interval: Number of queries between logging the cache
+                             statistics.
+        """
+        super().__init__(*args, **kwargs)
+        self.cache = cache or DNSCache()
+        self.report_interval = report_interval
+        self._queries = itertools.count(1)
+
+    def _is_local(self, qname):
+        """Whether a name is answered locally instead of forwarded."""
+        if any(qname.matchGlob(x) for x in self.skip):
+            return False
+        return (any(qname.matchGlob(name) for name, _, _ in self.zone)
+                or any(qname.matchGlob(x) for x in self.nxdomain))
+
+    def _forward(self, request, handler):
+        upstream, upstream_port = self.address, self.port
+        for name, ip, port in self.forward:
+            if request.q.qname.matchGlob(name):
+                upstream, upstream_port = ip, port
+        reply = DNSRecord.parse(request.send(
+            upstream, upstream_port, tcp=handler.protocol != 'udp',
+            timeout=self.timeout))
+        if reply.header.tc:
+            # Retry a truncated answer over TCP so that it can be cached.
+            reply = DNSRecord.parse(request.send(
+                upstream, upstream_port, tcp=True, timeout=self.timeout))
+        return reply
+
+    def resolve(self, request, handler):
+        if self._is_local(request.q.qname):
+            return super().resolve(request, handler)
+        try:
+            reply = self.cache.resolve(
+                request, lambda: self._forward(request, handler))
+        except OSError:
+            reply = request.reply()
+            reply.header.rcode = RCODE.SERVFAIL
+        if next(self._queries) % self.report_interval == 0:
+            logger.info(f'DNS cache: {self.cache.summary()}')
+        return reply
+
+
+def start(port=dns_port, conn=None, upstream=None, lan_ips=None):
+    """Start the DNS server on UDP and TCP.
+
+    Args:
+        port: Port to listen on.
+        conn: Pipe connection notified when the server is ready.
+        upstream: Upstream resolver as 'address:port', or None to use
+                  'dns_upstream' in config.ini.
+        lan_ips: A tuple (IPv4 address, IPv6 address) to answer the API
+                 server's domains with, or None to detect them.
+    """
+    lan_ipv4, lan_ipv6 = lan_ips or get_lan_ips()
     zone_record = ''
     if lan_ipv4:
         zone_record = cleandoc(f"""
@@ -40,23 +270,28 @@ def start(port=dns_port, conn=None):
         """)
         zone_record += '\n'
 
-    resolver = InterceptResolver(address='8.8.8.8',
-                                 port=53,
-                                 ttl='60s',
-                                 intercept=[zone_record],
-                                 skip=[],
-                                 nxdomain=[],
-                                 forward=[],
-                                 all_qtypes=False,
-                                 timeout=5)
+    address, _, upstream_port = (upstream or config.dns_upstream).partition(
+        ':')
+    resolver = CachingInterceptResolver(address=address,
+                                        port=int(upstream_port or 53),
+                                        ttl='60s',
+                                        intercept=[zone_record],
+                                        skip=[],
+                                        nxdomain=[],
+                                        forward=[],
+                                        all_qtypes=False,
+                                        timeout=5)
     dns_logger = DNSLogger(logf=logger.debug)
     udp_server = DNSServer(resolver, port=port, logger=dns_logger)
+    tcp_server = DNSServer(resolver, port=port, logger=dns_logger, tcp=True)
     logger.info(f'DNS is running on port {port}...')
     logger.info(f'IPv4: {lan_ipv4}')
     logger.info(f'IPv6: {lan_ipv6}')
+    logger.info(f'Upstream: {address}:{upstream_port or 53}')
     if conn:
         conn.send(True)
         conn.close()
+    tcp_server.start_thread()
     udp_server.start()
 
 
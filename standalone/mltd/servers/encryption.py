@@ -14,6 +14,12 @@ def decrypt_request(data):
     return bytearray(data)[16:]
 
 
+def encrypt_request(data):
+    cipher = AES.new(_key, AES.MODE_CBC, iv=_iv)
+    data = b'\x00' * 16 + bytes(data)
+    return b64encode(cipher.encrypt(pad(data, 16)), b'-_')
+
+
 def decrypt_response(data):
     cipher = AES.new(_key, AES.MODE_CBC, iv=_iv)
     data = unpad(cipher.decrypt(b64decode(data, b'-_')), 16)
@@ -1,13 +1,19 @@
 import json
 import time
+import uuid
 from datetime import datetime
 from decimal import Decimal
 from uuid import UUID
 
 from jsonrpc import JSONRPCResponseManager, dispatcher
+from jsonrpc.exceptions import JSONRPCInvalidRequest
+from jsonrpc.jsonrpc2 import JSONRPC20Response
 
+from mltd.models.session_scope import LockConflict, session_scope
+from mltd.models.shards import shard_router
 from mltd.servers.encryption import decrypt_request, encrypt_response
-from mltd.servers.logging import logger
+from mltd.servers.logging import (log_payload, logger, reset_request_id,
+                                  set_request_id)
 from mltd.servers.utilities import format_datetime
 from mltd.services import *
 
@@ -23,46 +29,123 @@ class CustomJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
+class ScopedDispatcher:
+    """Dispatcher running each method in a savepoint of the request."""
+
+    def __init__(self, dispatcher):
+        self._dispatcher = dispatcher
+        self._methods = {}
+
+    @property
+    def context_arg_for_method(self):
+        return self._dispatcher.context_arg_for_method
+
+    def __getitem__(self, key):
+        method = self._dispatcher[key]
+        scoped_method = self._methods.get(key)
+        if scoped_method is None or scoped_method.__wrapped__ is not method:
+            scoped_method = session_scope.method(method)
+            self._methods[key] = scoped_method
+        return scoped_method
+
+
+scoped_dispatcher = ScopedDispatcher(dispatcher)
+
+
+def get_user_id(environ, request):
+    """Get the ID of the user sending a request.
+
+    The game client sends the user ID in the header
+    'X-Application-User-Id', except in some requests (e.g.
+    'AuthService.Login') which only have it in the params.
+    Args:
+        environ: WSGI environment of the request.
+        request: Decrypted JSON-RPC request (or batch) in bytes.
+    Returns:
+        The user ID as a str, or None if it is missing or invalid.
+    """
+    user_id = environ.get('HTTP_X_APPLICATION_USER_ID')
+    if not user_id:
+        try:
+            payload = json.loads(request)
+        except ValueError:
+            return None
+        for call in payload if isinstance(payload, list) else [payload]:
+            params = call.get('params') if isinstance(call, dict) else None
+            if isinstance(params, list) and params:
+                params = params[0]
+            if isinstance(params, dict) and params.get('user_id'):
+                user_id = params['user_id']
+                break
+    try:
+        return str(UUID(user_id)) if user_id else None
+    except (TypeError, ValueError):
+        return None
+
+
 def application(environ, start_response):
     host = environ['HTTP_HOST']
 
     if ('theaterdays-zh.appspot.com' in host
             or 'theaterdays-ko.appspot.com' in host
             or '127.0.0.1' in host):
-        logger.info(f'Request received for service {environ["PATH_INFO"]}')
-        full_start_time = time.perf_counter_ns()
-
-        status = '200 OK'
-        headers = [
-            ('Content-Type', 'application/json'),
-            ('X-Encryption', 'on'),
-            ('X-Encryption-Compress', 'gzip'),
-            ('X-Encryption-Mode', '3'),
-            # ('X-Server-Date', '2022-02-01T20:00:00+0000'),
-        ]
-
-        request_len = int(environ['CONTENT_LENGTH'])
-        request = environ['wsgi.input'].read(request_len)
-        logger.debug(request)
-        request = decrypt_request(request)
-
-        context = {
-            'user_id': environ.get('HTTP_X_APPLICATION_USER_ID'),
-        }
-        svc_start_time = time.perf_counter_ns()
-        response = JSONRPCResponseManager.handle(request, dispatcher, context)
-        svc_end_time = time.perf_counter_ns()
-        logger.debug(
-            json.dumps(response.data, cls=CustomJSONEncoder, indent=2))
-        response = json.dumps(response.data, cls=CustomJSONEncoder,
-                              separators=(',', ':'))
-        response = encrypt_response(response)
-
-        full_end_time = time.perf_counter_ns()
-        logger.info('Service execution time: '
-                     + f'{(svc_end_time-svc_start_time) // 1_000_000} ms')
-        logger.info('Full execution time: '
-                     + f'{(full_end_time-full_start_time) // 1_000_000} ms')
+        request_id_token = set_request_id(uuid.uuid4().hex[:12])
+        try:
+            logger.info(f'Request received for service {environ["PATH_INFO"]}')
+            full_start_time = time.perf_counter_ns()
+
+            status = '200 OK'
+            headers = [
+                ('Content-Type', 'application/json'),
+                ('X-Encryption', 'on'),
+                ('X-Encryption-Compress', 'gzip'),
+                ('X-Encryption-Mode', '3'),
+                # ('X-Server-Date', '2022-02-01T20:00:00+0000'),
+            ]
+
+            request_len = int(environ['CONTENT_LENGTH'])
+            request = environ['wsgi.input'].read(request_len)
+            request = decrypt_request(request)
+            log_payload('Request: %s', request)
+
+            context = {
+                'user_id': environ.get('HTTP_X_APPLICATION_USER_ID'),
+            }
+            user_id = get_user_id(environ, request)
+            svc_start_time = time.perf_counter_ns()
+            if shard_router.enabled and user_id is None:
+                # Without a user ID, the shard storing the user is unknown.
+                logger.warning('Rejected request without a user ID')
+                response = JSONRPC20Response(
+                    error=JSONRPCInvalidRequest(data='Missing user ID')._data,
+                    _id=None)
+            else:
+                try:
+                    with session_scope.request(user_id=user_id):
+                        response = JSONRPCResponseManager.handle(
+                            request, scoped_dispatcher, context)
+                except LockConflict:
+                    logger.info('Write lock conflict, running the request '
+                                'again')
+                    with session_scope.request(immediate=True,
+                                               user_id=user_id):
+                        response = JSONRPCResponseManager.handle(
+                            request, scoped_dispatcher, context)
+            svc_end_time = time.perf_counter_ns()
+            log_payload('Response: %s', response.data, CustomJSONEncoder)
+            response = json.dumps(response.data, cls=CustomJSONEncoder,
+                                  separators=(',', ':'))
+            response = encrypt_response(response)
+
+            full_end_time = time.perf_counter_ns()
+            service_ms = (svc_end_time-svc_start_time) // 1_000_000
+            full_ms = (full_end_time-full_start_time) // 1_000_000
+            logger.info(f'Service execution time: {service_ms} ms',
+                        extra={'service_ms': service_ms})
+            logger.info(f'Full execution time: {full_ms} ms',
+                        extra={'full_ms': full_ms})
+        finally:
+            reset_request_id(request_id_token)
 
         start_response(status, headers)
         return [response]
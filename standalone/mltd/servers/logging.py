@@ -1,13 +1,177 @@
+"""Logging.
+
+All records go to the root logger, which writes them to
+'mltd-relive.log' through 'handler'. Handlers added with add_handler()
+(e.g. the stdout handler of the console) receive the same records.
+
+With 'log_mode = queue' in config.ini (the default), the root logger
+only has a QueueHandler, which puts records on a queue without
+formatting them, and a background QueueListener formats and writes them
+to the handlers. Requests therefore never wait for file I/O or
+formatting. With 'log_mode = sync', the handlers are attached to the
+root logger directly as before.
+
+With 'log_format = json', each record is written as one JSON object
+containing the time, level, logger name, message, request ID and any
+fields passed with 'extra'. Every record created while handling a
+request carries the request ID set with set_request_id().
+
+Payloads (e.g. decrypted requests and responses) are logged with
+log_payload() at debug level, for a sample of 'log_payload_sample_rate'
+of the requests, decided once per request so that the request and
+response payloads of a sampled request are both logged. A payload is
+only serialized when its record is written.
+"""
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from mltd.servers.config import config
 
+request_id = ContextVar('request_id', default='')
+# Whether the payloads of the current request are logged, or None
+# outside of a request
+_payload_sampled = ContextVar('payload_sampled', default=None)
+
+# Attributes of every LogRecord, which are not extra fields.
+_record_attributes = set(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime', 'request_id'}
+_record_factory = logging.getLogRecordFactory()
+
+
+def _request_record_factory(*args, **kwargs):
+    record = _record_factory(*args, **kwargs)
+    record.request_id = request_id.get()
+    return record
+
+
+logging.setLogRecordFactory(_request_record_factory)
+
+
+def set_request_id(value):
+    """Set the request ID of records created in the current context.
+
+    Also decides whether the payloads of the request are logged, so
+    that a sampled request has both its request and response payloads
+    logged (see log_payload()).
+    Args:
+        value: Request ID.
+    Returns:
+        A token to be passed to reset_request_id().
+    """
+    sampled = random.random() < config.log_payload_sample_rate
+    return request_id.set(value), _payload_sampled.set(sampled)
+
+
+def reset_request_id(token):
+    """Restore the request ID of the context before set_request_id().
+
+    Args:
+        token: Token returned by set_request_id().
+    """
+    request_id_token, sampled_token = token
+    request_id.reset(request_id_token)
+    _payload_sampled.reset(sampled_token)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a JSON object on a single line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.request_id:
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _record_attributes:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler leaving formatting to the listener thread."""
+
+    def prepare(self, record):
+        # Records stay in this process, so the message and arguments
+        # need not be merged into a picklable string here.
+        return record
+
+
+class LazyJSON:
+    """A value serialized to indented JSON only when formatted."""
+
+    def __init__(self, value, encoder=None):
+        self.value = value
+        self.encoder = encoder
+
+    def __str__(self):
+        if isinstance(self.value, (bytes, bytearray)):
+            return self.value.decode(errors='replace')
+        if isinstance(self.value, str):
+            return self.value
+        return json.dumps(self.value, cls=self.encoder, indent=2,
+                          ensure_ascii=False)
+
+
 logger = logging.getLogger()
 logger.setLevel(config.log_level)
 handler = RotatingFileHandler('mltd-relive.log', maxBytes=50_000_000,
                               backupCount=3, encoding='utf-8')
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+if config.log_format == 'json':
+    formatter = JSONFormatter()
+else:
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
-logger.addHandler(handler)
+
+if config.log_mode == 'queue':
+    _queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue, handler, respect_handler_level=True)
+    logger.addHandler(_DeferredQueueHandler(_queue))
+    _listener.start()
+    atexit.register(_listener.stop)
+else:
+    _listener = None
+    logger.addHandler(handler)
+
+
+def add_handler(new_handler):
+    """Add a handler receiving all records.
+
+    Args:
+        new_handler: A logging.Handler.
+    """
+    if _listener:
+        _listener.handlers = (*_listener.handlers, new_handler)
+    else:
+        logger.addHandler(new_handler)
+
+
+def log_payload(message, payload, encoder=None):
+    """Log a payload at debug level, for a sample of requests.
+
+    Within a request, the sampling decision made by set_request_id()
+    applies to all payloads of the request. Elsewhere, each call is
+    sampled on its own.
+    Args:
+        message: Message, where '%s' is replaced by the payload.
+        payload: bytes, bytearray, str or a JSON serializable object.
+        encoder: JSONEncoder subclass used to serialize the payload.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    sampled = _payload_sampled.get()
+    if sampled is None:
+        sampled = random.random() < config.log_payload_sample_rate
+    if sampled:
+        logger.debug(message, LazyJSON(payload, encoder))
@@ -1,5 +1,8 @@
+import time
 import traceback
-from multiprocessing import Pipe, Process
+from multiprocessing import Event, Pipe, Process
+
+from mltd.servers.logging import logger
 
 
 class CustomProcess(Process):
@@ -36,3 +39,96 @@ class CustomProcess(Process):
             self._exception = self._parent_exception_conn.recv()
         return self._exception
 
+
+class WorkerPool:
+    """Starts worker processes and restarts them when they exit.
+
+    Each worker runs 'target(worker_id=..., stop_event=..., conn=...,
+    **kwargs)' in a CustomProcess, and reports that it is ready through
+    the status pipe as a single server process does.
+    """
+
+    def __init__(self, target, workers, restart_delay=1, **kwargs):
+        """Initialize the pool.
+
+        Args:
+            target: Function run by each worker.
+            workers: Number of workers.
+            restart_delay: Minimum number of seconds between starting a
+                           worker and restarting it, so that a worker
+                           failing at startup is not restarted in a
+                           tight loop.
+            kwargs: Keyword arguments passed to 'target'. Objects such as
+                    sockets are passed to the workers by multiprocessing.
+        """
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.kwargs = kwargs
+        self.restarts = 0
+        self._stop_event = Event()
+        self._processes = [None] * workers
+        self._start_times = [0] * workers
+
+    def _start_worker(self, worker_id):
+        process = CustomProcess(
+            target=self.target, name=f'worker-{worker_id}', daemon=True,
+            kwargs={**self.kwargs, 'worker_id': worker_id,
+                    'stop_event': self._stop_event})
+        process.start()
+        self._processes[worker_id] = process
+        self._start_times[worker_id] = time.monotonic()
+
+    def start(self):
+        """Start all workers."""
+        for worker_id in range(self.workers):
+            self._start_worker(worker_id)
+
+    def is_ready(self):
+        """Whether all workers have reported that they are ready."""
+        return all(process.is_ready() for process in self._processes)
+
+    def supervise(self):
+        """Restart the workers that have exited.
+
+        Call this periodically from the parent process.
+        Returns:
+            The number of workers restarted.
+        """
+        if self._stop_event.is_set():
+            return 0
+        restarted = 0
+        for worker_id, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            if (time.monotonic() - self._start_times[worker_id]
+                    < self.restart_delay):
+                continue
+            exception = process.exception
+            if exception:
+                logger.error(f'Worker {worker_id} failed:\n{exception}')
+            else:
+                logger.error(f'Worker {worker_id} exited with code '
+                             f'{process.exitcode}')
+            logger.info(f'Restarting worker {worker_id}...')
+            self._start_worker(worker_id)
+            self.restarts += 1
+            restarted += 1
+        return restarted
+
+    def stop(self, timeout=10):
+        """Stop all workers after the requests being handled.
+
+        Args:
+            timeout: Seconds to wait for the workers to finish before
+                     terminating them.
+        """
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(deadline - time.monotonic(), 0))
+        for worker_id, process in enumerate(self._processes):
+            if process.is_alive():
+                logger.warning(f'Terminating worker {worker_id}')
+                process.terminate()
+                process.join()
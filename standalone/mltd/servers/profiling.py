@@ -0,0 +1,308 @@
+"""Stage-level profiling for heavy service methods.
+
+A service method wraps its body in 'stage_profiler.profile()' and marks
+the beginning of each stage by calling 'stage()' on the returned call
+object. Each stage lasts until the next stage begins or the call ends,
+so stages can be marked next to existing '#region' comments without
+re-indenting the code in between.
+
+For each stage, the wall time and the number of SQL statements executed
+are recorded. SQL statements are counted by the engine event listener
+in 'mltd.models.engine', which calls 'count_statement()' for every
+statement. The overhead is a few perf_counter_ns() calls per stage,
+which makes it cheap enough to be always enabled.
+
+Results are exposed in three ways:
+1. Each call logs its per-stage breakdown at debug level. The breakdown
+   is only formatted when debug logging is enabled.
+2. Once N calls of a method have been recorded, a call that ranks among
+   the slowest N calls of its method logs its breakdown at info level.
+3. summary() and slowest() return the aggregated per-stage statistics
+   and the breakdowns of the slowest N calls. The API server saves them
+   to 'mltd-relive-profile.json' every few seconds (each API worker to
+   'mltd-relive-profile-<worker ID>.json'), and the console prints them
+   merged:
+       python console.py --profile
+"""
+import glob
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from mltd.servers.logging import logger
+from mltd.servers.utilities import save_periodically
+
+slowest_n = 10
+stats_path = 'mltd-relive-profile.json'
+worker_stats_pattern = 'mltd-relive-profile-*.json'
+
+
+class ProfiledCall:
+    """Per-stage timings of a single profiled call."""
+
+    def __init__(self, profiler, method):
+        self.method = method
+        self.stages = []
+        self.total_ns = 0
+        self.total_statements = 0
+        self._profiler = profiler
+        self._stage_name = None
+        self._stage_start_ns = 0
+        self._stage_start_statements = 0
+
+    def stage(self, name):
+        """End the current stage (if any) and begin a new one."""
+        now = time.perf_counter_ns()
+        statements = self._profiler.statement_count()
+        self._end_stage(now, statements)
+        self._stage_name = name
+        self._stage_start_ns = now
+        self._stage_start_statements = statements
+
+    def _end_stage(self, now, statements):
+        if self._stage_name is None:
+            return
+        self.stages.append((self._stage_name,
+                            now - self._stage_start_ns,
+                            statements - self._stage_start_statements))
+        self._stage_name = None
+
+    def breakdown(self):
+        """Return a one-line human-readable breakdown of this call."""
+        stages = ', '.join(
+            f'{name}={elapsed_ns / 1_000_000:.1f} ms/{statements} sql'
+            for name, elapsed_ns, statements in self.stages)
+        return (f'{self.method}: {self.total_ns / 1_000_000:.1f} ms, '
+                f'{self.total_statements} sql ({stages})')
+
+
+class StageProfiler:
+    """Collects stage timings of profiled calls across all threads."""
+
+    def __init__(self, slowest_n=slowest_n, save_interval=10):
+        """Initialize the profiler.
+
+        Args:
+            slowest_n: Number of slowest calls kept for each method.
+            save_interval: Seconds between saving the statistics to
+                           'path' after start_saving().
+        """
+        self.slowest_n = slowest_n
+        self.save_interval = save_interval
+        self.path = stats_path
+        self._changed = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        # {(method, stage): [count, total_ns, max_ns, total_statements]}
+        self._stats = {}
+        # {method: min-heap of (total_ns, seq, ProfiledCall)}
+        self._slowest = {}
+
+    def count_statement(self):
+        """Count one SQL statement executed by the current thread."""
+        self._local.statements = getattr(self._local, 'statements', 0) + 1
+
+    def statement_count(self):
+        """Return the number of SQL statements executed by the current
+        thread so far."""
+        return getattr(self._local, 'statements', 0)
+
+    @contextmanager
+    def profile(self, method):
+        """Profile a call to a service method.
+
+        Args:
+            method: Name of the service method being profiled.
+        Yields:
+            A ProfiledCall object. Call its stage() method to mark the
+            beginning of each stage.
+        """
+        call = ProfiledCall(self, method)
+        start_ns = time.perf_counter_ns()
+        start_statements = self.statement_count()
+        try:
+            yield call
+        finally:
+            end_ns = time.perf_counter_ns()
+            end_statements = self.statement_count()
+            call._end_stage(end_ns, end_statements)
+            call.total_ns = end_ns - start_ns
+            call.total_statements = end_statements - start_statements
+            self._record(call)
+
+    def _record(self, call):
+        with self._lock:
+            self._changed = True
+            for name, elapsed_ns, statements in call.stages:
+                stats = self._stats.setdefault((call.method, name),
+                                               [0, 0, 0, 0])
+                stats[0] += 1
+                stats[1] += elapsed_ns
+                stats[2] = max(stats[2], elapsed_ns)
+                stats[3] += statements
+            heap = self._slowest.setdefault(call.method, [])
+            entry = (call.total_ns, next(self._counter), call)
+            if len(heap) < self.slowest_n:
+                # Every call is among the slowest until N are recorded.
+                heapq.heappush(heap, entry)
+                is_slowest = False
+            elif call.total_ns > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+                is_slowest = True
+            else:
+                is_slowest = False
+
+        if is_slowest:
+            logger.info(f'Among slowest {self.slowest_n} calls: '
+                        f'{call.breakdown()}')
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(call.breakdown())
+
+    def summary(self):
+        """Return aggregated statistics of all profiled stages.
+
+        Returns:
+            A list of dicts sorted by method name and then by total
+            time in descending order. Each dict contains the following
+            keys: method, stage, count, total_ms, avg_ms, max_ms and
+            avg_statements.
+        """
+        with self._lock:
+            items = [(key, list(stats)) for key, stats in self._stats.items()]
+        result = [{
+            'method': method,
+            'stage': stage,
+            'count': count,
+            'total_ms': total_ns / 1_000_000,
+            'avg_ms': total_ns / count / 1_000_000,
+            'max_ms': max_ns / 1_000_000,
+            'avg_statements': total_statements / count
+        } for (method, stage), (count, total_ns, max_ns, total_statements)
+            in items]
+        result.sort(key=lambda x: (x['method'], -x['total_ms']))
+        return result
+
+    def slowest(self, method):
+        """Return the slowest calls of a method, slowest first.
+
+        Args:
+            method: Name of the profiled service method.
+        Returns:
+            A list of ProfiledCall objects.
+        """
+        with self._lock:
+            heap = list(self._slowest.get(method, []))
+        return [call for _, _, call in sorted(heap, reverse=True)]
+
+    def reset(self):
+        """Discard all collected statistics."""
+        with self._lock:
+            self._stats.clear()
+            self._slowest.clear()
+
+    def save(self, path=None):
+        """Save the statistics and the slowest calls to a JSON file."""
+        path = path or self.path
+        with self._lock:
+            self._changed = False
+            methods = list(self._slowest)
+        slowest = [{
+            'method': call.method,
+            'total_ms': call.total_ns / 1_000_000,
+            'breakdown': call.breakdown(),
+        } for method in methods for call in self.slowest(method)]
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'stages': self.summary(),
+                       'slowest': slowest}, f)
+        os.replace(f'{path}.tmp', path)
+
+    def _save_changed(self):
+        if self._changed:
+            self.save()
+
+    def start_saving(self):
+        """Save to 'path' every 'save_interval' seconds if calls were
+        recorded, and at exit."""
+        save_periodically(self._save_changed, self.save_interval,
+                          'profile-saver')
+
+
+stage_profiler = StageProfiler()
+
+
+def load_profile(path=None):
+    """Load the statistics saved by the API server or its workers.
+
+    Args:
+        path: File saved by StageProfiler.save(), or None to merge the
+              files of the API server or of all its workers.
+    Returns:
+        A tuple of a list of stage dicts (see StageProfiler.summary())
+        and a list of the slowest calls of each method, slowest first,
+        as dicts containing the following keys: method, total_ms and
+        breakdown.
+    Raises:
+        FileNotFoundError: No file was found.
+    """
+    paths = [path] if path else glob.glob(worker_stats_pattern)
+    if not paths:
+        paths = [stats_path]
+    # {(method, stage): merged row}
+    merged = {}
+    slowest = []
+    for file_path in paths:
+        with open(file_path, encoding='utf-8') as f:
+            data = json.load(f)
+        for row in data['stages']:
+            key = (row['method'], row['stage'])
+            total = merged.get(key)
+            if total is None:
+                merged[key] = dict(row)
+                continue
+            statements = (total['avg_statements'] * total['count']
+                          + row['avg_statements'] * row['count'])
+            total['count'] += row['count']
+            total['total_ms'] += row['total_ms']
+            total['max_ms'] = max(total['max_ms'], row['max_ms'])
+            total['avg_ms'] = total['total_ms'] / total['count']
+            total['avg_statements'] = statements / total['count']
+        slowest.extend(data['slowest'])
+    stages = sorted(merged.values(),
+                    key=lambda x: (x['method'], -x['total_ms']))
+    slowest.sort(key=lambda x: x['total_ms'], reverse=True)
+    # Keep the slowest N calls of each method across all files.
+    counts = {}
+    kept = []
+    for call in slowest:
+        counts[call['method']] = counts.get(call['method'], 0) + 1
+        if counts[call['method']] <= slowest_n:
+            kept.append(call)
+    return stages, kept
+
+
+def format_profile(stages, slowest):
+    """Format the stage statistics and the slowest calls as text.
+
+    Args:
+        stages: A list of stage dicts returned by load_profile().
+        slowest: A list of slowest calls returned by load_profile().
+    Returns:
+        A str.
+    """
+    lines = [f'{"method":<28} {"stage":<24} {"count":>7} {"avg ms":>8} '
+             f'{"max ms":>8} {"avg sql":>8}']
+    for row in stages:
+        lines.append(f'{row["method"]:<28} {row["stage"]:<24} '
+                     f'{row["count"]:>7} {row["avg_ms"]:>8.1f} '
+                     f'{row["max_ms"]:>8.1f} {row["avg_statements"]:>8.1f}')
+    if slowest:
+        lines.append('')
+        lines.append('Slowest calls:')
+        lines.extend(call['breakdown'] for call in slowest)
+    return '\n'.join(lines)
@@ -0,0 +1,57 @@
+"""Scheduler for running batch jobs at server day boundaries.
+
+The daily reset is performed once at startup to catch up on any day
+boundary passed while the server was not running, and then at the start
+of each server day in the timezone specified by 'config.timezone'.
+Login still checks whether the daily reset is due for the user, so a
+user logging in right at the day boundary is never left unreset.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from mltd.servers.logging import logger
+from mltd.services.daily_reset import day_start, run_daily_reset
+
+# Number of seconds to wait after the day boundary before running the
+# daily reset, so that the job never runs slightly before midnight due
+# to timer inaccuracy.
+margin = 1
+
+_scheduler_thread = None
+
+
+def seconds_until_next_day(now):
+    """Get the number of seconds until the start of the next server day.
+
+    Args:
+        now: A timezone-aware datetime.
+    Returns:
+        Number of seconds (float) including the safety margin.
+    """
+    next_day_start = day_start(now + timedelta(days=1))
+    return (next_day_start - now).total_seconds() + margin
+
+
+def _run():
+    while True:
+        try:
+            run_daily_reset()
+        except Exception:
+            logger.exception('Daily reset failed.')
+        seconds = seconds_until_next_day(datetime.now(timezone.utc))
+        logger.info(f'Next daily reset in {seconds:.0f} seconds.')
+        time.sleep(seconds)
+
+
+def start():
+    """Start the daily reset scheduler in a daemon thread.
+
+    Calling this method more than once has no effect.
+    """
+    global _scheduler_thread
+    if _scheduler_thread:
+        return
+    _scheduler_thread = threading.Thread(target=_run, name='scheduler',
+                                         daemon=True)
+    _scheduler_thread.start()
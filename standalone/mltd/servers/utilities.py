@@ -1,18 +1,53 @@
+import atexit
+import threading
+import time
 from datetime import datetime, timezone
 
+from mltd.servers.logging import logger
+
 
 def format_datetime(dt):
-    """Return a str formatted as 'YYYY-MM-DDThh:mm:ss+zzzz'."""
+    """Return a str formatted as 'YYYY-MM-DDThh:mm:ss+zzzz'.
+
+    Naive datetimes are treated as UTC. isoformat() is used instead of
+    strftime() since it is about twice as fast, and its '+hh:mm' offset
+    only needs the colon removed. Placeholder dates such as 0001-01-01
+    still go through strftime(), which does not zero-pad the year, to
+    keep the output unchanged.
+    """
     if not isinstance(dt, datetime):
         raise TypeError('Not a datetime object')
+    if dt.year < 1000:
+        if not dt.tzinfo:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.strftime('%Y-%m-%dT%H:%M:%S%z')
+    s = dt.isoformat(timespec='seconds')
     if not dt.tzinfo:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.strftime('%Y-%m-%dT%H:%M:%S%z')
+        return s + '+0000'
+    return s[:-3] + s[-2:]
+
 
+def save_periodically(save, interval, name):
+    """Call a function every few seconds in a daemon thread, and at exit.
 
-def str_to_datetime(s):
-    """Convert a str into a UTC datetime."""
-    if not s:
-        return None
-    return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
+    Used by server processes to save statistics to a file read by the
+    console, so that the file stays current when no more requests come.
+    Args:
+        save: A function taking no arguments.
+        interval: Seconds between calls.
+        name: Name of the thread.
+    Returns:
+        The started thread.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                save()
+            except Exception:
+                logger.exception(f'{name} failed')
 
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    atexit.register(save)
+    return thread
@@ -2,11 +2,10 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Achievement
 from mltd.models.schemas import AchievementSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='AchievementService.GetAchievementList',
@@ -37,7 +36,7 @@ def get_achievement_list(params, context):
                         obtain by any user on the server.
             sort_id: Sort ID.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         achievements = session.scalars(
             select(Achievement)
             .where(Achievement.user_id == UUID(context['user_id']))
@@ -0,0 +1,194 @@
+"""Precomputed card and costume albums.
+
+The card album consists of master data for every card (each appearing
+twice, once unawakened and once awakened), and only the 'is_released'
+flag of each entry depends on the user. Serializing every MstCard with
+its relationships on each request is expensive, so the serialized album
+is built once per language as a template. Each card is identified by its
+ordinal in the template.
+
+The cards owned by a user and the awakened ones are represented as two
+bitsets (Python ints where bit i corresponds to the card with ordinal
+i), which are built from a single query on the card table. An album
+response is the template merged with the two bitsets.
+
+Running this module as a script checks that the merged album is the
+same as the one serialized from scratch and benchmarks both for the
+full card catalog.
+    python -m mltd.services.album [--user-id USER_ID] [--repeat N]
+"""
+import argparse
+import threading
+import time
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from mltd.models.engine import engine
+from mltd.models.models import Card, MstCard, MstCostume
+from mltd.models.schemas import AlbumSchema, MstCostumeSchema
+from mltd.servers.config import config
+
+
+class AlbumTemplate:
+    """Serialized card and costume albums shared by all users."""
+
+    def __init__(self, session: Session):
+        """Serialize the albums from master data.
+
+        Args:
+            session: Existing SQLAlchemy session.
+        """
+        mst_cards = session.scalars(
+            select(MstCard)
+        ).all()
+        album_schema = AlbumSchema()
+        self._cards = album_schema.dump(mst_cards, many=True)
+        self.card_ordinals = {card['mst_card_id']: i
+                              for i, card in enumerate(self._cards)}
+
+        mst_costumes = session.scalars(
+            select(MstCostume)
+            .where(MstCostume.exclude_album == False)
+        ).all()
+        mst_costume_schema = MstCostumeSchema()
+        self.costume_list = mst_costume_schema.dump(mst_costumes, many=True)
+
+    def get_bitsets(self, session: Session, user_id):
+        """Get the released and awakened bitsets of a user.
+
+        Args:
+            session: Existing SQLAlchemy session.
+            user_id: User ID in UUID format.
+        Returns:
+            A tuple (released, awakened) of ints. Bit i is set if the
+            user owns (or has awakened) the card with ordinal i.
+        """
+        released = 0
+        awakened = 0
+        for mst_card_id, is_awakened in session.execute(
+            select(Card.mst_card_id, Card.is_awakened)
+            .where(Card.user_id == user_id)
+        ):
+            bit = 1 << self.card_ordinals[mst_card_id]
+            released |= bit
+            if is_awakened:
+                awakened |= bit
+        return released, awakened
+
+    def render(self, released, awakened):
+        """Merge the card album template with the bitsets of a user.
+
+        Args:
+            released: Bitset of cards owned by the user.
+            awakened: Bitset of cards awakened by the user.
+        Returns:
+            A list of dicts representing the card album. See the return
+            value 'album_list' of the method 'CardService.GetAlbumList'
+            for the dict definition.
+        """
+        album_list = []
+        for is_awakened, bitset in [(False, released), (True, awakened)]:
+            for card in self._cards:
+                album_list.append({
+                    **card,
+                    'is_awakened': is_awakened,
+                    'is_released': bool(bitset & 1)
+                })
+                bitset >>= 1
+        return album_list
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_album_template(session: Session):
+    """Get the album template of the current language.
+
+    The template is built on the first call for each language.
+    Args:
+        session: Existing SQLAlchemy session.
+    Returns:
+        An AlbumTemplate object.
+    """
+    template = _templates.get(config.language)
+    if not template:
+        with _templates_lock:
+            template = _templates.get(config.language)
+            if not template:
+                template = AlbumTemplate(session)
+                _templates[config.language] = template
+    return template
+
+
+def _serialize_album(session: Session, user_id):
+    """Serialize the card album from scratch for comparison."""
+    mst_cards = session.scalars(
+        select(MstCard)
+    ).all()
+    owned_card_ids = set(session.scalars(
+        select(Card.mst_card_id)
+        .where(Card.user_id == user_id)
+    ))
+    awakened_card_ids = set(session.scalars(
+        select(Card.mst_card_id)
+        .where(Card.user_id == user_id)
+        .where(Card.is_awakened == True)
+    ))
+    album_schema = AlbumSchema()
+    album_list = []
+    for is_awakened, card_ids in [(False, owned_card_ids),
+                                  (True, awakened_card_ids)]:
+        for card in album_schema.dump(mst_cards, many=True):
+            card['is_awakened'] = is_awakened
+            card['is_released'] = card['mst_card_id'] in card_ids
+            album_list.append(card)
+    return album_list
+
+
+def benchmark(user_id, repeat=10):
+    """Compare the merged album with the serialized one and time both.
+
+    Args:
+        user_id: User ID in UUID format.
+        repeat: Number of times to build the album with each method.
+    Returns:
+        True if both methods produce the same album.
+    """
+    with Session(engine) as session:
+        start = time.perf_counter()
+        template = get_album_template(session)
+        template_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            expected = _serialize_album(session, user_id)
+        serialize_seconds = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            actual = template.render(*template.get_bitsets(session, user_id))
+        render_seconds = (time.perf_counter() - start) / repeat
+
+    passed = actual == expected
+    print(f'{len(template.card_ordinals)} cards, '
+          f'{sum(x["is_released"] for x in actual)} released entries')
+    print(f'Template built once in {template_seconds*1000:.1f} ms')
+    print(f'Serialize from scratch: {serialize_seconds*1000:.1f} ms/request')
+    print(f'Template with bitsets: {render_seconds*1000:.1f} ms/request')
+    print('Albums are identical' if passed else 'Albums differ')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Verify and benchmark the precomputed card album.')
+    parser.add_argument('--user-id',
+                        default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                        help='user ID in UUID format')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of albums to build with each method')
+    args = parser.parse_args()
+    raise SystemExit(0 if benchmark(UUID(args.user_id), args.repeat) else 1)
@@ -1,16 +1,12 @@
-import random
 from datetime import datetime, timezone
 from uuid import UUID
 
 from jsonrpc import dispatcher
-from sqlalchemy import delete, select, update
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
-from mltd.models.models import (Item, Mission, MstMission, MstSong, Offer,
-                                Song, User)
 from mltd.models.schemas import UserSchema
-from mltd.servers.config import config
+from mltd.models.session_scope import request_session
+from mltd.models.statements import select_user
+from mltd.services.daily_reset import is_daily_reset_due, reset_users
 
 
 @dispatcher.add_method(name='AuthService.TransferPassword')
@@ -109,15 +105,16 @@ def login(params):
                 resource_id: A string for getting song-related
                              resources.
                 sort_id: Sort ID.
-            type_lp_list: A list of 4 dicts representing user's all song
-                          LPs grouped by each idol type. Each dict
+            type_lp_list: A list of 4 dicts representing user's top 10
+                          song LPs grouped by each idol type. Each dict
                           contains the following keys.
                 idol_type: Song idol type.
-                lp_song_status_list: A nullable list of dicts
-                                     representing user's all song LPs
-                                     specific to this idol type, sorted
-                                     in descending LP. See 'lp_list'
-                                     above for the dict definition.
+                lp_song_status_list: A nullable list of at most 10
+                                     dicts representing user's highest
+                                     song LPs specific to this idol
+                                     type, sorted in descending LP. See
+                                     'lp_list' above for the dict
+                                     definition.
                 lp: User LP for this idol type. Calculated from user's
                     10 best song LPs for this idol type.
             theater_fan: Current number of fans for the user.
@@ -211,115 +208,22 @@ def login(params):
         ),
     }
 
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(params['user_id']))
+            select_user(UUID(params['user_id']))
         ).one()
         result['is_pending_song'] = user.pending_song is not None
         result['is_pending_job'] = user.pending_job is not None
         result['is_join_lounge'] = True if user.lounge_id else False
 
         now = datetime.now(timezone.utc)
-        last_login_date = user.last_login_date.replace(tzinfo=timezone.utc)
+        # Daily reset is normally performed by the scheduler at the start
+        # of each server day. Perform it here only if the user has not
+        # been reset yet (e.g. the server was not running at that time).
+        if is_daily_reset_due(user.challenge_song.update_date, now):
+            reset_users(session, now, user.user_id)
+            session.expire_all()
         user.last_login_date = now
-        # Perform daily reset.
-        if (last_login_date.astimezone(config.timezone).date()
-                < now.astimezone(config.timezone).date()):
-            # Update challenge_song based on user's unplayed and
-            # unlocked songs, idols' birthdays and server date.
-            unlocked_stmt = (
-                select(Song.mst_song_id)
-                .where(Song.user == user)
-                .where(Song.is_disable == False)
-            )
-            unlocked_song_ids = session.scalars(unlocked_stmt).all()
-            unplayed_stmt = unlocked_stmt.where(Song.is_played == False)
-            unplayed_song_ids = session.scalars(unplayed_stmt).all()
-            server_month = now.astimezone(config.timezone).month
-            server_day = now.astimezone(config.timezone).day
-            # TODO: check idols' birthdays
-            if (server_month == 2 and server_day == 27
-                and 1 in unlocked_song_ids):
-                user.challenge_song.daily_challenge_mst_song_id = 1
-            else:
-                song_ids = unlocked_song_ids
-                if unplayed_song_ids:
-                    song_ids = random.choice([unplayed_song_ids,
-                                              unlocked_song_ids])
-                user.challenge_song.daily_challenge_mst_song_id = (
-                    random.choice(song_ids))
-            user.challenge_song.update_date = now
-
-            # Remove expired items.
-            session.execute(
-                update(Item)
-                .where(Item.user == user)
-                .where(Item.mst_item_id.in_([
-                    32,     # One-day spark drink 30
-                    33      # One-day spark drink MAX
-                ]))
-                .values(amount=0)
-            )
-
-            # Reset daily missions.
-            session.execute(
-                update(Mission)
-                .where(Mission.user == user)
-                .where(Mission.mst_mission.has(MstMission.mission_type == 1))
-                .values(
-                    create_date=now,
-                    update_date=now,
-                    finish_date=datetime(1, 1, 1),
-                    progress=0,
-                    mission_state=1
-                )
-            )
-            song_idol_type_subq = (
-                select(MstSong.idol_type)
-                .where(MstSong.mst_song_id
-                       == user.challenge_song.daily_challenge_mst_song_id)
-                .scalar_subquery()
-            )
-            session.execute(
-                update(Mission)
-                .where(Mission.user == user)
-                .where(Mission.mst_mission_id == 72)
-                .values(song_idol_type=song_idol_type_subq)
-            )
-
-            # Reset weekly missions.
-            if (last_login_date.astimezone(config.timezone).year
-                    != now.astimezone(config.timezone).year
-                    or last_login_date.astimezone(
-                        config.timezone).isocalendar()[1]
-                    != now.astimezone(config.timezone).isocalendar()[1]):
-                session.execute(
-                    update(Mission)
-                    .where(Mission.user == user)
-                    .where(Mission.mst_mission.has(
-                        MstMission.mission_type == 2))
-                    .values(
-                        create_date=now,
-                        update_date=now,
-                        finish_date=datetime(1, 1, 1),
-                        progress=0,
-                        mission_state=1
-                    )
-                )
-
-            # Clear offer list.
-            session.execute(
-                delete(Offer)
-                .where(Offer.user_id == user.user_id)
-                .where(Offer.slot == 0)
-            )
-
-            # Reset daily free draws.
-            for gasha in user.gashas:
-                if gasha.mst_gasha_id == 99002:
-                    gasha.draw1_free_count = 1
-                    gasha.balloon = 1
 
         user_schema = UserSchema()
         result['user'] = user_schema.dump(user)
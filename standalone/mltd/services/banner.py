@@ -1,11 +1,10 @@
 from uuid import UUID
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Item, MstBanner, Present
 from mltd.models.schemas import MstBannerSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='BannerService.GetBannerList',
@@ -37,7 +36,7 @@ def get_banner_list(params, context):
         fixed_banner: A dict with empty banner info. See 'banner_list'
                       above for the dict definition.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         # Check whether the user has Welcome!! guaranteed SSR gacha
         # ticket.
         user_id = UUID(context['user_id'])
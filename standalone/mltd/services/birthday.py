@@ -5,9 +5,9 @@ from jsonrpc import dispatcher
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Birthday, MstBirthdayCalendar, MstIdol
 from mltd.models.schemas import BirthdaySchema, MstBirthdayCalendarSchema
+from mltd.models.session_scope import request_session
 from mltd.servers.config import config
 
 
@@ -89,7 +89,7 @@ def get_birthday(params, context):
     server_month = now.astimezone(config.timezone).month
     server_day = now.astimezone(config.timezone).day
 
-    with Session(engine) as session:
+    with request_session() as session:
         birthday_calendars = session.scalars(
             select(MstBirthdayCalendar)
         ).all()
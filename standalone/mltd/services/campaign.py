@@ -2,11 +2,10 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Campaign
 from mltd.models.schemas import CampaignSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='CampaignService.GetCampaignList',
@@ -29,7 +28,7 @@ def get_campaign_list(params, context):
             start_date: Campaign start date.
             end_date: Capmaign end date.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         campaigns = session.scalars(
             select(Campaign)
             .where(Campaign.user_id == UUID(context['user_id']))
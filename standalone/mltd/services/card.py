@@ -4,9 +4,11 @@ from jsonrpc import dispatcher
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
-from mltd.models.models import Card, MstCard, MstCostume, User
-from mltd.models.schemas import AlbumSchema, CardSchema, MstCostumeSchema
+from mltd.models.models import Card, MstCard, User
+from mltd.models.session_scope import request_session
+from mltd.services import fragments
+from mltd.services.album import get_album_template
+from mltd.services.list_cache import list_cache
 
 
 def add_card(session: Session, user: User, mst_card_id):
@@ -55,6 +57,7 @@ def add_card(session: Session, user: User, mst_card_id):
 
 
 @dispatcher.add_method(name='CardService.GetCardList', context_arg='context')
+@list_cache.cached('card')
 def get_card_list(params, context):
     """Get a list of cards obtained by the user.
 
@@ -256,19 +259,15 @@ def get_card_list(params, context):
             sign_type: 0.
             sign_type2: 0.
     """
-    with Session(engine) as session:
-        cards = session.scalars(
-            select(Card)
-            .where(Card.user_id == UUID(context['user_id']))
-        ).all()
-
-        card_schema = CardSchema()
-        card_list = card_schema.dump(cards, many=True)
+    with request_session() as session:
+        card_list = fragments.get_card_list(session,
+                                            UUID(context['user_id']))
 
     return {'card_list': card_list}
 
 
 @dispatcher.add_method(name='CardService.GetAlbumList', context_arg='context')
+@list_cache.cached('card')
 def get_album_list(params, context):
     """Get the card and costume albums of the user.
 
@@ -322,40 +321,12 @@ def get_album_list(params, context):
                       return value 'costume_list' of the method
                       'CardService.GetCardList' for the dict definition.
     """
-    with Session(engine) as session:
-        mst_cards = session.scalars(
-            select(MstCard)
-        ).all()
-
-        owned_card_ids = session.scalars(
-            select(Card.mst_card_id)
-            .where(Card.user_id == UUID(context['user_id']))
-        ).all()
-        awakened_card_ids = session.scalars(
-            select(Card.mst_card_id)
-            .where(Card.user_id == UUID(context['user_id']))
-            .where(Card.is_awakened == True)
-        ).all()
-
-        album_schema = AlbumSchema()
-        owned_album_list = album_schema.dump(mst_cards, many=True)
-        for card in owned_album_list:
-            card['is_awakened'] = False
-            card['is_released'] = card['mst_card_id'] in owned_card_ids
-        awakened_album_list = album_schema.dump(mst_cards, many=True)
-        for card in awakened_album_list:
-            card['is_awakened'] = True
-            card['is_released'] = card['mst_card_id'] in awakened_card_ids
-        album_list = owned_album_list
-        album_list.extend(awakened_album_list)
-
-        mst_costumes = session.scalars(
-            select(MstCostume)
-            .where(MstCostume.exclude_album == False)
-        ).all()
-
-        mst_costume_schema = MstCostumeSchema()
-        costume_list = mst_costume_schema.dump(mst_costumes, many=True)
+    with request_session() as session:
+        album_template = get_album_template(session)
+        released, awakened = album_template.get_bitsets(
+            session, UUID(context['user_id']))
+        album_list = album_template.render(released, awakened)
+        costume_list = album_template.costume_list
 
     return {
         'album_list': album_list,
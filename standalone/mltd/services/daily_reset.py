@@ -0,0 +1,252 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from mltd.models.models import (ChallengeSong, Gasha, Item, Mission,
+                                MstMission, MstSong, Offer, Song)
+from mltd.models.shards import shard_router
+from mltd.servers.config import config
+from mltd.servers.logging import logger
+
+
+def day_start(now):
+    """Get the start of the server day containing a given time.
+
+    Args:
+        now: A timezone-aware datetime.
+    Returns:
+        A UTC datetime representing 00:00 of the same day in server
+        timezone.
+    """
+    server_now = now.astimezone(config.timezone)
+    return server_now.replace(
+        hour=0, minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+
+
+def week_start(now):
+    """Get the start of the current period for weekly missions.
+
+    Weekly missions are reset when either the ISO week or the year
+    changes in server timezone, so the period starts at the later of
+    00:00 on Monday and 00:00 on January 1st.
+    Args:
+        now: A timezone-aware datetime.
+    Returns:
+        A UTC datetime representing the start of the current period.
+    """
+    server_now = now.astimezone(config.timezone)
+    server_day_start = server_now.replace(hour=0, minute=0, second=0,
+                                          microsecond=0)
+    monday = server_day_start - timedelta(days=server_now.weekday())
+    january_1st = server_day_start.replace(month=1, day=1)
+    return max(monday, january_1st).astimezone(timezone.utc)
+
+
+def is_daily_reset_due(last_reset_date, now):
+    """Check whether a user has not been reset today yet.
+
+    The update date of the daily challenge song marks the last time the
+    daily reset was performed for a user.
+    Args:
+        last_reset_date: challenge_song.update_date of the user.
+        now: A timezone-aware datetime.
+    Returns:
+        A bool indicating whether the daily reset should be performed.
+    """
+    return last_reset_date.replace(tzinfo=timezone.utc) < day_start(now)
+
+
+def reset_users(session: Session, now, user_id=None):
+    """Perform the daily and weekly resets using set-based statements.
+
+    Resets all users who have not been reset since the start of the
+    current server day, or only the specified user if 'user_id' is
+    given. The following are reset.
+    1. A new daily challenge song is chosen based on user's unplayed and
+       unlocked songs and server date.
+    2. One-day items are removed.
+    3. Daily missions are reset, and the idol type of mission 72 is set
+       to the idol type of the new daily challenge song.
+    4. Weekly missions are reset if the user has not been reset since
+       the start of the current week.
+    5. Offers in slot 0 are cleared.
+    6. Daily free draws are reset.
+    This method is idempotent within the same server day.
+    Args:
+        session: Existing SQLAlchemy session. The caller is responsible
+                 for committing the changes.
+        now: A timezone-aware datetime representing the current time.
+        user_id: User ID in UUID format (default None for all users).
+    Returns:
+        Number of users that have been reset.
+    """
+    today_start = day_start(now)
+    this_week_start = week_start(now)
+    options = {'synchronize_session': False}
+
+    due_stmt = (
+        select(ChallengeSong.user_id)
+        .where(ChallengeSong.update_date < today_start)
+    )
+    if user_id:
+        due_stmt = due_stmt.where(ChallengeSong.user_id == user_id)
+    weekly_due_stmt = due_stmt.where(
+        ChallengeSong.update_date < this_week_start)
+    due_stmt = due_stmt.correlate(None)
+    weekly_due_stmt = weekly_due_stmt.correlate(None)
+
+    reset_count = session.scalar(
+        select(func.count())
+        .select_from(due_stmt.subquery())
+    )
+    if not reset_count:
+        return 0
+
+    # Remove expired items.
+    session.execute(
+        update(Item)
+        .where(Item.user_id.in_(due_stmt))
+        .where(Item.mst_item_id.in_([
+            32,     # One-day spark drink 30
+            33      # One-day spark drink MAX
+        ]))
+        .values(amount=0),
+        execution_options=options
+    )
+
+    # Reset daily missions.
+    session.execute(
+        update(Mission)
+        .where(Mission.user_id.in_(due_stmt))
+        .where(Mission.mst_mission_id.in_(
+            select(MstMission.mst_mission_id)
+            .where(MstMission.mission_type == 1)
+        ))
+        .values(
+            create_date=now,
+            update_date=now,
+            finish_date=datetime(1, 1, 1),
+            progress=0,
+            mission_state=1
+        ),
+        execution_options=options
+    )
+
+    # Reset weekly missions.
+    session.execute(
+        update(Mission)
+        .where(Mission.user_id.in_(weekly_due_stmt))
+        .where(Mission.mst_mission_id.in_(
+            select(MstMission.mst_mission_id)
+            .where(MstMission.mission_type == 2)
+        ))
+        .values(
+            create_date=now,
+            update_date=now,
+            finish_date=datetime(1, 1, 1),
+            progress=0,
+            mission_state=1
+        ),
+        execution_options=options
+    )
+
+    # Clear offer list.
+    session.execute(
+        delete(Offer)
+        .where(Offer.user_id.in_(due_stmt))
+        .where(Offer.slot == 0),
+        execution_options=options
+    )
+
+    # Reset daily free draws.
+    session.execute(
+        update(Gasha)
+        .where(Gasha.user_id.in_(due_stmt))
+        .where(Gasha.mst_gasha_id == 99002)
+        .values(draw1_free_count=1, balloon=1),
+        execution_options=options
+    )
+
+    # Update challenge_song based on user's unplayed and unlocked songs,
+    # idols' birthdays and server date. Half of the users with unplayed
+    # songs get an unplayed song, and the rest get any unlocked song.
+    due_challenge_song_stmt = (
+        update(ChallengeSong)
+        .where(ChallengeSong.update_date < today_start)
+    )
+    if user_id:
+        due_challenge_song_stmt = due_challenge_song_stmt.where(
+            ChallengeSong.user_id == user_id)
+    unlocked_stmt = (
+        select(Song.mst_song_id)
+        .where(Song.user_id == ChallengeSong.user_id)
+        .where(Song.is_disable == False)
+    )
+    unplayed_stmt = unlocked_stmt.where(Song.is_played == False)
+    session.execute(
+        due_challenge_song_stmt
+        .where(unlocked_stmt.exists())
+        .values(daily_challenge_mst_song_id=(
+            unlocked_stmt.order_by(func.random()).limit(1).scalar_subquery()
+        )),
+        execution_options=options
+    )
+    session.execute(
+        due_challenge_song_stmt
+        .where(func.abs(func.random()) % 2 == 0)
+        .where(unplayed_stmt.exists())
+        .values(daily_challenge_mst_song_id=(
+            unplayed_stmt.order_by(func.random()).limit(1).scalar_subquery()
+        )),
+        execution_options=options
+    )
+    server_now = now.astimezone(config.timezone)
+    # TODO: check idols' birthdays
+    if server_now.month == 2 and server_now.day == 27:
+        session.execute(
+            due_challenge_song_stmt
+            .where(unlocked_stmt.where(Song.mst_song_id == 1).exists())
+            .values(daily_challenge_mst_song_id=1),
+            execution_options=options
+        )
+    session.execute(
+        update(Mission)
+        .where(Mission.user_id.in_(due_stmt))
+        .where(Mission.mst_mission_id == 72)
+        .values(song_idol_type=(
+            select(MstSong.idol_type)
+            .join(ChallengeSong,
+                  ChallengeSong.daily_challenge_mst_song_id
+                  == MstSong.mst_song_id)
+            .where(ChallengeSong.user_id == Mission.user_id)
+            .scalar_subquery()
+        )),
+        execution_options=options
+    )
+
+    # Mark these users as reset for today. This must be the last
+    # statement because the previous statements use the update date to
+    # find the users to be reset.
+    session.execute(
+        due_challenge_song_stmt
+        .values(update_date=now),
+        execution_options=options
+    )
+
+    return reset_count
+
+
+def run_daily_reset():
+    """Perform the daily reset for all users.
+
+    Users are reset in a single transaction per shard (see
+    'mltd.models.shards').
+    """
+    now = datetime.now(timezone.utc)
+    reset_count = 0
+    for shard_engine in shard_router.user_engines():
+        with Session(shard_engine) as session:
+            reset_count += reset_users(session, now)
+            session.commit()
+    logger.info(f'Daily reset performed for {reset_count} users.')
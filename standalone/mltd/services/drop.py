@@ -0,0 +1,502 @@
+"""Drop engine for picking random drop rewards after playing a song.
+
+Master data needed for picking drops (N/R card IDs and ex costume IDs)
+is loaded once, and the weighted choices are precomputed as alias tables
+for each drop configuration (item day, song idol type and availability
+of auto live passes/costumes). Each drop is then picked in O(1) time, so
+picking k drops takes O(k) time regardless of the number of outcomes.
+
+All random numbers are drawn from an injectable RNG (the 'random' module
+by default), so a seeded random.Random instance makes the drops
+reproducible.
+
+Running this module as a script checks that the distribution of drops
+picked by the engine matches the reference implementation (the original
+random.choices based implementation in LiveService.FinishSong) using a
+chi-squared test, and benchmarks both implementations.
+    python -m mltd.services.drop [--samples N] [--seed SEED]
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from enum import Enum
+from math import sqrt
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from mltd.models.engine import engine
+from mltd.models.models import Costume, MstCard, MstCostume
+
+
+# The drop rates are an approximation based on the following 1309 items
+# dropped across 245 songs.
+# Stage dress           105 ( 73 on non-item days)
+# Mini crown            116 ( 84 on non-item days)
+# Lipstick              187 (107 on non-item days)
+# Perfume               229 (150 on non-item days)
+# Mirror                112 ( 64 on non-item days)
+# Gasha medal 10pt       66
+# Gasha medal 15pt       79
+# Gasha medal 20pt       66
+# Lesson ticket N        74
+# Lesson ticket R        65
+# Throat lozenges         4
+# Tapioca drink           9
+# High cocoa chocolate    9
+# Roll cake               6
+# Fan letter              9
+# Single flower          10
+# Hand cream             10
+# Bath additive           5
+# Auto live pass         10
+# N cards               113
+# R cards                17
+# Costumes                8
+class DropType(Enum):
+    AWAKENING_ITEM = 55.0
+    GASHA_MEDAL_PT = 15.5
+    LESSON_TICKET = 10.0
+    CARD = 9.5
+    AUTO_LIVE_PASS = 5.0
+    GIFT = 4.5
+    COSTUME = 0.5
+
+
+class AwakeningDropType(Enum):
+    STAGE_DRESS = (4, 100, 15.7)
+    MINI_CROWN = (4, 101, 17.7)
+    PRINCESS_LIPSTICK = (1, 110, 7.4)
+    PRINCESS_PERFUME = (1, 111, 10.4)
+    PRINCESS_MIRROR = (1, 112, 4.4)
+    FAIRY_LIPSTICK = (2, 120, 7.4)
+    FAIRY_PERFUME = (2, 121, 10.4)
+    FAIRY_MIRROR = (2, 122, 4.4)
+    ANGEL_LIPSTICK = (3, 130, 7.4)
+    ANGEL_PERFUME = (3, 131, 10.4)
+    ANGEL_MIRROR = (3, 132, 4.4)
+    def __init__(self, idol_type, mst_item_id, weight):
+        self.idol_type = idol_type
+        self.mst_item_id = mst_item_id
+        self.weight = weight
+
+
+# {mst_item_id: gasha medal pt}
+gasha_medal_pt = {502: 10, 503: 15, 504: 20}
+lesson_ticket_item_ids = [200, 201]
+# {mst_item_id: weight}
+gift_weights = {70: 1, 71: 2, 72: 2, 73: 1, 80: 2, 81: 2, 82: 2, 83: 1}
+# {card rarity: weight}
+card_rarity_weights = {1: 9, 2: 1}
+
+
+class AliasTable:
+    """Walker's alias table for sampling from a discrete distribution.
+
+    Building the table takes O(n) time for n outcomes, and each sample
+    takes O(1) time and a single random number.
+    """
+
+    def __init__(self, outcomes, weights):
+        """Build an alias table.
+
+        Args:
+            outcomes: A list of possible outcomes.
+            weights: A list of non-negative weights for each outcome.
+        """
+        n = len(outcomes)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights]
+        self.outcomes = list(outcomes)
+        self._prob = [1.0] * n
+        self._alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            self._prob[i] = scaled[i]
+            self._alias[i] = j
+            scaled[j] -= 1 - scaled[i]
+            if scaled[j] < 1:
+                small.append(j)
+            else:
+                large.append(j)
+        # Outcomes left in either list have a probability of 1 up to
+        # rounding errors, which is the default.
+
+    def sample(self, rng=random):
+        """Pick a random outcome.
+
+        Args:
+            rng: Random number generator providing random().
+        Returns:
+            One of the outcomes.
+        """
+        x = rng.random() * len(self.outcomes)
+        i = int(x)
+        if x - i < self._prob[i]:
+            return self.outcomes[i]
+        return self.outcomes[self._alias[i]]
+
+
+class DropEngine:
+    """Picks random drop rewards using precomputed alias tables."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(rarity, idol_type): [mst_card_id]}, idol_type=0 for all
+        self._card_ids = None
+        self._ex_costume_ids = None
+        # {(has_auto_live_pass, has_costume): AliasTable of DropType}
+        self._drop_type_tables = {}
+        for has_auto_live_pass in [False, True]:
+            for has_costume in [False, True]:
+                drop_types = [x for x in DropType
+                              if (x is not DropType.AUTO_LIVE_PASS
+                                  or has_auto_live_pass)
+                              and (x is not DropType.COSTUME or has_costume)]
+                self._drop_type_tables[(has_auto_live_pass, has_costume)] = (
+                    AliasTable(drop_types, [x.value for x in drop_types]))
+        # {item day idol type: AliasTable of reward}, 0 for non-item days
+        self._awakening_tables = {}
+        for item_day_idol_type in range(5):
+            awakening_drops = [x for x in AwakeningDropType
+                               if not item_day_idol_type
+                               or x.idol_type == item_day_idol_type]
+            self._awakening_tables[item_day_idol_type] = AliasTable(
+                [_item_reward(x.mst_item_id, 7) for x in awakening_drops],
+                [x.weight for x in awakening_drops])
+        self._gasha_medal_rewards = [_item_reward(x, 4)
+                                     for x in gasha_medal_pt]
+        self._lesson_ticket_rewards = [_item_reward(x, 8)
+                                       for x in lesson_ticket_item_ids]
+        self._gift_table = AliasTable(
+            [_item_reward(x, 25 if x < 80 else 26) for x in gift_weights],
+            list(gift_weights.values()))
+        self._auto_live_pass_reward = _item_reward(50, 23)
+        self._card_rarity_table = AliasTable(
+            list(card_rarity_weights), list(card_rarity_weights.values()))
+
+    def load(self, session: Session):
+        """Load master data required for picking drops.
+
+        Master data is only loaded on the first call.
+        Args:
+            session: Existing SQLAlchemy session.
+        """
+        if self._card_ids is not None:
+            return
+        with self._lock:
+            if self._card_ids is not None:
+                return
+            card_ids = {}
+            for mst_card_id, rarity, idol_type in session.execute(
+                select(MstCard.mst_card_id, MstCard.rarity, MstCard.idol_type)
+                .where(MstCard.rarity.in_(list(card_rarity_weights)))
+            ):
+                card_ids.setdefault((rarity, 0), []).append(mst_card_id)
+                card_ids.setdefault((rarity, idol_type), []).append(
+                    mst_card_id)
+            self._ex_costume_ids = session.scalars(
+                select(MstCostume.mst_costume_id)
+                .where(MstCostume.costume_name == 'ex')
+                .where(MstCostume.costume_number.in_([2, 3, 5, 6]))
+            ).all()
+            self._card_ids = card_ids
+
+    def locked_costume_ids(self, session: Session, user_id):
+        """Get the ex costumes that can be dropped for a user.
+
+        Args:
+            session: Existing SQLAlchemy session.
+            user_id: User ID in UUID format.
+        Returns:
+            A list of mst_costume_id of ex costumes the user does not
+            own yet.
+        """
+        self.load(session)
+        unlocked_costume_ids = set(session.scalars(
+            select(Costume.mst_costume_id)
+            .where(Costume.user_id == user_id)
+            .where(Costume.mst_costume_id.in_(self._ex_costume_ids))
+        ))
+        return [x for x in self._ex_costume_ids
+                if x not in unlocked_costume_ids]
+
+    @staticmethod
+    def drop_count(course_id, is_s_rank, rng=random):
+        """Pick the number of drops for a song.
+
+        Args:
+            course_id: An int (1 to 6) representing the course.
+            is_s_rank: Whether the user got an S score rank.
+            rng: Random number generator providing random().
+        Returns:
+            Number of drops.
+        """
+        if is_s_rank:
+            counts = [(2, 3), (2, 3), (4, 5), (3, 4), (4, 5),
+                      (5, 6)][course_id-1]
+        else:
+            counts = [(2,), (2,), (4,), (3,), (4,), (4, 5)][course_id-1]
+        return counts[int(rng.random() * len(counts))]
+
+    def pick_drops(self, k, song_idol_type, is_item_day,
+                   auto_live_pass_remaining, locked_costume_ids,
+                   rng=random):
+        """Pick random drop rewards.
+
+        Drops that are no longer available (auto live passes reaching
+        the max amount or all ex costumes being unlocked) are excluded
+        from subsequent picks, which has the same distribution as
+        re-picking among the remaining drop types.
+        Args:
+            k: Number of drops.
+            song_idol_type: Idol type of the song.
+            is_item_day: Whether the song's idol type is the daily idol
+                         type.
+            auto_live_pass_remaining: Number of auto live passes that
+                                      can be added before reaching the
+                                      max amount.
+            locked_costume_ids: A list of mst_costume_id of ex costumes
+                                that can be dropped. Picked costumes are
+                                removed from the list.
+            rng: Random number generator providing random().
+        Returns:
+            A list of k tuples (DropType, reward). Each reward is a dict
+            of keyword arguments for creating an MstRewardItem, which
+            must not be modified.
+        """
+        card_idol_type = (song_idol_type
+                          if is_item_day and song_idol_type != 4 else 0)
+        awakening_table = self._awakening_tables[
+            song_idol_type if is_item_day else 0]
+        auto_live_pass_remaining = auto_live_pass_remaining or 0
+        drops = []
+        for _ in range(k):
+            drop_type = self._drop_type_tables[(
+                auto_live_pass_remaining > 0,
+                len(locked_costume_ids) > 0
+            )].sample(rng)
+
+            if drop_type is DropType.AWAKENING_ITEM:
+                reward = awakening_table.sample(rng)
+            elif drop_type is DropType.GASHA_MEDAL_PT:
+                reward = _choice(self._gasha_medal_rewards, rng)
+            elif drop_type is DropType.LESSON_TICKET:
+                reward = _choice(self._lesson_ticket_rewards, rng)
+            elif drop_type is DropType.GIFT:
+                reward = self._gift_table.sample(rng)
+            elif drop_type is DropType.AUTO_LIVE_PASS:
+                auto_live_pass_remaining -= 1
+                reward = self._auto_live_pass_reward
+            elif drop_type is DropType.CARD:
+                rarity = self._card_rarity_table.sample(rng)
+                reward = {
+                    'reward_type': 6,
+                    'mst_card_id': _choice(
+                        self._card_ids[(rarity, card_idol_type)], rng),
+                    'amount': 1
+                }
+            elif drop_type is DropType.COSTUME:
+                reward = {
+                    'reward_type': 8,
+                    'mst_costume_id': locked_costume_ids.pop(
+                        int(rng.random() * len(locked_costume_ids))),
+                    'amount': 1
+                }
+
+            drops.append((drop_type, reward))
+        return drops
+
+
+def _item_reward(mst_item_id, item_type):
+    return {
+        'reward_type': 4,
+        'mst_item_id': mst_item_id,
+        'item_type': item_type,
+        'amount': 1
+    }
+
+
+def _choice(seq, rng):
+    return seq[int(rng.random() * len(seq))]
+
+
+drop_engine = DropEngine()
+
+
+def _reference_pick_drops(k, song_idol_type, is_item_day,
+                          auto_live_pass_remaining, locked_costume_ids,
+                          n_card_ids, r_card_ids, rng):
+    """Original implementation used for verifying the drop engine."""
+    allowed_drops = [
+        DropType.AWAKENING_ITEM,
+        DropType.GASHA_MEDAL_PT,
+        DropType.LESSON_TICKET,
+        DropType.CARD,
+        DropType.GIFT
+    ]
+    if auto_live_pass_remaining:
+        allowed_drops.append(DropType.AUTO_LIVE_PASS)
+    if locked_costume_ids:
+        allowed_drops.append(DropType.COSTUME)
+    drops = []
+    selected_drops = rng.choices(
+        allowed_drops, [x.value for x in allowed_drops], k=k)
+    for drop_type in selected_drops:
+        if (drop_type is DropType.AUTO_LIVE_PASS
+                and not auto_live_pass_remaining):
+            if DropType.AUTO_LIVE_PASS in allowed_drops:
+                allowed_drops.remove(DropType.AUTO_LIVE_PASS)
+            drop_type = rng.choices(
+                allowed_drops, [x.value for x in allowed_drops], k=1)[0]
+        if drop_type is DropType.COSTUME and not locked_costume_ids:
+            if DropType.COSTUME in allowed_drops:
+                allowed_drops.remove(DropType.COSTUME)
+            drop_type = rng.choices(
+                allowed_drops, [x.value for x in allowed_drops], k=1)[0]
+
+        if drop_type is DropType.AWAKENING_ITEM:
+            allowed_awakening_drops = list(AwakeningDropType)
+            if is_item_day:
+                allowed_awakening_drops = [
+                    x for x in allowed_awakening_drops
+                    if x.idol_type == song_idol_type]
+            drops.append(('item', rng.choices(
+                allowed_awakening_drops,
+                [x.weight for x in allowed_awakening_drops],
+                k=1)[0].mst_item_id))
+        elif drop_type is DropType.GASHA_MEDAL_PT:
+            drops.append(('item', rng.choice([502, 503, 504])))
+        elif drop_type is DropType.LESSON_TICKET:
+            drops.append(('item', rng.choice([200, 201])))
+        elif drop_type is DropType.GIFT:
+            drops.append(('item', rng.choices(
+                [70, 71, 72, 73, 80, 81, 82, 83],
+                [1, 2, 2, 1, 2, 2, 2, 1], k=1)[0]))
+        elif drop_type is DropType.AUTO_LIVE_PASS:
+            auto_live_pass_remaining -= 1
+            drops.append(('item', 50))
+        elif drop_type is DropType.CARD:
+            if rng.choices(['N', 'R'], [9, 1], k=1)[0] == 'N':
+                drops.append(('card', rng.choice(n_card_ids)))
+            else:
+                drops.append(('card', rng.choice(r_card_ids)))
+        elif drop_type is DropType.COSTUME:
+            selected_costume_id = rng.choice(locked_costume_ids)
+            locked_costume_ids.remove(selected_costume_id)
+            drops.append(('costume', selected_costume_id))
+    return drops
+
+
+def _outcome(drop_type, reward):
+    if 'mst_item_id' in reward:
+        return ('item', reward['mst_item_id'])
+    elif 'mst_card_id' in reward:
+        return ('card', reward['mst_card_id'])
+    return ('costume', reward['mst_costume_id'])
+
+
+def chi_squared_critical(df):
+    """Critical value of the chi-squared distribution at p=0.001.
+
+    Uses the Wilson-Hilferty approximation of the quantile.
+    Args:
+        df: Degrees of freedom, at least 1.
+    Returns:
+        A float.
+    """
+    z = 3.090
+    return df * (1 - 2/(9*df) + z*sqrt(2/(9*df))) ** 3
+
+
+def _chi_squared(counts1, counts2):
+    """Two-sample chi-squared test for equal sample sizes.
+
+    Returns:
+        A tuple (statistic, critical value at p=0.001).
+    """
+    categories = set(counts1) | set(counts2)
+    statistic = sum((counts1[c] - counts2[c]) ** 2 / (counts1[c] + counts2[c])
+                    for c in categories)
+    return statistic, chi_squared_critical(max(len(categories) - 1, 1))
+
+
+def verify(samples=100_000, seed=0):
+    """Compare the drop engine with the reference implementation.
+
+    Card drops are grouped by rarity to keep the number of categories
+    small enough for the chi-squared test.
+    Args:
+        samples: Number of songs to simulate for each configuration.
+        seed: Seed of the random number generators.
+    Returns:
+        True if the distributions match for all configurations.
+    """
+    with Session(engine) as session:
+        drop_engine.load(session)
+    card_rarities = {
+        card_id: rarity
+        for (rarity, idol_type), card_ids in drop_engine._card_ids.items()
+        for card_id in card_ids
+    }
+    costume_ids = drop_engine._ex_costume_ids[:2]
+    all_passed = True
+    # (song_idol_type, is_item_day, auto_live_pass_remaining, k)
+    for song_idol_type, is_item_day, auto_live_pass_remaining, k in [
+        (1, False, 10, 4),
+        (1, True, 10, 4),
+        (4, True, 1, 6),
+        (2, True, 0, 6),
+    ]:
+        card_idol_type = (song_idol_type
+                          if is_item_day and song_idol_type != 4 else 0)
+        n_card_ids = drop_engine._card_ids[(1, card_idol_type)]
+        r_card_ids = drop_engine._card_ids[(2, card_idol_type)]
+        engine_counts = Counter()
+        reference_counts = Counter()
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        for _ in range(samples):
+            for drop in drop_engine.pick_drops(
+                    k, song_idol_type, is_item_day, auto_live_pass_remaining,
+                    list(costume_ids), rng):
+                engine_counts[_outcome(*drop)] += 1
+        engine_seconds = time.perf_counter() - start
+        rng = random.Random(seed + 1)
+        start = time.perf_counter()
+        for _ in range(samples):
+            for drop in _reference_pick_drops(
+                    k, song_idol_type, is_item_day, auto_live_pass_remaining,
+                    list(costume_ids), n_card_ids, r_card_ids, rng):
+                reference_counts[drop] += 1
+        reference_seconds = time.perf_counter() - start
+        for counts in [engine_counts, reference_counts]:
+            for outcome in [x for x in counts if x[0] == 'card']:
+                counts[('rarity', card_rarities[outcome[1]])] += (
+                    counts.pop(outcome))
+        statistic, critical = _chi_squared(engine_counts, reference_counts)
+        passed = statistic <= critical
+        all_passed = all_passed and passed
+        print(f'idol_type={song_idol_type} item_day={is_item_day} '
+              f'auto_live_pass={auto_live_pass_remaining} k={k}: '
+              f'chi2={statistic:.1f} (critical {critical:.1f}) '
+              f'{"OK" if passed else "MISMATCH"}, '
+              f'engine {engine_seconds*1e6/samples:.1f} us/song, '
+              f'reference {reference_seconds*1e6/samples:.1f} us/song')
+    return all_passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Verify and benchmark the drop engine.')
+    parser.add_argument('--samples', type=int, default=100_000,
+                        help='number of songs to simulate per configuration')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random number generators')
+    args = parser.parse_args()
+    raise SystemExit(0 if verify(args.samples, args.seed) else 1)
@@ -2,15 +2,14 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import (EventMemory, EventStory, EventTalkStory,
                                 MstEventTalkCallText)
 from mltd.models.schemas import (EventMemorySchema, EventStorySchema,
                                  EventTalkStorySchema, MstEventSchema,
                                  MstEventTalkCallTextSchema,
                                  MstEventTalkControlSchema)
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='EventService.GetEventList')
@@ -123,7 +122,7 @@ def get_event_talk_archive_list(params, context):
                 appeal_type: 0.
                 is_board_open: false.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         mst_event_talk_call_texts = session.scalars(
             select(MstEventTalkCallText)
         ).all()
@@ -336,7 +335,7 @@ def get_event_story_list(params, context):
                 event_encounter_status_list: null.
                 past_mst_event_id: 0.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         event_stories = session.scalars(
             select(EventStory)
             .where(EventStory.user_id == UUID(context['user_id']))
@@ -0,0 +1,277 @@
+"""Per-user cache of serialized rows of heavy collections.
+
+CardService.GetCardList and SongService.GetSongList serialize every card
+or song of a user through nested schemas, although only a few rows
+change between calls. Instead, the serialized dict of each row (a
+fragment) is cached per user, keyed by the entity ID and the version of
+the row, and a list is assembled from the fragments.
+
+The version of a row is the tuple of its column values (together with
+those of its course rows for a song), which is read by a single
+column-only query without loading any relationship. Services that write
+to a row (e.g. LiveService.FinishSong or CardService.AwakenCard) change
+its version, so only the rows they touched are serialized again on the
+next call, and fragments of deleted rows are dropped. Since a fragment
+is only reused for identical column values, the cache needs no explicit
+invalidation and stays correct for writes made by other processes.
+
+Running this module as a script benchmarks a card list of the given
+size against serializing it from scratch.
+    python -m mltd.services.fragments [--user-id USER_ID] [--cards N]
+"""
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from mltd.models.engine import engine
+from mltd.models.fast_schemas import compile_schema
+from mltd.models.loaders import loader_profile
+from mltd.models.models import Card, Course, Song
+from mltd.models.schemas import CardSchema, SongSchema
+from mltd.servers.config import config
+
+
+class FragmentStore:
+    """Serialized rows of a per-user collection keyed by row version."""
+
+    def __init__(self, serialize, max_users=64):
+        """Create an empty store.
+
+        Args:
+            serialize: A function taking an SQLAlchemy session and a list
+                       of entity IDs, and returning a dict mapping each
+                       entity ID to a tuple (version, fragment).
+            max_users: Number of users whose fragments are kept.
+        """
+        self._serialize = serialize
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # {(user_id, language, timezone): {entity_id: (version, fragment)}}
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def assemble(self, session: Session, user_id, rows):
+        """Assemble a list of fragments.
+
+        Args:
+            session: Existing SQLAlchemy session.
+            user_id: User ID in UUID format.
+            rows: A list of tuples (entity_id, version) in list order.
+        Returns:
+            A list of serialized dicts in the same order as rows.
+        """
+        key = (user_id, config.language, config.timezone)
+        with self._lock:
+            cached = self._users.get(key, {})
+        stale_ids = [entity_id for entity_id, version in rows
+                     if cached.get(entity_id, (None,))[0] != version]
+
+        if stale_ids:
+            fragments = {entity_id: cached[entity_id]
+                         for entity_id, _ in rows if entity_id in cached}
+            fragments.update(self._serialize(session, stale_ids))
+        else:
+            fragments = cached
+
+        with self._lock:
+            self.hits += len(rows) - len(stale_ids)
+            self.misses += len(stale_ids)
+            self._users[key] = fragments
+            self._users.move_to_end(key)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        # Rows deleted after the versions were read have no fragment.
+        return [fragments[entity_id][1] for entity_id, _ in rows
+                if entity_id in fragments]
+
+    def clear(self):
+        """Discard all fragments and statistics."""
+        with self._lock:
+            self._users.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def _card_version(card):
+    return tuple(getattr(card, column.key)
+                 for column in Card.__table__.columns)
+
+
+def _serialize_cards(session: Session, card_ids):
+    cards = session.scalars(
+        select(Card)
+        .where(Card.card_id.in_(card_ids))
+        .options(*loader_profile('card-list'))
+    ).all()
+    card_schema = compile_schema(CardSchema)
+    return {card.card_id: (_card_version(card), card_schema.dump(card))
+            for card in cards}
+
+
+def _song_version(song):
+    return (
+        tuple(getattr(song, column.key) for column in Song.__table__.columns),
+        tuple(tuple(getattr(course, column.key)
+                    for column in Course.__table__.columns)
+              for course in song.courses)
+    )
+
+
+def _serialize_songs(session: Session, song_ids):
+    songs = session.scalars(
+        select(Song)
+        .where(Song.song_id.in_(song_ids))
+    ).all()
+    song_schema = compile_schema(SongSchema)
+    return {song.song_id: (_song_version(song), song_schema.dump(song))
+            for song in songs}
+
+
+card_fragments = FragmentStore(_serialize_cards)
+song_fragments = FragmentStore(_serialize_songs)
+
+
+def get_card_list(session: Session, user_id):
+    """Get the serialized cards of a user.
+
+    Args:
+        session: Existing SQLAlchemy session.
+        user_id: User ID in UUID format.
+    Returns:
+        A list of dicts. See the return value 'card_list' of the method
+        'CardService.GetCardList' for the dict definition.
+    """
+    rows = session.execute(
+        select(*Card.__table__.columns)
+        .where(Card.user_id == user_id)
+    )
+    return card_fragments.assemble(
+        session, user_id, [(row.card_id, tuple(row)) for row in rows])
+
+
+def get_song_list(session: Session, user_id):
+    """Get the serialized songs of a user.
+
+    Args:
+        session: Existing SQLAlchemy session.
+        user_id: User ID in UUID format.
+    Returns:
+        A list of dicts. See the return value 'song_list' of the method
+        'SongService.GetSongList' for the dict definition.
+    """
+    courses = {}
+    for row in session.execute(
+        select(*Course.__table__.columns)
+        .where(Course.user_id == user_id)
+        .order_by(Course.course_id)
+    ):
+        courses.setdefault(row.mst_song_id, []).append(tuple(row))
+
+    rows = session.execute(
+        select(*Song.__table__.columns)
+        .where(Song.user_id == user_id)
+    )
+    return song_fragments.assemble(session, user_id, [
+        (row.song_id,
+         (tuple(row), tuple(courses.get(row.mst_song_id, []))))
+        for row in rows
+    ])
+
+
+def benchmark(user_id, n_cards=1500, repeat=5):
+    """Benchmark assembling a card list from fragments.
+
+    The card catalog is smaller than n_cards and each user owns a card
+    at most once, so the cards of the user are padded with transient
+    copies (never added to a session) up to n_cards.
+    Args:
+        user_id: User ID in UUID format.
+        n_cards: Number of cards in the list.
+        repeat: Number of lists to build with each method.
+    Returns:
+        True if the assembled lists match the serialized ones.
+    """
+    with Session(engine) as session:
+        owned = session.scalars(
+            select(Card)
+            .where(Card.user_id == user_id)
+        ).all()
+        if not owned:
+            print('The user owns no card.')
+            return False
+        cards = []
+        for i in range(n_cards):
+            source = owned[i % len(owned)]
+            card = Card(**{column.key: getattr(source, column.key)
+                           for column in Card.__table__.columns})
+            if i >= len(owned):
+                card.card_id = f'{source.card_id}-{i}'
+            set_committed_value(card, 'mst_card', source.mst_card)
+            cards.append(card)
+        cards_by_id = {card.card_id: card for card in cards}
+
+        card_schema = CardSchema()
+
+        def serialize(session, card_ids):
+            return {card_id: (_card_version(cards_by_id[card_id]),
+                              card_schema.dump(cards_by_id[card_id]))
+                    for card_id in card_ids}
+
+        def rows():
+            return [(card.card_id, _card_version(card)) for card in cards]
+
+        store = FragmentStore(serialize)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            expected = card_schema.dump(cards, many=True)
+        serialize_ms = (time.perf_counter() - start) / repeat * 1000
+
+        start = time.perf_counter()
+        store.assemble(None, user_id, rows())
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            actual = store.assemble(None, user_id, rows())
+        warm_ms = (time.perf_counter() - start) / repeat * 1000
+        passed = actual == expected
+
+        # Touch 10 cards as a live performance with a full unit would.
+        for card in cards[:10]:
+            card.exp += 1
+        expected = card_schema.dump(cards, many=True)
+        start = time.perf_counter()
+        actual = store.assemble(None, user_id, rows())
+        touched_ms = (time.perf_counter() - start) * 1000
+        passed = passed and actual == expected
+
+    print(f'{n_cards} cards ({len(owned)} owned, rest padded)')
+    print(f'Serialize from scratch: {serialize_ms:.1f} ms/list')
+    print(f'Fragments, cold: {cold_ms:.1f} ms')
+    print(f'Fragments, warm: {warm_ms:.1f} ms/list')
+    print(f'Fragments, 10 cards touched: {touched_ms:.1f} ms')
+    print('Lists are identical' if passed else 'Lists differ')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the card list assembled from fragments.')
+    parser.add_argument('--user-id',
+                        default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                        help='user ID in UUID format')
+    parser.add_argument('--cards', type=int, default=1500,
+                        help='number of cards in the list')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of lists to build with each method')
+    args = parser.parse_args()
+    raise SystemExit(0 if benchmark(UUID(args.user_id), args.cards,
+                                    args.repeat) else 1)
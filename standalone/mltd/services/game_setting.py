@@ -2,9 +2,7 @@ from datetime import datetime, timedelta, timezone
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import (MstAwakeningConfig, MstComicMenu,
                                 MstExMasterLessonConfig, MstGameSetting,
                                 MstLessonMoneyConfig,
@@ -23,6 +21,7 @@ from mltd.models.schemas import (MstAwakeningConfigSchema, MstComicMenuSchema,
                                  MstMasterLesson2ConfigSchema,
                                  MstMasterLessonFiveConfigSchema,
                                  MstTitleImageSchema, MstTrainingUnitSchema)
+from mltd.models.session_scope import request_session
 from mltd.servers.config import config
 from mltd.servers.utilities import format_datetime
 
@@ -261,7 +260,7 @@ def get_setting(params):
             end_date: Date when this loading screen character becomes
                       unavailable.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         mst_game_setting = session.scalar(
             select(MstGameSetting)
         )
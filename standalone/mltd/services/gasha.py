@@ -2,11 +2,10 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Gasha
 from mltd.models.schemas import GashaSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='GashaService.GetGashaList', context_arg='context')
@@ -85,7 +84,7 @@ def get_gasha_list(params, context):
                      0.
         has_need_refresh_gasha_draw_point: false.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         gashas = session.scalars(
             select(Gasha)
             .where(Gasha.user_id == UUID(context['user_id']))
@@ -0,0 +1,272 @@
+"""Gacha draw engine.
+
+Cards are drawn from MstCard rarity pools with configured rates. Each
+rarity's rate is shared evenly among the cards of that rarity, and a
+cumulative weight table over all cards in the pool is precomputed once.
+A batch of draws is then done by random.choices() with the precomputed
+'cum_weights', which only takes a random number and a binary search per
+card, so a million simulated draws take a fraction of a second.
+
+Three kinds of draws are supported.
+1. Single draws from the normal table.
+2. 10 draws, all from the normal table.
+3. 10 draws with a guaranteed SR, where the last card is drawn from a
+   table that only contains SR and SSR cards. This applies to gachas
+   whose 'sr_passport' is 1.
+
+All random numbers are drawn from an injectable RNG (the 'random' module
+by default), so a seeded random.Random instance makes the draws
+reproducible.
+
+Running this module as a script simulates draws for each kind of draw,
+checks that the observed rates of each rarity are within 4 standard
+deviations of the configured rates and that cards of the same rarity
+are drawn uniformly (chi-squared test), and reports the draw speed.
+    python -m mltd.services.gasha_draw [--draws N] [--seed SEED]
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from math import sqrt
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from mltd.models.engine import engine
+from mltd.models.models import MstCard
+from mltd.services.drop import chi_squared_critical
+
+# {card rarity: rate in percent}
+default_rates = {4: 3, 3: 12, 2: 85}
+# Rates for the last card of 10 draws with a guaranteed SR.
+sr_guaranteed_rates = {4: 3, 3: 97}
+
+
+class CumulativeTable:
+    """Cumulative weight table over the cards of a pool."""
+
+    def __init__(self, card_ids_by_rarity, rates):
+        """Build a cumulative table.
+
+        Args:
+            card_ids_by_rarity: A dict mapping each card rarity to a
+                                list of mst_card_id.
+            rates: A dict mapping each card rarity to its rate. Rates
+                   do not need to add up to 100.
+        """
+        self.rates = dict(rates)
+        self.card_ids = []
+        self.cum_weights = []
+        total = 0
+        for rarity, rate in rates.items():
+            card_ids = card_ids_by_rarity.get(rarity)
+            if not card_ids:
+                raise ValueError(f'no cards of rarity {rarity} in pool')
+            weight = rate / len(card_ids)
+            for card_id in card_ids:
+                total += weight
+                self.card_ids.append(card_id)
+                self.cum_weights.append(total)
+
+    def sample(self, n, rng=random):
+        """Draw cards from the table.
+
+        Args:
+            n: Number of cards to draw.
+            rng: Random number generator providing choices().
+        Returns:
+            A list of n mst_card_id.
+        """
+        return rng.choices(self.card_ids, cum_weights=self.cum_weights, k=n)
+
+
+class GashaPool:
+    """A pool of cards that can be drawn from a gacha."""
+
+    def __init__(self, card_ids_by_rarity, rates=default_rates,
+                 guaranteed_rates=sr_guaranteed_rates):
+        """Build the tables for a pool.
+
+        Args:
+            card_ids_by_rarity: A dict mapping each card rarity to a
+                                list of mst_card_id.
+            rates: A dict mapping each card rarity to its rate for
+                   normal draws.
+            guaranteed_rates: A dict mapping each card rarity to its
+                              rate for the guaranteed card of 10 draws.
+        """
+        self.card_rarities = {
+            card_id: rarity
+            for rarity, card_ids in card_ids_by_rarity.items()
+            for card_id in card_ids
+        }
+        self.table = CumulativeTable(card_ids_by_rarity, rates)
+        self.guaranteed_table = CumulativeTable(card_ids_by_rarity,
+                                                guaranteed_rates)
+
+    def draw1(self, rng=random):
+        """Cast a single draw.
+
+        Args:
+            rng: Random number generator providing choices().
+        Returns:
+            A list of 1 mst_card_id.
+        """
+        return self.table.sample(1, rng)
+
+    def draw10(self, sr_passport=False, rng=random):
+        """Cast 10 draws.
+
+        Args:
+            sr_passport: Whether an SR card is guaranteed.
+            rng: Random number generator providing choices().
+        Returns:
+            A list of 10 mst_card_id.
+        """
+        if not sr_passport:
+            return self.table.sample(10, rng)
+        return self.table.sample(9, rng) + self.guaranteed_table.sample(1, rng)
+
+    def simulate(self, n, sr_passport=False, rng=random):
+        """Simulate a large number of draws in batches.
+
+        Args:
+            n: Number of cards to draw. For 10 draws (sr_passport=True),
+               this is rounded down to a multiple of 10.
+            sr_passport: Whether every 10th card is a guaranteed SR.
+            rng: Random number generator providing choices().
+        Returns:
+            A list of mst_card_id.
+        """
+        if not sr_passport:
+            return self.table.sample(n, rng)
+        rounds = n // 10
+        normal = self.table.sample(rounds * 9, rng)
+        guaranteed = self.guaranteed_table.sample(rounds, rng)
+        card_ids = []
+        for i in range(rounds):
+            card_ids += normal[i*9:i*9+9]
+            card_ids.append(guaranteed[i])
+        return card_ids
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(session: Session):
+    """Get the pool of normal R/SR/SSR cards.
+
+    The pool is built from master data on the first call.
+    Args:
+        session: Existing SQLAlchemy session.
+    Returns:
+        A GashaPool object.
+    """
+    global _pool
+    if _pool:
+        return _pool
+    with _pool_lock:
+        if not _pool:
+            card_ids_by_rarity = {}
+            for mst_card_id, rarity in session.execute(
+                select(MstCard.mst_card_id, MstCard.rarity)
+                .where(MstCard.ex_type == 0)
+                .where(MstCard.rarity.in_(list(default_rates)))
+                .order_by(MstCard.mst_card_id)
+            ):
+                card_ids_by_rarity.setdefault(rarity, []).append(mst_card_id)
+            _pool = GashaPool(card_ids_by_rarity)
+    return _pool
+
+
+def _verify_rates(pool, card_ids, table):
+    """Check observed rates of drawn cards against a table.
+
+    Returns:
+        True if all rarity rates are within 4 standard deviations and
+        cards of each rarity are drawn uniformly.
+    """
+    n = len(card_ids)
+    total_rate = sum(table.rates.values())
+    card_counts = Counter(card_ids)
+    rarity_counts = Counter()
+    for card_id, count in card_counts.items():
+        rarity_counts[pool.card_rarities[card_id]] += count
+    passed = True
+    for rarity, rate in table.rates.items():
+        p = rate / total_rate
+        observed = rarity_counts[rarity] / n
+        sigma = sqrt(p * (1-p) / n)
+        ok = abs(observed - p) <= 4 * sigma
+        passed = passed and ok
+        print(f'  rarity {rarity}: expected {p:.4%}, observed {observed:.4%} '
+              f'{"OK" if ok else "MISMATCH"}')
+        # Chi-squared test for uniformity within this rarity.
+        rarity_card_ids = [x for x in table.card_ids
+                           if pool.card_rarities[x] == rarity]
+        expected = rarity_counts[rarity] / len(rarity_card_ids)
+        if expected < 5:
+            continue
+        statistic = sum((card_counts[x] - expected) ** 2 / expected
+                        for x in rarity_card_ids)
+        critical = chi_squared_critical(max(len(rarity_card_ids) - 1, 1))
+        ok = statistic <= critical
+        passed = passed and ok
+        print(f'    uniformity: chi2={statistic:.1f} '
+              f'(critical {critical:.1f}) {"OK" if ok else "MISMATCH"}')
+    return passed
+
+
+def verify(draws=1_000_000, seed=0):
+    """Verify observed rates of simulated draws against configured ones.
+
+    Args:
+        draws: Number of cards to draw for each kind of draw.
+        seed: Seed of the random number generator.
+    Returns:
+        True if the observed rates match for all kinds of draws.
+    """
+    with Session(engine) as session:
+        pool = get_pool(session)
+    rng = random.Random(seed)
+    all_passed = True
+
+    start = time.perf_counter()
+    card_ids = pool.simulate(draws, rng=rng)
+    seconds = time.perf_counter() - start
+    print(f'Normal draws: {draws} cards in {seconds:.3f} s')
+    all_passed = _verify_rates(pool, card_ids, pool.table) and all_passed
+
+    start = time.perf_counter()
+    card_ids = pool.simulate(draws, sr_passport=True, rng=rng)
+    seconds = time.perf_counter() - start
+    print(f'10 draws with guaranteed SR: {len(card_ids)} cards in '
+          f'{seconds:.3f} s')
+    print(' First 9 cards:')
+    normal = [x for i, x in enumerate(card_ids) if i % 10 != 9]
+    all_passed = _verify_rates(pool, normal, pool.table) and all_passed
+    print(' Last card:')
+    guaranteed = card_ids[9::10]
+    all_passed = (_verify_rates(pool, guaranteed, pool.guaranteed_table)
+                  and all_passed)
+
+    start = time.perf_counter()
+    for _ in range(draws // 10):
+        pool.draw10(sr_passport=True, rng=rng)
+    seconds = time.perf_counter() - start
+    print(f'{draws // 10} individual 10 draws in {seconds:.3f} s')
+    return all_passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Verify gacha rates and benchmark the draw engine.')
+    parser.add_argument('--draws', type=int, default=1_000_000,
+                        help='number of cards to draw per kind of draw')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random number generator')
+    args = parser.parse_args()
+    raise SystemExit(0 if verify(args.draws, args.seed) else 1)
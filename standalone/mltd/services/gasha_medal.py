@@ -2,11 +2,10 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import GashaMedal
 from mltd.models.schemas import GashaMedalSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='GashaMedalService.GetGashaMedal',
@@ -29,7 +28,7 @@ def get_gasha_medal(params, context):
         gasha_medal_max: Maximum possible number of gacha medals a user
                          can own (10).
     """
-    with Session(engine) as session:
+    with request_session() as session:
         gasha_medal = session.scalars(
             select(GashaMedal)
             .where(GashaMedal.user_id == UUID(context['user_id']))
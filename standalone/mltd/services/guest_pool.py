@@ -0,0 +1,193 @@
+"""Pool of profiles that guests are sampled from.
+
+LiveService.GetRandomGuestList used to pick guests with ORDER BY random()
+LIMIT 20 over every profile, which scans and sorts the whole profile
+table on every song selection. Instead, the IDs of all profiles are kept
+in a dense list that is refreshed periodically, guests are sampled from
+it by random indices in O(k), and only the chosen Profile rows are
+fetched.
+
+Profiles created after the last refresh are not sampled until the next
+refresh, and profiles deleted since then are skipped when the chosen
+rows are fetched. Only one request refreshes the pool, while the others
+keep sampling from the previous IDs. With user shards, the IDs are
+loaded from every shard.
+
+Running this module as a script benchmarks the pool against ORDER BY
+random() on an in-memory database with the given number of profiles.
+    python -m mltd.services.guest_pool [--profiles N] [--repeat N]
+"""
+import argparse
+import random
+import threading
+import time
+from uuid import uuid4
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import Session
+
+from mltd.models.models import Profile
+from mltd.models.shards import shard_router
+
+
+class GuestPool:
+    """Dense array of profile IDs that guests are sampled from."""
+
+    def __init__(self, refresh_interval=600):
+        """Create an empty pool.
+
+        Args:
+            refresh_interval: Number of seconds after which the profile
+                              IDs are loaded again.
+        """
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._profile_ids = []
+        self._refresh_time = None
+
+    def refresh(self, session: Session):
+        """Load the IDs of all profiles.
+
+        Args:
+            session: Existing SQLAlchemy session.
+        """
+        profile_ids = shard_router.scatter(
+            session,
+            lambda shard_session: shard_session.scalars(
+                select(Profile.id_)
+            ).all()
+        )
+        with self._lock:
+            self._profile_ids = profile_ids
+            self._refresh_time = time.monotonic()
+
+    def _get_profile_ids(self, session: Session):
+        now = time.monotonic()
+        with self._lock:
+            last_refresh_time = self._refresh_time
+            stale = (last_refresh_time is None
+                     or now - last_refresh_time > self.refresh_interval)
+            # Only one caller refreshes the pool. The others keep
+            # sampling from the current IDs in the meantime.
+            if stale:
+                self._refresh_time = now
+            profile_ids = self._profile_ids
+        if not stale:
+            return profile_ids
+        try:
+            self.refresh(session)
+        except BaseException:
+            with self._lock:
+                if self._refresh_time == now:
+                    self._refresh_time = last_refresh_time
+            raise
+        return self._profile_ids
+
+    def sample(self, session: Session, k, excluded_ids=(), rng=random):
+        """Sample distinct profile IDs.
+
+        Args:
+            session: Existing SQLAlchemy session, used when the pool needs
+                     to be refreshed.
+            k: Number of profile IDs to sample.
+            excluded_ids: Profile IDs that must not be sampled (e.g. the
+                          user and their friends).
+            rng: Random number generator providing random() and sample().
+        Returns:
+            A list of at most k profile IDs in random order.
+        """
+        profile_ids = self._get_profile_ids(session)
+        excluded_ids = set(excluded_ids)
+        n = len(profile_ids)
+        # With at least half of the pool eligible, each random index is
+        # accepted with a probability of at least 1/2.
+        if n < 2 * (k + len(excluded_ids)):
+            eligible_ids = [x for x in profile_ids if x not in excluded_ids]
+            return rng.sample(eligible_ids, min(k, len(eligible_ids)))
+        sampled_ids = []
+        while len(sampled_ids) < k:
+            profile_id = profile_ids[int(rng.random() * n)]
+            if profile_id not in excluded_ids:
+                excluded_ids.add(profile_id)
+                sampled_ids.append(profile_id)
+        return sampled_ids
+
+
+guest_pool = GuestPool()
+
+
+def benchmark(n_profiles=100_000, repeat=100):
+    """Benchmark the pool against ORDER BY random().
+
+    Args:
+        n_profiles: Number of profiles in the in-memory database.
+        repeat: Number of guest lists to sample with each method.
+    """
+    bench_engine = create_engine('sqlite+pysqlite://')
+    with bench_engine.begin() as connection:
+        # Only the profile table exists in this database.
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        Profile.__table__.create(connection)
+        connection.execute(insert(Profile.__table__), [
+            {'id_': uuid4(), 'name': f'P{i}', 'birthday': '',
+             'is_birthday_public': False, 'comment': '',
+             'favorite_card_id': None, 'favorite_card_before_awake': False,
+             'mst_achievement_id': 1, 'lp': 0, 'album_count': 55,
+             'story_count': 0}
+            for i in range(n_profiles)
+        ])
+
+    pool = GuestPool()
+    with Session(bench_engine) as session:
+        user_id, *friend_ids = session.scalars(
+            select(Profile.id_)
+            .limit(6)
+        ).all()
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            session.execute(
+                select(Profile.__table__)
+                .where(Profile.id_ != user_id)
+                .where(~Profile.id_.in_(friend_ids))
+                .order_by(func.random())
+                .limit(20 - len(friend_ids))
+            ).all()
+        order_by_ms = (time.perf_counter() - start) / repeat * 1000
+
+        start = time.perf_counter()
+        pool.refresh(session)
+        refresh_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            guest_ids = pool.sample(session, 20 - len(friend_ids),
+                                    [user_id, *friend_ids])
+        sample_ms = (time.perf_counter() - start) / repeat * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            guest_ids = pool.sample(session, 20 - len(friend_ids),
+                                    [user_id, *friend_ids])
+            session.execute(
+                select(Profile.__table__)
+                .where(Profile.id_.in_(guest_ids))
+            ).all()
+        pool_ms = (time.perf_counter() - start) / repeat * 1000
+
+    print(f'{n_profiles} profiles, {20 - len(friend_ids)} guests per list')
+    print(f'ORDER BY random(): {order_by_ms:.2f} ms/list')
+    print(f'Pool refresh: {refresh_ms:.1f} ms')
+    print(f'Pool sample: {sample_ms*1000:.1f} us/list')
+    print(f'Pool sample and fetch: {pool_ms:.2f} ms/list')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the guest pool.')
+    parser.add_argument('--profiles', type=int, default=100_000,
+                        help='number of profiles')
+    parser.add_argument('--repeat', type=int, default=100,
+                        help='number of guest lists to sample')
+    args = parser.parse_args()
+    benchmark(args.profiles, args.repeat)
@@ -2,15 +2,16 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
+from mltd.models.fast_schemas import compile_schema
 from mltd.models.models import (CostumeAdv, Episode, Idol, Memorial,
                                 MstCostumeBulkChangeGroup)
 from mltd.models.schemas import (CostumeAdvSchema, EpisodeSchema, IdolSchema,
                                  MemorialSchema,
                                  MstCostumeBulkChangeGroupSchema)
+from mltd.models.session_scope import request_session
 from mltd.servers.i18n import translation
+from mltd.services.list_cache import list_cache
 
 _ = translation.gettext
 
@@ -84,6 +85,8 @@ def localize_character_name(mst_character_id):
 
 
 @dispatcher.add_method(name='IdolService.GetIdolList', context_arg='context')
+@list_cache.cached('idol', 'costume', 'lesson_wear_config',
+                    'memorial', 'episode', 'costume_adv')
 def get_idol_list(params, context):
     """Get a list of idol info for the user.
 
@@ -241,13 +244,13 @@ def get_idol_list(params, context):
                               costume episode. See 'reward_item_list'
                               for 'memorial_list' above.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         idols = session.scalars(
             select(Idol)
             .where(Idol.user_id == UUID(context['user_id']))
         ).all()
 
-        idol_schema = IdolSchema()
+        idol_schema = compile_schema(IdolSchema)
         idol_list = idol_schema.dump(idols, many=True)
 
         memorials = session.scalars(
@@ -255,7 +258,7 @@ def get_idol_list(params, context):
             .where(Memorial.user_id == UUID(context['user_id']))
         ).all()
 
-        memorial_schema = MemorialSchema()
+        memorial_schema = compile_schema(MemorialSchema)
         memorial_list = memorial_schema.dump(memorials, many=True)
 
         episodes = session.scalars(
@@ -263,7 +266,7 @@ def get_idol_list(params, context):
             .where(Episode.user_id == UUID(context['user_id']))
         ).all()
 
-        episode_schema = EpisodeSchema()
+        episode_schema = compile_schema(EpisodeSchema)
         episode_list = episode_schema.dump(episodes, many=True)
 
         costume_advs = session.scalars(
@@ -271,7 +274,7 @@ def get_idol_list(params, context):
             .where(CostumeAdv.user_id == UUID(context['user_id']))
         ).all()
 
-        costume_adv_schema = CostumeAdvSchema()
+        costume_adv_schema = compile_schema(CostumeAdvSchema)
         costume_adv_list = costume_adv_schema.dump(costume_advs, many=True)
 
     return {
@@ -321,7 +324,7 @@ def get_bulk_change_costume_group_list(params):
             begin_date: '2018-01-01T00:00:00+0800'.
             end_date: '2099-12-31T23:59:59+0800'.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         mst_costume_bulk_change_groups = session.scalars(
             select(MstCostumeBulkChangeGroup)
         ).all()
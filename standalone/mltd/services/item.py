@@ -5,10 +5,12 @@ from jsonrpc import dispatcher
 from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
+from mltd.models.fast_schemas import compile_schema
 from mltd.models.models import GashaMedalExpireDate, Item, Jewel, MstItem, User
 from mltd.models.schemas import ItemSchema
+from mltd.models.session_scope import request_session
 from mltd.servers.config import config
+from mltd.services.list_cache import list_cache
 
 
 def add_item(
@@ -78,6 +80,7 @@ def add_item(
 
 
 @dispatcher.add_method(name='ItemService.GetItemList', context_arg='context')
+@list_cache.cached('item')
 def get_item_list(params, context):
     """Get items owned by a user.
 
@@ -181,13 +184,13 @@ def get_item_list(params, context):
             is_extend: true for some Platinum/Selection/SSR tickets,
                        false for everything else.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         items = session.scalars(
             select(Item)
             .where(Item.user_id == UUID(context['user_id']))
         ).all()
 
-        item_schema = ItemSchema()
+        item_schema = compile_schema(ItemSchema)
         item_list = item_schema.dump(items, many=True)
 
     return {'item_list': item_list}
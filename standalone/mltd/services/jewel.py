@@ -2,11 +2,10 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Jewel
 from mltd.models.schemas import JewelSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='JewelService.GetJewel', context_arg='context')
@@ -26,7 +25,7 @@ def get_jewel(params, context):
             paid_jewel_amount: 0 (All purchased jewels are counted as
                                free jewels on overseas servers).
     """
-    with Session(engine) as session:
+    with request_session() as session:
         jewel = session.scalars(
             select(Jewel)
             .where(Jewel.user_id == UUID(context['user_id']))
@@ -1,10 +1,9 @@
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import MstJob
 from mltd.models.schemas import MstJobSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='JobService.GetJobList')
@@ -33,7 +32,7 @@ def get_job_list(params):
             end_date: Date when this job becomes unavailable.
         job_special_list: null.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         mst_jobs = session.scalars(
             select(MstJob)
         ).all()
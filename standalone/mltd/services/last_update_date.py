@@ -2,11 +2,10 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import LastUpdateDate
 from mltd.models.schemas import LastUpdateDateSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='LastUpdateDateService.GetLastUpdateDateList',
@@ -49,7 +48,7 @@ def get_last_update_date_list(params, context):
             is_new_mail: Whether there is any new mail.
             is_new_blog: Whether there is any new blog.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         last_update_dates = session.scalars(
             select(LastUpdateDate)
             .where(LastUpdateDate.user_id == UUID(context['user_id']))
@@ -0,0 +1,213 @@
+"""Cached responses of list services.
+
+List services (e.g. CardService.GetCardList) return every row of a
+per-user collection, although most of the time nothing has changed since
+the last call. The game client always expects the full list, so instead
+of returning an empty payload, the response is cached per user together
+with the versions of the collections it is built from (see
+'mltd.models.versions'). As long as none of those collections has
+changed, the cached response is returned without querying or
+serializing the collection again.
+
+The versions are read before the service runs, so a response can only
+be cached under versions older than the data it contains, which causes
+an extra rebuild at worst and never a stale response. If a request is
+rolled back, all cached responses are discarded.
+
+Running this module as a script replays the list services for a user
+and reports the CPU time and response bytes saved by the cache.
+    python -m mltd.services.list_cache [--user-id USER_ID] [--rounds N]
+"""
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from mltd.models.engine import engine
+from mltd.models.session_scope import request_session, session_scope
+from mltd.models.versions import get_versions
+from mltd.servers.config import config
+from mltd.servers.logging import logger
+
+
+class _Entry:
+
+    def __init__(self, key, payload, build_ns):
+        self.key = key
+        self.payload = payload
+        self.build_ns = build_ns
+        self._size = None
+
+    @property
+    def size(self):
+        """Size of the serialized payload in bytes (computed once)."""
+        if self._size is None:
+            self._size = len(json.dumps(self.payload, default=str,
+                                        separators=(',', ':')))
+        return self._size
+
+
+class ListCache:
+    """LRU cache of list service responses keyed by collection versions."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # {(user_id, method): _Entry}
+        self._entries = OrderedDict()
+        # {method: [hits, misses, saved_ns, saved_bytes]}
+        self._stats = {}
+
+    def cached(self, *collections):
+        """Decorator for caching the response of a list service.
+
+        The decorated service must take 'context' containing the user ID
+        and must not modify the database.
+        Args:
+            collections: Names of the collections (tables) the response
+                         is built from.
+        """
+        def decorator(f):
+            method = f'{f.__module__.rsplit(".", 1)[-1]}.{f.__name__}'
+
+            @wraps(f)
+            def wrapper(params, context):
+                user_id = UUID(context['user_id'])
+                with request_session() as session:
+                    key = (config.language, config.timezone,
+                           get_versions(session, user_id, collections))
+                entry = self._get(user_id, method, key)
+                if entry:
+                    return entry.payload
+                start = time.perf_counter_ns()
+                payload = f(params, context)
+                build_ns = time.perf_counter_ns() - start
+                self._put(user_id, method, _Entry(key, payload, build_ns))
+                return payload
+
+            return wrapper
+
+        return decorator
+
+    def _get(self, user_id, method, key):
+        with self._lock:
+            stats = self._stats.setdefault(method, [0, 0, 0, 0])
+            entry = self._entries.get((user_id, method))
+            if not entry or entry.key != key:
+                stats[1] += 1
+                return None
+            self._entries.move_to_end((user_id, method))
+            stats[0] += 1
+            stats[2] += entry.build_ns
+        size = entry.size
+        with self._lock:
+            stats[3] += size
+        logger.debug(f'{method} served from cache for user {user_id}.')
+        return entry
+
+    def _put(self, user_id, method, entry):
+        with self._lock:
+            self._entries[(user_id, method)] = entry
+            self._entries.move_to_end((user_id, method))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def summary(self):
+        """Return cache statistics of each list service.
+
+        Returns:
+            A list of dicts sorted by method name. Each dict contains the
+            following keys: method, hits, misses, saved_ms and
+            saved_bytes (serialized response bytes not rebuilt).
+        """
+        with self._lock:
+            items = [(method, list(stats))
+                     for method, stats in self._stats.items()]
+        return [{
+            'method': method,
+            'hits': hits,
+            'misses': misses,
+            'saved_ms': saved_ns / 1_000_000,
+            'saved_bytes': saved_bytes
+        } for method, (hits, misses, saved_ns, saved_bytes) in sorted(items)]
+
+    def clear(self):
+        """Discard all cached responses and statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+    def invalidate(self):
+        """Discard all cached responses but keep statistics."""
+        with self._lock:
+            self._entries.clear()
+
+
+list_cache = ListCache()
+# Responses cached during a request that is rolled back may have been
+# built from uncommitted data under versions that will be reused.
+session_scope.on_rollback(list_cache.invalidate)
+
+
+def replay(user_id, rounds=10):
+    """Replay list services and report what the cache saved.
+
+    Between rounds, an item is given to the user so that the item list
+    has to be rebuilt while other lists are served from the cache.
+    Args:
+        user_id: User ID in UUID format.
+        rounds: Number of times to call each list service.
+    """
+    from mltd.models.models import User
+    from mltd.services.card import get_album_list, get_card_list
+    from mltd.services.idol import get_idol_list
+    from mltd.services.item import add_item, get_item_list
+    # The instance used by the services, since this module may be run
+    # as '__main__'.
+    from mltd.services.list_cache import list_cache
+    from mltd.services.song import get_song_list
+    from mltd.services.unit import get_unit_list
+
+    services = [get_card_list, get_album_list, get_idol_list, get_item_list,
+                get_song_list, get_unit_list]
+    context = {'user_id': str(user_id)}
+    list_cache.clear()
+    start = time.perf_counter()
+    for i in range(rounds):
+        for service in services:
+            service({}, context)
+        with Session(engine) as session:
+            user = session.get(User, user_id)
+            add_item(session=session, user=user, mst_item_id=200,
+                     item_type=8)
+            session.commit()
+    seconds = time.perf_counter() - start
+
+    print(f'{rounds} rounds of {len(services)} list services in '
+          f'{seconds:.2f} s')
+    total_ms = 0
+    total_bytes = 0
+    for stats in list_cache.summary():
+        total_ms += stats['saved_ms']
+        total_bytes += stats['saved_bytes']
+        print(f'{stats["method"]}: {stats["hits"]} hits, '
+              f'{stats["misses"]} misses, saved {stats["saved_ms"]:.0f} ms '
+              f'and {stats["saved_bytes"]:,} bytes')
+    print(f'Total saved: {total_ms:.0f} ms and {total_bytes:,} bytes')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replay list services and report cache savings.')
+    parser.add_argument('--user-id',
+                        default='ffffffff-ffff-ffff-ffff-ffffffffffff',
+                        help='user ID in UUID format')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='number of times to call each list service')
+    args = parser.parse_args()
+    replay(UUID(args.user_id), args.rounds)
@@ -1,35 +1,45 @@
 import random
 from datetime import datetime, timedelta, timezone
 from decimal import ROUND_DOWN, Decimal
-from enum import Enum
 from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import func, or_, select, update
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
+from mltd.models.fast_schemas import compile_schema
+from mltd.models.loaders import loader_profile
 from mltd.models.models import (Card, ClearSongCount, Costume, Course, Friend,
                                 FullComboSongCount, Item, LP, MainStoryChapter,
-                                Memorial, Mission, MstCard, MstCostume,
-                                MstCourse, MstCourseReward, MstGameSetting,
-                                MstItem, MstMainStory,
+                                Memorial, Mission, MstCard, MstCourseReward,
+                                MstGameSetting, MstItem, MstMainStory,
                                 MstMainStoryContactStatus, MstMemorial,
                                 MstMission, MstRewardItem, MstScoreThreshold,
                                 MstTheaterRoomStatus, PendingSong, Present,
                                 Profile, RandomLive, RandomLiveIdol, Song,
-                                SongUnit, Unit, User)
+                                SongUnit, TopLP, Unit)
+from mltd.models.progression import get_progression
 from mltd.models.schemas import (CardSchema, GashaMedalSchema, GuestSchema,
                                  IdolSchema, ItemSchema, MemorialSchema,
                                  MissionSchema, MstRewardItemSchema,
                                  PendingSongSchema, RandomLiveSchema,
                                  SongSchema, SongUnitSchema, UnitSchema,
                                  UserSchema)
+from mltd.models.session_scope import request_session
+from mltd.models.shards import shard_router
+from mltd.models.statements import (select_active_mission,
+                                    select_course_cost,
+                                    select_open_missions,
+                                    select_score_threshold_list, select_user)
 from mltd.servers.config import config
 from mltd.servers.i18n import translation
+from mltd.servers.profiling import stage_profiler
 from mltd.services.card import add_card
+from mltd.services.drop import DropType, drop_engine, gasha_medal_pt
 from mltd.services.game_setting import get_item_day_idol_type
+from mltd.services.guest_pool import guest_pool
 from mltd.services.item import add_item
+from mltd.services.live_rewards import (RandomMode, distribute_gain,
+                                         get_gains)
 from mltd.services.mission import update_mission_progress
 from mltd.services.present import add_present
 from mltd.services.song import localize_song_name
@@ -37,6 +47,39 @@ from mltd.services.song import localize_song_name
 _ = translation.gettext
 
 
+def _fetch_guests(shard_session, guest_ids):
+    """Serialize the profiles of guests stored in a database."""
+    guest_schema = GuestSchema()
+    return guest_schema.dump(shard_session.scalars(
+        select(Profile)
+        .where(Profile.id_.in_(guest_ids))
+    ), many=True)
+
+
+def dump_pending_song(session, pending_song):
+    """Serialize a pending song with the profile of its guest.
+
+    With user shards, the guest is usually stored in another shard, where
+    the guest_profile relationship cannot reach, so a missing profile is
+    loaded with shard_router.gather().
+    Args:
+        session: Session of the current request.
+        pending_song: A PendingSong.
+    Returns:
+        A dict, see the return value 'pending_song' of the method
+        'UserService.GetPendingData'.
+    """
+    pending_song_schema = PendingSongSchema()
+    result = pending_song_schema.dump(pending_song)
+    if pending_song.guest_user_id and pending_song.guest_profile is None:
+        guests = shard_router.gather(session, [pending_song.guest_user_id],
+                                     _fetch_guests)
+        if guests:
+            guests[0]['is_friend'] = result['user_summary']['is_friend']
+            result['user_summary'] = guests[0]
+    return result
+
+
 @dispatcher.add_method(name='LiveService.GetRandomLive', context_arg='context')
 def get_random_live(params, context):
     """Service for getting random live info for a user.
@@ -82,7 +125,7 @@ def get_random_live(params, context):
         'idol_list': None
     }
 
-    with Session(engine) as session:
+    with request_session() as session:
         random_live = session.scalar(
             select(RandomLive)
             .where(RandomLive.user_id == UUID(context['user_id']))
@@ -169,7 +212,7 @@ def set_random_live(params, context):
                 costume_is_random: false.
                 costume_random_type: 0.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         random_live = RandomLive(
             user_id=UUID(context['user_id']),
             random_live_type=params['random_live_type'],
@@ -245,26 +288,22 @@ def get_random_guest_list(params, context):
             create_date: The date when the guest first registered.
             last_login_date: Last login date of the guest.
     """
-    with Session(engine) as session:
-        friends = session.scalars(
-            select(Profile)
-            .join(Friend, Friend.friend_id == Profile.id_)
-            .where(Friend.user_id == UUID(context['user_id']))
-            .order_by(func.random())
-            .limit(15)
-        ).all()
-        friend_ids = [friend.id_ for friend in friends]
-        other_guests = session.scalars(
-            select(Profile)
-            .where(Profile.id_ != UUID(context['user_id']))
-            .where(~Profile.id_.in_(friend_ids))
-            .order_by(func.random())
-            .limit(20 - len(friends))
+    user_id = UUID(context['user_id'])
+    with request_session() as session:
+        friend_ids = session.scalars(
+            select(Friend.friend_id)
+            .where(Friend.user_id == user_id)
         ).all()
-
-        guest_schema = GuestSchema()
-        guest_list = guest_schema.dump(friends, many=True)
-        guest_list.extend(guest_schema.dump(other_guests, many=True))
+        friend_ids = random.sample(friend_ids, min(15, len(friend_ids)))
+        other_guest_ids = guest_pool.sample(
+            session, 20 - len(friend_ids), [user_id, *friend_ids])
+
+        # Guests may be stored in other shards.
+        guests = {UUID(guest['user_id']): guest
+                  for guest in shard_router.gather(
+                      session, friend_ids + other_guest_ids, _fetch_guests)}
+        guest_list = [guests[x] for x in friend_ids + other_guest_ids
+                      if x in guests]
         for guest in guest_list:
             guest['is_friend'] = UUID(guest['user_id']) in friend_ids
 
@@ -359,30 +398,21 @@ def start_song(params, context):
     """
     now = datetime.now(timezone.utc)
     seed = random.randint(-2_147_483_648, 2_147_483_647)
-    with Session(engine) as session:
-        level_subq = (
-            select(MstCourse.level)
-            .where(MstCourse.mst_song_id == params['mst_song_id'])
-            .where(MstCourse.course_id == params['course'])
-            .scalar_subquery()
-        )
+    with request_session() as session:
         threshold_list_str = session.scalar(
-            select(MstScoreThreshold.score_threshold_list)
-            .where(MstScoreThreshold.level == level_subq)
+            select_score_threshold_list(params['mst_song_id'],
+                                        params['course'])
         )
         threshold_list = [int(x) for x in threshold_list_str.split(',')]
 
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         before_vitality = user.vitality
         after_vitality = before_vitality
         if not params['live_ticket']:
             cost = session.scalar(
-                select(MstCourse.cost)
-                .where(MstCourse.mst_song_id == params['mst_song_id'])
-                .where(MstCourse.course_id == params['course'])
+                select_course_cost(params['mst_song_id'], params['course'])
             )
             after_vitality -= cost
             if after_vitality < 0:
@@ -481,10 +511,9 @@ def continue_song(params, context):
         A dict containing a single key named 'retry_count', whose value
         is the same as 'retry_count' above.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         user.pending_song.retry_count = params['retry_count']
 
@@ -521,16 +550,14 @@ def restart_song(params, context):
         return value 'pending_song' of the method
         'UserService.GetPendingData' for the dict definition.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         if params['live_token'] != user.pending_song.live_token:
             raise ValueError('Game and server live_tokens do not match')
 
-        pending_song_schema = PendingSongSchema()
-        pending_song = pending_song_schema.dump(user.pending_song)
+        pending_song = dump_pending_song(session, user.pending_song)
 
     return {'pending_song': pending_song}
 
@@ -555,10 +582,9 @@ def break_song(params, context):
     Returns:
         See the implementation below.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
 
         if user.pending_song.use_full_random:
@@ -957,93 +983,89 @@ def finish_song(params, context):
         require_log_id: ''.
     """
     now = datetime.now(timezone.utc)
-    with Session(engine) as session:
+    profiled_call = stage_profiler.profile('LiveService.FinishSong')
+    with profiled_call as profile, request_session() as session:
+        profile.stage('load_user')
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'live-finish')
         ).one()
         if params['live_token'] != user.pending_song.live_token:
             raise ValueError('Game and server live_tokens do not match')
 
         course_id = user.pending_song.course
         is_ticket = user.pending_song.live_ticket > 0
-        gained_exp = (0 if is_ticket
-                      else [0, 150, 150, 260, 204, 260, 306][course_id])
+        if user.pending_song.use_full_random:
+            random_mode = RandomMode.FULL
+        elif user.pending_song.use_song_random:
+            random_mode = RandomMode.SONG
+        else:
+            random_mode = RandomMode.NONE
+        gains = get_gains(course_id, random_mode, is_ticket)
+        gained_exp = gains.exp
         if user.level < 50:
             gained_exp *= 2
-        gained_money = (0 if is_ticket
-                        else [0, 630, 630, 1200, 900, 1200, 1350][course_id])
-        gained_fan = [0, 60, 60, 100, 78, 97, 120][course_id]
-        gained_affection = [0, 12, 12, 24, 18, 24, 30][course_id]
-        gained_awakening_pt = [0, 15, 15, 28, 22, 28, 34][course_id]
-        if is_ticket:
-            gained_fan //= 2
-            gained_affection //= 2
-        if user.pending_song.use_song_random:
-            if is_ticket:
-                gained_fan = [0, 36, 36, 60, 48, 60, 72][course_id]
-                gained_affection = [0, 7, 6, 14, 7, 12, 18][course_id]
-            else:
-                gained_fan = [0, 72, 72, 120, 96, 120, 144][course_id]
-                gained_affection = [0, 14, 12, 28, 19, 25, 36][course_id]
-            gained_awakening_pt = [0, 18, 18, 33, 26, 33, 40][course_id]
-        if user.pending_song.use_full_random:
-            if is_ticket:
-                gained_fan = [0, 45, 43, 75, 60, 73, 90][course_id]
-                gained_affection = [0, 9, 7, 18, 12, 18, 19][course_id]
-            else:
-                gained_fan = [0, 90, 90, 150, 120, 150, 180][course_id]
-                gained_affection = [0, 18, 18, 36, 25, 36, 43][course_id]
-            gained_awakening_pt = [0, 22, 22, 42, 33, 42, 51][course_id]
+        gained_money = gains.money
+        gained_fan = gains.fan
+        gained_affection = gains.affection
+        gained_awakening_pt = gains.awakening_pt
 
         #region Update user info.
-
-        user_lv_base = session.scalar(
-            select(MstGameSetting.user_lv_base)
+        profile.stage('user_info')
+
+        progression = get_progression(session)
+        new_level, new_exp = progression.level_for_exp(
+            user.level, user.exp + gained_exp)
+        new_next_exp = (user.next_exp if new_level == user.level
+                        else progression.next_exp[new_level])
+        new_rank = min(
+            max(progression.rank_for_fan(user.theater_fan + gained_fan),
+                user.producer_rank),
+            user.producer_rank + 1
         )
-        new_level = user.level
-        new_exp = user.exp + gained_exp
-        new_next_exp = user.next_exp
-        while new_exp >= new_next_exp:
-            new_level += 1
-            new_exp -= new_next_exp
-            new_next_exp += user_lv_base
-        new_rank = user.producer_rank
-        rank_up_requirement = [0, 1_000, 10_000, 50_000, 100_000, 300_000,
-                               500_000, 1_000_000]
-        if (new_rank < 8
-                and user.theater_fan + gained_fan
-                >= rank_up_requirement[new_rank]):
-            new_rank += 1
-        rank_reward = session.scalar(
-            select(MstRewardItem)
-            .where(MstRewardItem.mst_item_id
-                   == 0 if new_rank == user.producer_rank else 3)
-            .where(MstRewardItem.amount
-                   == (0 if new_rank == user.producer_rank
-                       else 50 if new_rank <= 6
-                       else 100 if new_rank == 7
-                       else 150))
-        )
-        new_vitality = user.vitality
-        new_max_vitality = user.max_vitality
-        if new_level > user.level:
-            for level in range(user.level+1, new_level+1):
-                if (level <= 60 and level % 2 == 0
-                    or 60 < level and level <= 150 and level % 3 == 0
-                    or 150 < level and level <= 426 and level % 4 == 0
-                    or 426 < level and level <= 586 and level % 5 == 1
-                    or 586 < level and level <= 700 and level % 6 == 4):
-                    new_max_vitality += 1
-                new_vitality += new_max_vitality
-        new_max_friend = user.max_friend
-        if new_level > user.level:
-            for level in range(user.level+1, new_level+1):
-                if level <= 151 and level % 3 == 1:
-                    new_max_friend += 1
+        rank_reward = progression.rank_reward(new_rank > user.producer_rank,
+                                               new_rank)
+        recovered_vitality, new_max_vitality = progression.level_up_vitality(
+            user.level, new_level, user.max_vitality)
+        new_vitality = user.vitality + recovered_vitality
+        new_max_friend = progression.level_up_max_friend(
+            user.level, new_level, user.max_friend)
         new_theater_fan = user.theater_fan + gained_fan
-        user_schema = UserSchema()
-        user_dict = user_schema.dump(user)
+
+        def _update_top_lps(mst_song_id, idol_type, course, song_lp):
+            """Update the top 10 song LPs of an idol type for the user.
+
+            Args:
+                mst_song_id: ID of the song whose LP has risen.
+                idol_type: Idol type of the song.
+                course: Course the user played on to get the song LP.
+                song_lp: New song LP.
+            Returns:
+                Change in user LP for this idol type.
+            """
+            type_top_lps = [top_lp for top_lp in user.top_lps
+                            if top_lp.idol_type == idol_type]
+            before_type_lp = sum(top_lp.lp for top_lp in type_top_lps)
+            top_lp = next((top_lp for top_lp in type_top_lps
+                           if top_lp.mst_song_id == mst_song_id), None)
+            if top_lp:
+                top_lp.course = course
+                top_lp.lp = song_lp
+            elif len(type_top_lps) < 10 or song_lp > type_top_lps[-1].lp:
+                if len(type_top_lps) >= 10:
+                    user.top_lps.remove(type_top_lps.pop())
+                top_lp = TopLP(
+                    user_id=user.user_id,
+                    mst_song_id=mst_song_id,
+                    idol_type=idol_type,
+                    course=course,
+                    lp=song_lp
+                )
+                user.top_lps.append(top_lp)
+                type_top_lps.append(top_lp)
+            user.top_lps.sort(key=lambda x: (
+                -x.lp, x.update_date.replace(tzinfo=timezone.utc)))
+            return sum(top_lp.lp for top_lp in type_top_lps) - before_type_lp
+
         song_idol_type = user.pending_song.song.mst_song.idol_type
         new_song_lp = user.pending_song.song.lp
         new_lp = user.lp
@@ -1051,15 +1073,12 @@ def finish_song(params, context):
         if not is_live_support:
             if params['score'] // 10_000 > new_song_lp:
                 new_song_lp = params['score'] // 10_000
-                for type_lp in user_dict['type_lp_list']:
-                    if type_lp['idol_type'] == song_idol_type:
-                        if (not type_lp['lp_song_status_list']
-                                or len(type_lp['lp_song_status_list']) < 10):
-                            new_lp += new_song_lp
-                        else:
-                            min_lp = type_lp['lp_song_status_list'][-1]['lp']
-                            if new_song_lp > min_lp:
-                                new_lp += new_song_lp - min_lp
+                new_lp += _update_top_lps(
+                    mst_song_id=user.pending_song.mst_song_id,
+                    idol_type=song_idol_type,
+                    course=user.pending_song.course,
+                    song_lp=new_song_lp
+                )
         new_money = min(user.money + gained_money, user.max_money)
         if new_theater_fan >= 1_000_000:
             new_map_level = 20
@@ -1081,7 +1100,7 @@ def finish_song(params, context):
             'rank_up': new_rank > user.producer_rank,
             'before_rank': user.producer_rank,
             'after_rank': new_rank,
-            'rank_reward': reward_item_schema.dump(rank_reward),
+            'rank_reward': rank_reward,
             'before_vitality': user.vitality,
             'after_vitality': new_vitality,
             'before_max_vitality': user.max_vitality,
@@ -1121,7 +1140,7 @@ def finish_song(params, context):
 
         user.level = new_level
         user.producer_rank = new_rank
-        if rank_reward.mst_item_id:
+        if rank_reward['mst_item_id']:
             add_present(
                 session=session,
                 user=user,
@@ -1132,8 +1151,8 @@ def finish_song(params, context):
                     ).format(
                         rank=['E', 'D', 'C', 'B', 'A', 'S', 'SS'][new_rank-2]
                     ),
-                    amount=rank_reward.amount,
-                    item_id=f'{user.user_id}_{rank_reward.mst_item_id}'
+                    amount=rank_reward['amount'],
+                    item_id=f'{user.user_id}_{rank_reward["mst_item_id"]}'
                 )
             )
         user.vitality = new_vitality
@@ -1154,7 +1173,6 @@ def finish_song(params, context):
                     course=user.pending_song.course,
                     lp=new_song_lp
                 ))
-                session.expire(user, ['lps'])
             elif new_song_lp > lp.lp:
                 lp.course = user.pending_song.course
                 lp.lp = new_song_lp
@@ -1174,6 +1192,7 @@ def finish_song(params, context):
 
         #region Update song and course info and give score/combo/clear
         #       rank rewards to the user.
+        profile.stage('course_rewards')
 
         song = user.pending_song.song
         course = song.courses[course_id-1]
@@ -1391,7 +1410,7 @@ def finish_song(params, context):
                 .where(Course.user == user)
                 .values(is_released=True)
             )
-        song_schema = SongSchema()
+        song_schema = compile_schema(SongSchema)
         song_dict = song_schema.dump(song)
 
         if (live_result_reward['before_clear_rank'] == 0
@@ -1414,35 +1433,7 @@ def finish_song(params, context):
         #endregion
 
         #region Update card and idol info.
-
-        def _distribute_gain_per_card(total_gain, max_gain_per_card):
-            """Calculate the gained fan/affection/awakening pt per card.
-
-            Args:
-                total_gain: Total fan/affection/awakening pt to be
-                            distributed across the five cards/idols.
-                max_gain_per_card: A list of 5 ints representing the
-                                   maximum allowed gain per card/idol.
-            Returns:
-                A list of 5 ints representing the distributed gain per
-                card/idol.
-            """
-            gain_per_card = [0, 0, 0, 0, 0]
-            while total_gain > 0 and [x for x in max_gain_per_card if x > 0]:
-                if total_gain >= 2 and max_gain_per_card[0] >= 2:
-                    gain_per_card[0] += 2
-                    total_gain -= 2
-                    max_gain_per_card[0] -= 2
-                elif total_gain >= 1 and max_gain_per_card[0] >= 1:
-                    gain_per_card[0] += 1
-                    total_gain -= 1
-                    max_gain_per_card[0] -= 1
-                for i in range(1, 5):
-                    if total_gain >= 1 and max_gain_per_card[i] >= 1:
-                        gain_per_card[i] += 1
-                        total_gain -= 1
-                        max_gain_per_card[i] -= 1
-            return gain_per_card
+        profile.stage('card_idol_info')
 
         unit_dict = {
             'unit_num': 0,
@@ -1492,11 +1483,11 @@ def finish_song(params, context):
                 cards[0].mst_card.awakening_gauge_max
                 - cards[0].awakening_gauge)
         else:
-            gained_fan_per_idol = _distribute_gain_per_card(
+            gained_fan_per_idol = distribute_gain(
                 gained_fan, [gained_fan] * 5)
-            gained_affection_per_idol = _distribute_gain_per_card(
+            gained_affection_per_idol = distribute_gain(
                 gained_affection, [gained_affection] * 5)
-            gained_awakening_pt_per_card = _distribute_gain_per_card(
+            gained_awakening_pt_per_card = distribute_gain(
                 gained_awakening_pt,
                 [card.mst_card.awakening_gauge_max - card.awakening_gauge
                  for card in cards])
@@ -1558,7 +1549,7 @@ def finish_song(params, context):
             if memorial_id:
                 memorial.is_released = True
 
-        card_schema = CardSchema()
+        card_schema = compile_schema(CardSchema)
         card_list = card_schema.dump(cards, many=True)
         center_2nd_anniversary_card = session.scalar(
             select(Card)
@@ -1566,10 +1557,11 @@ def finish_song(params, context):
             .where(Card.user == user)
             .where(MstCard.mst_idol_id == idols[0].mst_idol_id)
             .where(MstCard.ex_type == 7)
+            .options(*loader_profile('card-list'))
         )
         if center_2nd_anniversary_card:
             card_list.append(card_schema.dump(center_2nd_anniversary_card))
-        idol_schema = IdolSchema()
+        idol_schema = compile_schema(IdolSchema)
         updated_idol_list = [{
             'idol_id': '',
             'mst_idol_id': 0,
@@ -1612,56 +1604,7 @@ def finish_song(params, context):
         #endregion
 
         #region Pick random drop rewards and give them to the user.
-
-        # The drop rates are an approximation based on the following
-        # 1309 items dropped across 245 songs.
-        # Stage dress           105 ( 73 on non-item days)
-        # Mini crown            116 ( 84 on non-item days)
-        # Lipstick              187 (107 on non-item days)
-        # Perfume               229 (150 on non-item days)
-        # Mirror                112 ( 64 on non-item days)
-        # Gasha medal 10pt       66
-        # Gasha medal 15pt       79
-        # Gasha medal 20pt       66
-        # Lesson ticket N        74
-        # Lesson ticket R        65
-        # Throat lozenges         4
-        # Tapioca drink           9
-        # High cocoa chocolate    9
-        # Roll cake               6
-        # Fan letter              9
-        # Single flower          10
-        # Hand cream             10
-        # Bath additive           5
-        # Auto live pass         10
-        # N cards               113
-        # R cards                17
-        # Costumes                8
-        class DropType(Enum):
-            AWAKENING_ITEM = 55.0
-            GASHA_MEDAL_PT = 15.5
-            LESSON_TICKET = 10.0
-            CARD = 9.5
-            AUTO_LIVE_PASS = 5.0
-            GIFT = 4.5
-            COSTUME = 0.5
-
-        class AwakeningDropType(Enum):
-            STAGE_DRESS = (4, 100, 15.7)
-            MINI_CROWN = (4, 101, 17.7)
-            PRINCESS_LIPSTICK = (1, 110, 7.4)
-            PRINCESS_PERFUME = (1, 111, 10.4)
-            PRINCESS_MIRROR = (1, 112, 4.4)
-            FAIRY_LIPSTICK = (2, 120, 7.4)
-            FAIRY_PERFUME = (2, 121, 10.4)
-            FAIRY_MIRROR = (2, 122, 4.4)
-            ANGEL_LIPSTICK = (3, 130, 7.4)
-            ANGEL_PERFUME = (3, 131, 10.4)
-            ANGEL_MIRROR = (3, 132, 4.4)
-            def __init__(self, idol_type, mst_item_id, weight):
-                self.idol_type = idol_type
-                self.mst_item_id = mst_item_id
-                self.weight = weight
+        profile.stage('drops')
 
         old_gasha_medals = len(user.gasha_medal.gasha_medal_expire_dates)
         old_gasha_medal_pt = user.gasha_medal.point_amount
@@ -1671,32 +1614,9 @@ def finish_song(params, context):
         if not user.pending_song.live_ticket:
             drop_reward_box_list = []
             is_item_day = song_idol_type == get_item_day_idol_type()
-            n_card_id_stmt = (
-                select(MstCard.mst_card_id)
-                .where(MstCard.rarity == 1)
-            )
-            r_card_id_stmt = (
-                select(MstCard.mst_card_id)
-                .where(MstCard.rarity == 2)
-            )
-            if is_item_day and song_idol_type != 4:
-                n_card_id_stmt = n_card_id_stmt.where(
-                    MstCard.idol_type == song_idol_type)
-                r_card_id_stmt = r_card_id_stmt.where(
-                    MstCard.idol_type == song_idol_type)
-            n_card_ids = session.scalars(n_card_id_stmt).all()
-            r_card_ids = session.scalars(r_card_id_stmt).all()
-            unlocked_costume_subq = (
-                select(Costume.mst_costume_id)
-                .where(Costume.user == user)
-                .where(Costume.mst_costume_id == MstCostume.mst_costume_id)
-            ).exists()
-            locked_costume_ids = session.scalars(
-                select(MstCostume.mst_costume_id)
-                .where(MstCostume.costume_name == 'ex')
-                .where(MstCostume.costume_number.in_([2, 3, 5, 6]))
-                .where(~unlocked_costume_subq)
-            ).all()
+            drop_engine.load(session)
+            locked_costume_ids = drop_engine.locked_costume_ids(
+                session, user.user_id)
             auto_live_pass_remaining = session.scalar(
                 select(MstItem.max_amount - Item.amount)
                 .select_from(Item)
@@ -1705,131 +1625,20 @@ def finish_song(params, context):
                 .where(Item.mst_item_id == 50)
                 .where(Item.amount < MstItem.max_amount)
             )
-            allowed_drops = [
-                DropType.AWAKENING_ITEM,
-                DropType.GASHA_MEDAL_PT,
-                DropType.LESSON_TICKET,
-                DropType.CARD,
-                DropType.GIFT
-            ]
-            if auto_live_pass_remaining:
-                allowed_drops.append(DropType.AUTO_LIVE_PASS)
-            if locked_costume_ids:
-                allowed_drops.append(DropType.COSTUME)
-            drop_count = [
-                2, 2, 4, 3, 4, random.randint(4, 5)][course_id-1]
-            if params['score_rank'] == 5:
-                drop_count = [
-                    random.randint(2, 3),
-                    random.randint(2, 3),
-                    random.randint(4, 5),
-                    random.randint(3, 4),
-                    random.randint(4, 5),
-                    random.randint(5, 6)
-                ][course_id-1]
-
-            selected_drops = random.choices(
-                allowed_drops, [x.value for x in allowed_drops], k=drop_count)
-            for drop_type in selected_drops:
-                if (drop_type is DropType.AUTO_LIVE_PASS
-                        and not auto_live_pass_remaining):
-                    if DropType.AUTO_LIVE_PASS in allowed_drops:
-                        allowed_drops.remove(DropType.AUTO_LIVE_PASS)
-                    drop_type = random.choices(
-                        allowed_drops, [x.value for x in allowed_drops], k=1
-                    )[0]
-                if drop_type is DropType.COSTUME and not locked_costume_ids:
-                    if DropType.COSTUME in allowed_drops:
-                        allowed_drops.remove(DropType.COSTUME)
-                    drop_type = random.choices(
-                        allowed_drops, [x.value for x in allowed_drops], k=1
-                    )[0]
-
-                if drop_type is DropType.AWAKENING_ITEM:
-                    allowed_awakening_drops = [
-                        AwakeningDropType.STAGE_DRESS,
-                        AwakeningDropType.MINI_CROWN,
-                        AwakeningDropType.PRINCESS_LIPSTICK,
-                        AwakeningDropType.PRINCESS_PERFUME,
-                        AwakeningDropType.PRINCESS_MIRROR,
-                        AwakeningDropType.FAIRY_LIPSTICK,
-                        AwakeningDropType.FAIRY_PERFUME,
-                        AwakeningDropType.FAIRY_MIRROR,
-                        AwakeningDropType.ANGEL_LIPSTICK,
-                        AwakeningDropType.ANGEL_PERFUME,
-                        AwakeningDropType.ANGEL_MIRROR
-                    ]
-                    if is_item_day:
-                        allowed_awakening_drops = [
-                            x for x in allowed_awakening_drops
-                            if x.idol_type == song_idol_type]
-                    selected_awakening_drop = random.choices(
-                        allowed_awakening_drops,
-                        [x.weight for x in allowed_awakening_drops], k=1)[0]
-                    drop_reward_item = MstRewardItem(
-                        reward_type=4,
-                        mst_item_id=selected_awakening_drop.mst_item_id,
-                        item_type=7,
-                        amount=1
-                    )
-                elif drop_type is DropType.GASHA_MEDAL_PT:
-                    selected_item_id = random.choice([502, 503, 504])
-                    dropped_gasha_medal_pt += (
-                        10 if selected_item_id == 502
-                        else 15 if selected_item_id == 503
-                        else 20)
-                    drop_reward_item = MstRewardItem(
-                        reward_type=4,
-                        mst_item_id=selected_item_id,
-                        item_type=4,
-                        amount=1
-                    )
-                elif drop_type is DropType.LESSON_TICKET:
-                    selected_item_id = random.choice([200, 201])
-                    drop_reward_item = MstRewardItem(
-                        reward_type=4,
-                        mst_item_id=selected_item_id,
-                        item_type=8,
-                        amount=1
-                    )
-                elif drop_type is DropType.GIFT:
-                    selected_item_id = random.choices(
-                        [70, 71, 72, 73, 80, 81, 82, 83],
-                        [1, 2, 2, 1, 2, 2, 2, 1], k=1)[0]
-                    drop_reward_item = MstRewardItem(
-                        reward_type=4,
-                        mst_item_id=selected_item_id,
-                        item_type=25 if selected_item_id < 80 else 26,
-                        amount=1
-                    )
-                elif drop_type is DropType.AUTO_LIVE_PASS:
-                    auto_live_pass_remaining -= 1
-                    drop_reward_item = MstRewardItem(
-                        reward_type=4,
-                        mst_item_id=50,
-                        item_type=23,
-                        amount=1
-                    )
-                elif drop_type is DropType.CARD:
-                    selected_card_type = random.choices(
-                        ['N', 'R'], [9, 1], k=1)[0]
-                    if selected_card_type == 'N':
-                        selected_card_id = random.choice(n_card_ids)
-                    else:
-                        selected_card_id = random.choice(r_card_ids)
-                    drop_reward_item = MstRewardItem(
-                        reward_type=6,
-                        mst_card_id=selected_card_id,
-                        amount=1
-                    )
-                elif drop_type is DropType.COSTUME:
-                    selected_costume_id = random.choice(locked_costume_ids)
-                    locked_costume_ids.remove(selected_costume_id)
-                    drop_reward_item = MstRewardItem(
-                        reward_type=8,
-                        mst_costume_id=selected_costume_id,
-                        amount=1
-                    )
+            drop_count = drop_engine.drop_count(
+                course_id, params['score_rank'] == 5)
+            selected_drops = drop_engine.pick_drops(
+                k=drop_count,
+                song_idol_type=song_idol_type,
+                is_item_day=is_item_day,
+                auto_live_pass_remaining=auto_live_pass_remaining,
+                locked_costume_ids=locked_costume_ids
+            )
+            for drop_type, reward in selected_drops:
+                drop_reward_item = MstRewardItem(**reward)
+                if drop_type is DropType.GASHA_MEDAL_PT:
+                    dropped_gasha_medal_pt += gasha_medal_pt[
+                        drop_reward_item.mst_item_id]
 
                 drop_reward_box_list.append({
                     'drop_reward_item': reward_item_schema.dump(
@@ -1886,6 +1695,7 @@ def finish_song(params, context):
                         mst_costume_id=mst_costume_id
                     ))
 
+        profile.stage('items')
         result_gasha_medal = {
             'before_gauge': 0,
             'after_gauge': 0,
@@ -1919,7 +1729,7 @@ def finish_song(params, context):
         ).all()
         updated_item_list = []
         if updated_items:
-            item_schema = ItemSchema()
+            item_schema = compile_schema(ItemSchema)
             updated_item_list = item_schema.dump(updated_items, many=True)
         gasha_medal_schema = GashaMedalSchema()
         gasha_medal = gasha_medal_schema.dump(user.gasha_medal)
@@ -1927,6 +1737,7 @@ def finish_song(params, context):
         #endregion
 
         #region Unlock main story episode (if any).
+        profile.stage('main_story')
 
         release_mst_main_story_id = 0
         mst_room_id = 0
@@ -1967,16 +1778,14 @@ def finish_song(params, context):
 
         #region Update mission info and give mission rewards to the
         #       user.
+        profile.stage('missions')
 
         mission_list = []
-        mission_schema = MissionSchema()
+        mission_schema = compile_schema(MissionSchema)
 
         # Update daily mission progress.
         daily_song_mission = session.scalar(
-            select(Mission)
-            .where(Mission.user == user)
-            .where(Mission.mst_mission_id == 72)
-            .where(Mission.mission_state == 1)
+            select_active_mission(user.user_id, 72)
         )
         if (daily_song_mission
                 and user.challenge_song.daily_challenge_mst_song_id
@@ -1990,10 +1799,7 @@ def finish_song(params, context):
             mission_list.append(mission_schema.dump(daily_song_mission))
 
             daily_total_mission = session.scalar(
-                select(Mission)
-                .where(Mission.user == user)
-                .where(Mission.mst_mission_id == 75)
-                .where(Mission.mission_state == 1)
+                select_active_mission(user.user_id, 75)
             )
             if daily_total_mission:
                 is_complete = update_mission_progress(
@@ -2008,10 +1814,7 @@ def finish_song(params, context):
 
         # Update weekly mission progress.
         weekly_fan_mission = session.scalar(
-            select(Mission)
-            .where(Mission.user == user)
-            .where(Mission.mst_mission_id == 70)
-            .where(Mission.mission_state == 1)
+            select_active_mission(user.user_id, 70)
         )
         if weekly_fan_mission:
             is_complete = update_mission_progress(
@@ -2025,13 +1828,7 @@ def finish_song(params, context):
 
         # Update normal mission progress.
         live_clear_missions = session.scalars(
-            select(Mission)
-            .join(MstMission)
-            .where(Mission.user == user)
-            .where(MstMission.mst_mission_class_id == 1)
-            .where(Mission.mission_state.in_([0, 1]))
-            # Process missions in the order they are unlocked.
-            .order_by(MstMission.sort_id)
+            select_open_missions(user.user_id, 1)
         ).all()
         for mission in live_clear_missions:
             is_complete = update_mission_progress(
@@ -2070,12 +1867,7 @@ def finish_song(params, context):
                         mission_list.append(mission_schema.dump(mission))
 
             score_missions = session.scalars(
-                select(Mission)
-                .join(MstMission)
-                .where(Mission.user == user)
-                .where(MstMission.mst_mission_class_id == 3)
-                .where(Mission.mission_state.in_([0, 1]))
-                .order_by(MstMission.sort_id)
+                select_open_missions(user.user_id, 3)
             ).all()
             for mission in score_missions:
                 is_complete = update_mission_progress(
@@ -2088,12 +1880,7 @@ def finish_song(params, context):
                     mission_list.append(mission_schema.dump(mission))
 
             song_level_missions = session.scalars(
-                select(Mission)
-                .join(MstMission)
-                .where(Mission.user == user)
-                .where(MstMission.mst_mission_class_id == 4)
-                .where(Mission.mission_state.in_([0, 1]))
-                .order_by(MstMission.sort_id)
+                select_open_missions(user.user_id, 4)
             ).all()
             for mission in song_level_missions:
                 is_complete = update_mission_progress(
@@ -2107,12 +1894,7 @@ def finish_song(params, context):
 
         card_count = len(user.cards)
         card_missions = session.scalars(
-            select(Mission)
-            .join(MstMission)
-            .where(Mission.user == user)
-            .where(MstMission.mst_mission_class_id == 5)
-            .where(Mission.mission_state.in_([0, 1]))
-            .order_by(MstMission.sort_id)
+            select_open_missions(user.user_id, 5)
         ).all()
         for mission in card_missions:
             is_complete = update_mission_progress(
@@ -2125,12 +1907,7 @@ def finish_song(params, context):
                 mission_list.append(mission_schema.dump(mission))
 
         affection_missions = session.scalars(
-            select(Mission)
-            .join(MstMission)
-            .where(Mission.user == user)
-            .where(MstMission.mst_mission_class_id == 6)
-            .where(Mission.mission_state.in_([0, 1]))
-            .order_by(MstMission.sort_id)
+            select_open_missions(user.user_id, 6)
         ).all()
         for mission in affection_missions:
             progress = mission.progress
@@ -2151,12 +1928,7 @@ def finish_song(params, context):
 
         if result_user['rank_up']:
             user_level_missions = session.scalars(
-                select(Mission)
-                .join(MstMission)
-                .where(Mission.user == user)
-                .where(MstMission.mst_mission_class_id == 7)
-                .where(Mission.mission_state.in_([0, 1]))
-                .order_by(MstMission.sort_id)
+                select_open_missions(user.user_id, 7)
             ).all()
             for mission in user_level_missions:
                 is_complete = update_mission_progress(
@@ -2174,12 +1946,7 @@ def finish_song(params, context):
             .where(Song.is_cleared == True)
         )
         song_clear_missions = session.scalars(
-            select(Mission)
-            .join(MstMission)
-            .where(Mission.user == user)
-            .where(MstMission.mst_mission_class_id == 8)
-            .where(Mission.mission_state.in_([0, 1]))
-            .order_by(MstMission.sort_id)
+            select_open_missions(user.user_id, 8)
         ).all()
         for mission in song_clear_missions:
             is_complete = update_mission_progress(
@@ -2193,12 +1960,7 @@ def finish_song(params, context):
 
         costume_count = len(user.costumes)
         costume_missions = session.scalars(
-            select(Mission)
-            .join(MstMission)
-            .where(Mission.user == user)
-            .where(MstMission.mst_mission_class_id == 9)
-            .where(Mission.mission_state.in_([0, 1]))
-            .order_by(MstMission.sort_id)
+            select_open_missions(user.user_id, 9)
         ).all()
         for mission in costume_missions:
             is_complete = update_mission_progress(
@@ -2211,12 +1973,7 @@ def finish_song(params, context):
                 mission_list.append(mission_schema.dump(mission))
 
         user_lp_missions = session.scalars(
-            select(Mission)
-            .join(MstMission)
-            .where(Mission.user == user)
-            .where(MstMission.mst_mission_class_id == 37)
-            .where(Mission.mission_state.in_([0, 1]))
-            .order_by(MstMission.sort_id)
+            select_open_missions(user.user_id, 37)
         ).all()
         for mission in user_lp_missions:
             is_complete = update_mission_progress(
@@ -2251,10 +2008,7 @@ def finish_song(params, context):
                 mission_list.append(mission_schema.dump(mission))
 
         shika_unit_center_mission = session.scalar(
-            select(Mission)
-            .where(Mission.user == user)
-            .where(Mission.mst_mission_id == 120)
-            .where(Mission.mission_state == 1)
+            select_active_mission(user.user_id, 120)
         )
         if (shika_unit_center_mission
                 and idols[0].mst_idol_id
@@ -2273,10 +2027,7 @@ def finish_song(params, context):
                     mission_schema.dump(shika_unit_center_mission))
 
         shika_solo_center_mission = session.scalar(
-            select(Mission)
-            .where(Mission.user == user)
-            .where(Mission.mst_mission_id == 121)
-            .where(Mission.mission_state == 1)
+            select_active_mission(user.user_id, 121)
         )
         if (shika_solo_center_mission
                 and idols[0].mst_idol_id
@@ -2295,10 +2046,7 @@ def finish_song(params, context):
                     mission_schema.dump(shika_solo_center_mission))
 
         shika_live_mission = session.scalar(
-            select(Mission)
-            .where(Mission.user == user)
-            .where(Mission.mst_mission_id == 122)
-            .where(Mission.mission_state == 1)
+            select_active_mission(user.user_id, 122)
         )
         if (shika_live_mission
                 and [idol for idol in idols
@@ -2316,10 +2064,7 @@ def finish_song(params, context):
                 mission_list.append(mission_schema.dump(shika_live_mission))
 
         shika_center_mission = session.scalar(
-            select(Mission)
-            .where(Mission.user == user)
-            .where(Mission.mst_mission_id == 123)
-            .where(Mission.mission_state == 1)
+            select_active_mission(user.user_id, 123)
         )
         if (shika_center_mission
                 and idols[0].mst_idol_id
@@ -2333,6 +2078,7 @@ def finish_song(params, context):
             if is_complete:
                 mission_list.append(mission_schema.dump(shika_center_mission))
 
+        user_schema = UserSchema()
         user_dict = user_schema.dump(user)
         for type_lp in user_dict['type_lp_list']:
             if type_lp['idol_type'] == song_idol_type:
@@ -2385,6 +2131,7 @@ def finish_song(params, context):
 
         #endregion
 
+        profile.stage('commit')
         if user.pending_song.use_full_random:
             random_live = session.scalars(
                 select(RandomLive)
@@ -2400,8 +2147,7 @@ def finish_song(params, context):
             ).one()
             session.delete(random_live)
 
-        pending_song_schema = PendingSongSchema()
-        pending_song = pending_song_schema.dump(user.pending_song)
+        pending_song = dump_pending_song(session, user.pending_song)
         user.pending_song = None
 
         session.commit()
@@ -2670,21 +2416,14 @@ def start_rehearsal(params, context):
         unit_num: Unit number of the chosen unit (1-18).
     """
     now = datetime.now(timezone.utc)
-    with Session(engine) as session:
-        level_subq = (
-            select(MstCourse.level)
-            .where(MstCourse.mst_song_id == params['mst_song_id'])
-            .where(MstCourse.course_id == params['course'])
-            .scalar_subquery()
-        )
+    with request_session() as session:
         threshold_list_str = session.scalar(
-            select(MstScoreThreshold.score_threshold_list)
-            .where(MstScoreThreshold.level == level_subq)
+            select_score_threshold_list(params['mst_song_id'],
+                                        params['course'])
         )
 
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         rehearsal_cost = session.scalar(
             select(MstGameSetting.rehearsal_cost)
@@ -2751,10 +2490,9 @@ def break_rehearsal(params, context):
     Returns:
         See the implementation below.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         user.pending_song = None
 
@@ -2801,10 +2539,9 @@ def finish_rehearsal(params, context):
         is_event_twin_stage: false.
         played_event_type: 0.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         song = user.pending_song.song
         song_schema = SongSchema()
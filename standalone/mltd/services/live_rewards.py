@@ -0,0 +1,219 @@
+"""Reward tables for finishing a live.
+
+The gains of a live (exp, money, fan, affection and awakening pt)
+depend only on the course, the random mode and whether live tickets
+were used, so they are precomputed into a table keyed by these three
+values.
+
+In 5-idol modes, the gained fan, affection and awakening pt are
+distributed across the five cards/idols in rounds. In each round, the
+center gets 2 and every other card gets 1, each limited by its remaining
+cap and by the remaining total. Instead of simulating the rounds one
+unit at a time, distribute_gain() finds the number of complete rounds by
+bisection and computes the gain of each card directly from it.
+
+Running this module as a script checks distribute_gain() against the
+round-by-round reference on random inputs and benchmarks both.
+    python -m mltd.services.live_rewards [--cases N] [--seed SEED]
+"""
+import argparse
+import random
+import time
+from enum import IntEnum
+from typing import NamedTuple
+
+
+class RandomMode(IntEnum):
+    NONE = 0
+    SONG = 1
+    FULL = 2
+
+
+class Gains(NamedTuple):
+    exp: int
+    money: int
+    fan: int
+    affection: int
+    awakening_pt: int
+
+
+# Each list is indexed by course ID (1-6, 0 is unused).
+_exp = [0, 150, 150, 260, 204, 260, 306]
+_money = [0, 630, 630, 1200, 900, 1200, 1350]
+# {(random mode, is_ticket): list of gains}
+_fan = {
+    (RandomMode.NONE, False): [0, 60, 60, 100, 78, 97, 120],
+    (RandomMode.NONE, True): [0, 30, 30, 50, 39, 48, 60],
+    (RandomMode.SONG, False): [0, 72, 72, 120, 96, 120, 144],
+    (RandomMode.SONG, True): [0, 36, 36, 60, 48, 60, 72],
+    (RandomMode.FULL, False): [0, 90, 90, 150, 120, 150, 180],
+    (RandomMode.FULL, True): [0, 45, 43, 75, 60, 73, 90],
+}
+_affection = {
+    (RandomMode.NONE, False): [0, 12, 12, 24, 18, 24, 30],
+    (RandomMode.NONE, True): [0, 6, 6, 12, 9, 12, 15],
+    (RandomMode.SONG, False): [0, 14, 12, 28, 19, 25, 36],
+    (RandomMode.SONG, True): [0, 7, 6, 14, 7, 12, 18],
+    (RandomMode.FULL, False): [0, 18, 18, 36, 25, 36, 43],
+    (RandomMode.FULL, True): [0, 9, 7, 18, 12, 18, 19],
+}
+# {random mode: list of gains}
+_awakening_pt = {
+    RandomMode.NONE: [0, 15, 15, 28, 22, 28, 34],
+    RandomMode.SONG: [0, 18, 18, 33, 26, 33, 40],
+    RandomMode.FULL: [0, 22, 22, 42, 33, 42, 51],
+}
+
+gains_table = {
+    (course_id, mode, is_ticket): Gains(
+        exp=0 if is_ticket else _exp[course_id],
+        money=0 if is_ticket else _money[course_id],
+        fan=_fan[(mode, is_ticket)][course_id],
+        affection=_affection[(mode, is_ticket)][course_id],
+        awakening_pt=_awakening_pt[mode][course_id]
+    )
+    for course_id in range(7)
+    for mode in RandomMode
+    for is_ticket in (False, True)
+}
+
+
+def get_gains(course_id, mode, is_ticket):
+    """Get the gains of a live.
+
+    Args:
+        course_id: Course ID (1-6).
+        mode: A RandomMode. FULL takes precedence if both song random
+              and full random are used.
+        is_ticket: Whether live tickets were used.
+    Returns:
+        A Gains tuple. The exp is not yet doubled for users below level
+        50.
+    """
+    return gains_table[(course_id, mode, is_ticket)]
+
+
+def _given_after_rounds(rounds, caps):
+    """Total gain given after a number of complete rounds."""
+    return min(2 * rounds, caps[0]) + sum(min(rounds, x) for x in caps[1:])
+
+
+def distribute_gain(total_gain, max_gain_per_card):
+    """Calculate the gained fan/affection/awakening pt per card.
+
+    Args:
+        total_gain: Total fan/affection/awakening pt to be distributed
+                    across the five cards/idols.
+        max_gain_per_card: A list of 5 ints representing the maximum
+                           allowed gain per card/idol.
+    Returns:
+        A list of 5 ints representing the distributed gain per
+        card/idol.
+    """
+    caps = [max(x, 0) for x in max_gain_per_card]
+    if total_gain <= 0:
+        return [0, 0, 0, 0, 0]
+    max_rounds = max((caps[0] + 1) // 2, *caps[1:])
+    if _given_after_rounds(max_rounds, caps) <= total_gain:
+        return caps
+
+    # Bisect for the number of complete rounds.
+    low = 0
+    high = max_rounds
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _given_after_rounds(middle, caps) <= total_gain:
+            low = middle
+        else:
+            high = middle - 1
+    rounds = low
+
+    gain_per_card = [min(2 * rounds, caps[0])]
+    gain_per_card += [min(rounds, x) for x in caps[1:]]
+    remaining = total_gain - sum(gain_per_card)
+    # Hand out the last incomplete round in order.
+    extra = min(2, caps[0] - gain_per_card[0], remaining)
+    gain_per_card[0] += extra
+    remaining -= extra
+    for i in range(1, 5):
+        if remaining >= 1 and caps[i] > gain_per_card[i]:
+            gain_per_card[i] += 1
+            remaining -= 1
+    return gain_per_card
+
+
+def _reference_distribute_gain(total_gain, max_gain_per_card):
+    """Round-by-round distribution that distribute_gain() replaces."""
+    max_gain_per_card = list(max_gain_per_card)
+    gain_per_card = [0, 0, 0, 0, 0]
+    while total_gain > 0 and [x for x in max_gain_per_card if x > 0]:
+        if total_gain >= 2 and max_gain_per_card[0] >= 2:
+            gain_per_card[0] += 2
+            total_gain -= 2
+            max_gain_per_card[0] -= 2
+        elif total_gain >= 1 and max_gain_per_card[0] >= 1:
+            gain_per_card[0] += 1
+            total_gain -= 1
+            max_gain_per_card[0] -= 1
+        for i in range(1, 5):
+            if total_gain >= 1 and max_gain_per_card[i] >= 1:
+                gain_per_card[i] += 1
+                total_gain -= 1
+                max_gain_per_card[i] -= 1
+    return gain_per_card
+
+
+def verify(cases=100_000, seed=0):
+    """Compare distribute_gain() with the reference on random inputs.
+
+    Inputs include the fan/affection/awakening pt gains of every entry
+    in the gains table with both uniform and random caps, and random
+    totals and caps (including zero and negative caps).
+    Args:
+        cases: Number of random inputs.
+        seed: Seed of the random number generator.
+    Returns:
+        True if both produce the same distribution for every input.
+    """
+    rng = random.Random(seed)
+    inputs = []
+    for gains in gains_table.values():
+        for total_gain in gains[2:]:
+            inputs.append((total_gain, [total_gain] * 5))
+            inputs.append(
+                (total_gain, [rng.randint(0, 60) for _ in range(5)]))
+    for _ in range(cases):
+        total_gain = rng.randint(-5, 300)
+        high = rng.choice([3, 30, 300])
+        inputs.append(
+            (total_gain, [rng.randint(-2, high) for _ in range(5)]))
+
+    passed = True
+    for total_gain, caps in inputs:
+        expected = _reference_distribute_gain(total_gain, caps)
+        actual = distribute_gain(total_gain, caps)
+        if actual != expected:
+            print(f'MISMATCH for {total_gain}, {caps}: '
+                  f'{actual} != {expected}')
+            passed = False
+    print(f'{len(inputs)} inputs {"OK" if passed else "failed"}')
+
+    for name, f in [('Reference', _reference_distribute_gain),
+                    ('Direct', distribute_gain)]:
+        start = time.perf_counter()
+        for total_gain, caps in inputs:
+            f(total_gain, caps)
+        seconds = time.perf_counter() - start
+        print(f'{name}: {seconds / len(inputs) * 1e6:.2f} us/call')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Verify and benchmark the gain distribution.')
+    parser.add_argument('--cases', type=int, default=100_000,
+                        help='number of random inputs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random number generator')
+    args = parser.parse_args()
+    raise SystemExit(0 if verify(args.cases, args.seed) else 1)
@@ -3,12 +3,12 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select, update
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import (LastUpdateDate, Mission, MstBirthdayCalendar,
-                                MstMission, Present, User)
+                                MstMission, Present)
 from mltd.models.schemas import LoginBonusScheduleSchema, MissionSchema
+from mltd.models.session_scope import request_session
+from mltd.models.statements import select_user
 from mltd.servers.config import config
 from mltd.servers.i18n import translation
 from mltd.services.birthday import get_birthday_entrance_direction_resource
@@ -178,10 +178,9 @@ def execute_login_bonus(params, context):
         'updated_idol_list': None
     }
 
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
 
         now = datetime.now(timezone.utc)
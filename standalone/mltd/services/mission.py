@@ -5,13 +5,14 @@ from jsonrpc import dispatcher
 from sqlalchemy import and_, or_, select, update
 from sqlalchemy.orm import Session, contains_eager
 
-from mltd.models.engine import engine
+from mltd.models.fast_schemas import compile_schema
 from mltd.models.models import (Mission, MstMission, MstMissionSchedule,
                                 MstPanelMissionSheet, PanelMissionSheet,
                                 Present, Song, User)
 from mltd.models.schemas import (MissionSchema, MstMissionScheduleSchema,
                                  MstPanelMissionSheetSchema,
                                  PanelMissionSheetSchema, SongSchema)
+from mltd.models.session_scope import request_session
 from mltd.servers.i18n import translation
 from mltd.services.idol import localize_character_name
 from mltd.services.present import add_present
@@ -496,7 +497,7 @@ def get_mission_list(params, context):
                          of the method 'AuthService.Login' for the dict
                          definition.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         mission_type_list = params['mission_type_list']
         mst_mission_schedules = session.scalars(
             select(MstMissionSchedule)
@@ -528,9 +529,9 @@ def get_mission_list(params, context):
 
         mission_schedule_schema = MstMissionScheduleSchema()
         panel_mission_sheet_schema = MstPanelMissionSheetSchema()
-        mission_schema = MissionSchema()
+        mission_schema = compile_schema(MissionSchema)
         mission_summary_schema = PanelMissionSheetSchema()
-        song_schema = SongSchema()
+        song_schema = compile_schema(SongSchema)
 
         mission_schedule_list = mission_schedule_schema.dump(
             mst_mission_schedules, many=True)
@@ -4,12 +4,12 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import and_, or_, select
-from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy.orm import contains_eager
 
-from mltd.models.engine import engine
 from mltd.models.models import (Idol, MstIdol, MstOffer, MstOfferText, Offer,
                                 OfferSummary, OfferText)
 from mltd.models.schemas import OfferSchema
+from mltd.models.session_scope import request_session
 
 
 @dispatcher.add_method(name='OfferService.GetOfferList', context_arg='context')
@@ -81,7 +81,7 @@ def get_offer_list(params, context):
                                for this offer.
     """
     user_id = UUID(context['user_id'])
-    with Session(engine) as session:
+    with request_session() as session:
         concurrency_max_count = session.scalars(
             select(OfferSummary.concurrency_max_count)
             .where(OfferSummary.user_id == user_id)
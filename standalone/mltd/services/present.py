@@ -9,10 +9,11 @@ from jsonrpc import dispatcher
 from sqlalchemy import and_, delete, func, or_, select, update
 from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
+from mltd.models.fast_schemas import compile_schema
 from mltd.models.models import (Achievement, Item, LastUpdateDate, MstItem,
                                 Present, User)
 from mltd.models.schemas import PresentSchema
+from mltd.models.session_scope import request_session
 from mltd.servers.config import config
 from mltd.servers.logging import logger
 
@@ -92,7 +93,7 @@ def get_present_count(params, context):
         number of presents in user's present box. If the user has more
         than 100 presents, this value is set to 100.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         value = session.scalar(
             select(func.count(Present.present_id))
             .where(Present.user_id == UUID(context['user_id']))
@@ -167,7 +168,7 @@ def get_present_list(params, context):
                 next 100 items (an empty string if no items left).
     """
     user_id = UUID(context['user_id'])
-    with Session(engine) as session:
+    with request_session() as session:
         session.execute(
             delete(Present)
             .where(Present.user_id == user_id)
@@ -258,7 +259,7 @@ def get_present_list(params, context):
         present_stmt = present_stmt.limit(params['limit'])
         presents = session.scalars(present_stmt).all()
 
-        present_schema = PresentSchema()
+        present_schema = compile_schema(PresentSchema)
         present_list = present_schema.dump(presents, many=True)
 
         cursor = ''
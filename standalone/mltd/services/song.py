@@ -2,13 +2,15 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
-from mltd.models.models import (Course, MstCourseReward, MstRewardItem,
-                                MstScoreThreshold, Song)
-from mltd.models.schemas import CourseSchema, MstRewardItemSchema, SongSchema
+from mltd.models.models import (MstCourseReward, MstRewardItem,
+                                MstScoreThreshold)
+from mltd.models.schemas import CourseSchema, MstRewardItemSchema
+from mltd.models.session_scope import request_session
+from mltd.models.statements import select_course
 from mltd.servers.i18n import translation
+from mltd.services import fragments
+from mltd.services.list_cache import list_cache
 
 _ = translation.gettext
 
@@ -145,6 +147,7 @@ def localize_song_name(mst_song_id):
 
 
 @dispatcher.add_method(name='SongService.GetSongList', context_arg='context')
+@list_cache.cached('song', 'course')
 def get_song_list(params, context):
     """Service for getting a list of all songs.
 
@@ -306,14 +309,9 @@ def get_song_list(params, context):
             song_parts_type: 1 for songs with partially separate vocals.
                              0 for everything else.
     """
-    with Session(engine) as session:
-        songs = session.scalars(
-            select(Song)
-            .where(Song.user_id == UUID(context['user_id']))
-        ).all()
-
-        song_schema = SongSchema()
-        song_list = song_schema.dump(songs, many=True)
+    with request_session() as session:
+        song_list = fragments.get_song_list(session,
+                                            UUID(context['user_id']))
 
     return {'song_list': song_list}
 
@@ -341,13 +339,11 @@ def get_course(params, context):
                            definition. All mission statuses are either
                            0 or 1.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         course_id = params['course']
         course = session.scalars(
-            select(Course)
-            .where(Course.user_id == UUID(context['user_id']))
-            .where(Course.mst_song_id == params['mst_song_id'])
-            .where(Course.course_id == course_id)
+            select_course(UUID(context['user_id']), params['mst_song_id'],
+                          course_id)
         ).one()
         course_schema = CourseSchema()
         course_dict = course_schema.dump(course)
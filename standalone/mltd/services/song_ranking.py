@@ -4,11 +4,11 @@ from datetime import datetime, timezone
 
 from jsonrpc import dispatcher
 from sqlalchemy import and_, or_, select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import Course, Profile
 from mltd.models.schemas import GuestSchema
+from mltd.models.session_scope import request_session
+from mltd.models.shards import shard_router
 
 
 @dispatcher.add_method(name='SongRankingService.GetSongRanking')
@@ -47,7 +47,7 @@ def get_song_ranking(params):
         cursor: Pagination cursor for the next invocation to fetch the
                 next top 20 scores.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         ranking_stmt = (
             select(Course.score, Course.score_update_date, Profile)
             .join(Profile, Course.user_id == Profile.id_)
@@ -71,12 +71,19 @@ def get_song_ranking(params):
             .order_by(Course.score.desc(), Course.score_update_date)
             .limit(20)
         )
-        result = session.execute(ranking_stmt).all()
+        guest_schema = GuestSchema()
+
+        def fetch_scores(shard_session):
+            return [(score, score_update_date, guest_schema.dump(profile))
+                    for score, score_update_date, profile
+                    in shard_session.execute(ranking_stmt)]
+
+        # Merge the top scores of each shard.
+        result = sorted(shard_router.scatter(session, fetch_scores),
+                        key=lambda x: (-x[0], x[1]))[:20]
 
         song_score_list = []
-        guest_schema = GuestSchema()
-        for score, _, profile in result:
-            user_summary = guest_schema.dump(profile)
+        for score, _, user_summary in result:
             user_summary['is_friend'] = False
             song_score_list.append({
                 'score': score,
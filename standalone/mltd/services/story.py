@@ -3,15 +3,14 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import func, select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
 from mltd.models.models import (MainStoryChapter, MstMainStoryContactStatus,
                                 MstTopics, MstWhiteBoard, SpecialStory)
 from mltd.models.schemas import (MainStoryChapterSchema,
                                  MstMainStoryContactStatusSchema,
                                  MstTopicsSchema, MstWhiteBoardSchema,
                                  SpecialStorySchema)
+from mltd.models.session_scope import request_session
 from mltd.servers.config import config
 from mltd.servers.utilities import format_datetime
 
@@ -102,7 +101,7 @@ def get_story_list(params, context):
                     mst_event_id: 0.
             duration: Duration of this theater contact.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         main_story_chapters = session.scalars(
             select(MainStoryChapter)
             .where(MainStoryChapter.user_id == UUID(context['user_id']))
@@ -155,7 +154,7 @@ def get_topics_list(params):
                     secretary/theater per category.
             release_date: Release date of this topic.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         recent_release_date = session.scalar(
             select(func.max(MstTopics.release_date))
         )
@@ -200,7 +199,7 @@ def get_white_board_list(params):
             begin_date: Same as 'display_date'.
             end_date: '2099-12-31T23:59:59+0800'.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         recent_begin_date = session.scalar(
             select(func.max(MstWhiteBoard.begin_date))
         )
@@ -283,7 +282,7 @@ def get_special_story_list(params, context):
             begin_date: Date when this special story becomes available.
             end_date: Date when this special story becomes unavailable.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         special_stories = session.scalars(
             select(SpecialStory)
             .where(SpecialStory.user_id == UUID(context['user_id']))
@@ -2,15 +2,16 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
-from mltd.models.models import (Card, MstCard, MstLessonWear, SongUnit, Unit,
-                                User)
+from mltd.models.models import Card, MstCard, MstLessonWear, SongUnit, Unit
 from mltd.models.schemas import SongUnitSchema, UnitSchema
+from mltd.models.session_scope import request_session
+from mltd.models.statements import select_user
+from mltd.services.list_cache import list_cache
 
 
 @dispatcher.add_method(name='UnitService.GetUnitList', context_arg='context')
+@list_cache.cached('unit', 'unit_idol')
 def get_unit_list(params, context):
     """Service for getting a list of user-defined units.
 
@@ -38,7 +39,7 @@ def get_unit_list(params, context):
                                    selected for each live performance.
                 costume_random_type: 0.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         units = session.scalars(
             select(Unit)
             .where(Unit.user_id == UUID(context['user_id']))
@@ -93,10 +94,9 @@ def set_unit(params, context):
         mission_process: Empty info. See the implementation below.
         mission_list: An empty list.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
 
         card_ids = set()
@@ -173,7 +173,7 @@ def get_song_unit_list(params, context):
             is_new: Whether the user has never made any changes to this
                     song unit.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         song_units = session.scalars(
             select(SongUnit)
             .where(SongUnit.user_id == UUID(context['user_id']))
@@ -218,7 +218,7 @@ def set_song_unit(params, context):
         See the return value 'song_unit_list' of the method
         'UnitService.GetSongUnitList' for the dict definition.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         song_unit = session.scalars(
             select(SongUnit)
             .where(SongUnit.user_id == UUID(context['user_id']))
@@ -3,12 +3,13 @@ from uuid import UUID
 
 from jsonrpc import dispatcher
 from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from mltd.models.engine import engine
-from mltd.models.models import Profile, RecordTime, User
-from mltd.models.schemas import (PendingJobSchema, PendingSongSchema,
-                                 ProfileSchema, RecordTimeSchema, UserSchema)
+from mltd.models.models import Profile, RecordTime
+from mltd.models.schemas import (PendingJobSchema, ProfileSchema,
+                                 RecordTimeSchema, UserSchema)
+from mltd.models.session_scope import request_session
+from mltd.models.statements import select_user
+from mltd.services.live import dump_pending_song
 
 
 @dispatcher.add_method(name='UserService.GetSelf', context_arg='context')
@@ -25,10 +26,9 @@ def get_self(params, context):
         A dict containing user info. See the return value 'user' of
         AuthService.Login method for the definition.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']))
         ).one()
 
         user_schema = UserSchema()
@@ -98,7 +98,7 @@ def get_self_profile(params, context):
             live_course: Course ID (1-6).
             count: Number of songs full comboed for this course.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         profile = session.scalars(
             select(Profile)
             .where(Profile.id_ == UUID(context['user_id']))
@@ -128,7 +128,7 @@ def get_record_time_list(params, context):
             kind: A string representing the kind of action performed.
             time: The time when the user performed this action.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         record_times = session.scalars(
             select(RecordTime)
             .where(RecordTime.user_id == UUID(context['user_id']))
@@ -158,7 +158,7 @@ def record_time(params, context):
         the action. See the return value 'record_time_list' of the
         method 'UserService.GetRecordTimeList' for the dict definition.
     """
-    with Session(engine) as session:
+    with request_session() as session:
         record_time = RecordTime(
             user_id=UUID(context['user_id']),
             kind=params['kind'],
@@ -492,10 +492,9 @@ def get_pending_data(params, context):
         }
     }
 
-    with Session(engine) as session:
+    with request_session() as session:
         user = session.scalars(
-            select(User)
-            .where(User.user_id == UUID(context['user_id']))
+            select_user(UUID(context['user_id']), 'user-core')
         ).one()
         if user.pending_song:
             start_date = user.pending_song.start_date.replace(
@@ -503,9 +502,8 @@ def get_pending_data(params, context):
             if start_date + timedelta(days=1) <= datetime.now(timezone.utc):
                 user.pending_song.is_expired = True
 
-            pending_song_schema = PendingSongSchema()
-            result['pending_song'] = pending_song_schema.dump(
-                user.pending_song)
+            result['pending_song'] = dump_pending_song(session,
+                                                       user.pending_song)
 
             if params['live_token'] != user.pending_song.live_token:
                 # Game and server live_tokens do not match if different